@@ -13,6 +13,7 @@ import numpy as np
 from matplotlib import pyplot as plt
 from scipy import interpolate
 from scipy import optimize
+from scipy.sparse import csr_matrix
 # =============================================================================
 # Astropy and associated packages
 # =============================================================================
@@ -210,6 +211,131 @@ def flux_conserving_interpolation(new_wavelength, wavelength, spectra, **interp_
     return new_spectra
 
 
+def _wavelength_edges(wavelength):
+    """Compute the pixel edges along the last axis of a wavelength array."""
+    dwave = np.diff(wavelength, axis=-1)
+    return np.concatenate((wavelength[..., :1] - dwave[..., :1] / 2,
+                           wavelength[..., :-1] + dwave / 2,
+                           wavelength[..., -1:] + dwave[..., -1:] / 2),
+                          axis=-1)
+
+
+def flux_conserving_operator(new_wavelength, wavelength):
+    """Sparse operator of the flux-conserving linear interpolation.
+
+    Each new pixel is the average of the old pixels weighted by their overlap,
+    which is equivalent to `flux_conserving_interpolation` (using the default
+    extrapolation of `np.interp`).
+
+    Parameters
+    ----------
+    new_wavelength : ndarray
+        New wavelength grid, either common to every row (1D) or a grid per
+        row with dimensions (n_rows, n_new).
+    wavelength : ndarray
+        Old wavelength grid, either common to every row (1D) or a grid per
+        row with dimensions (n_rows, n_old).
+
+    Returns
+    -------
+    operator : scipy.sparse.csr_matrix
+        If both grids are 1D, a (n_new, n_old) matrix. Otherwise, a block
+        diagonal (n_rows * n_new, n_rows * n_old) matrix that acts on the
+        flattened spectra.
+    """
+    new_wavelength = np.asarray(new_wavelength, dtype=float)
+    wavelength = np.asarray(wavelength, dtype=float)
+    n_new, n_old = new_wavelength.shape[-1], wavelength.shape[-1]
+    new_edges = np.atleast_2d(_wavelength_edges(new_wavelength))
+    edges = np.atleast_2d(_wavelength_edges(wavelength))
+    n_rows = max(new_edges.shape[0], edges.shape[0])
+    new_edges = np.broadcast_to(new_edges, (n_rows, n_new + 1))
+    edges = np.broadcast_to(edges, (n_rows, n_old + 1))
+    # Flux outside the old grid is lost (as np.interp clamps the cumulative)
+    clipped_edges = np.clip(new_edges, edges[:, :1], edges[:, -1:])
+    lower, upper = clipped_edges[:, :-1], clipped_edges[:, 1:]
+    # Search every row at once by shifting each row to a disjoint range
+    row_offset = (np.arange(n_rows) * (
+        np.max(edges) - np.min(edges) + 1.))[:, np.newaxis]
+    flat_edges = (edges + row_offset).ravel()
+    first_edge = (np.arange(n_rows) * (n_old + 1))[:, np.newaxis]
+    first_pix = np.searchsorted(flat_edges, (lower + row_offset).ravel(),
+                                side='right').reshape(lower.shape) - 1
+    last_pix = np.searchsorted(flat_edges, (upper + row_offset).ravel(),
+                               side='left').reshape(upper.shape) - 1
+    first_pix = np.clip(first_pix - first_edge, 0, n_old - 1)
+    last_pix = np.clip(last_pix - first_edge, 0, n_old - 1)
+    # Every (new pixel, old pixel) pair that may overlap
+    counts = np.maximum(last_pix - first_pix + 1, 0).ravel()
+    entry_row = np.repeat(np.arange(counts.size), counts)
+    entry_start = np.repeat(np.cumsum(counts) - counts, counts)
+    old_pix = (np.repeat(first_pix.ravel(), counts)
+               + np.arange(entry_row.size) - entry_start)
+    row = entry_row // n_new
+    overlap = (np.minimum(upper.ravel()[entry_row], edges[row, old_pix + 1])
+               - np.maximum(lower.ravel()[entry_row], edges[row, old_pix]))
+    weights = np.clip(overlap, 0, None) / np.diff(new_edges, axis=1).ravel()[
+        entry_row]
+    if new_wavelength.ndim == 1 and wavelength.ndim == 1:
+        shape = (n_new, n_old)
+        columns = old_pix
+    else:
+        shape = (n_rows * n_new, n_rows * n_old)
+        columns = old_pix + row * n_old
+    return csr_matrix((weights, (entry_row, columns)), shape=shape)
+
+
+def flux_conserving_interpolation_2d(new_wavelength, wavelength, spectra,
+                                     variance=None, operator=None):
+    """Flux-conserving linear interpolation of a set of spectra.
+
+    Batched version of `flux_conserving_interpolation` that also propagates
+    the variance. Every row of `spectra` is resampled at once using a sparse
+    operator (see `flux_conserving_operator`), that can be precomputed and
+    reused for data sharing the same wavelength grids.
+
+    `np.nan` values become zero.
+
+    Parameters
+    ----------
+    new_wavelength : ndarray
+        New wavelength grid, either common to every row (1D) or a grid per
+        row (e.g. the original grid shifted by a per-row offset).
+    wavelength : ndarray
+        Old wavelength grid, either common to every row (1D) or a grid per
+        row.
+    spectra : ndarray
+        (n_rows, n_old) spectra.
+    variance : ndarray, optional
+        (n_rows, n_old) variance of the spectra.
+    operator : scipy.sparse.csr_matrix, optional
+        Precomputed operator. If provided, the wavelength grids are ignored.
+
+    Returns
+    -------
+    new_spectra : ndarray
+        (n_rows, n_new) interpolated spectra.
+    new_variance : ndarray or None
+        (n_rows, n_new) propagated variance, if `variance` is provided.
+    """
+    if operator is None:
+        operator = flux_conserving_operator(new_wavelength, wavelength)
+    spectra = np.asarray(spectra)
+    n_rows = spectra.shape[0]
+    shared_grid = operator.shape[1] == spectra.shape[1]
+
+    def resample(data, op):
+        data = np.where(np.isnan(data), 0, data)
+        if shared_grid:
+            return (op @ data.T).T
+        return (op @ data.ravel()).reshape(n_rows, -1)
+
+    new_spectra = resample(spectra, operator)
+    if variance is None:
+        return new_spectra, None
+    return new_spectra, resample(np.asarray(variance), operator.power(2))
+
+
 def centre_of_mass(w, x, y):
     """Compute the centre of mass of a given image.
     Parameters
@@ -235,6 +361,78 @@ def centre_of_mass(w, x, y):
             .format(w, x, y))
 
 
+def _reduce_last_axis(stat, data):
+    """Apply `stat` along the last axis of `data`.
+
+    Functions that do not accept the `axis` keyword are applied to each
+    1D slice with `np.apply_along_axis`.
+    """
+    try:
+        return stat(data, axis=-1)
+    except TypeError:
+        return np.apply_along_axis(stat, -1, data)
+
+
+def spectral_centre_of_mass(data, positions, power=1.0, wavelength_step=1,
+                            stat=np.nanmedian):
+    """Compute the centre of mass at every wavelength for several powers.
+
+    The weighted sums of all powers are computed as matrix products in a
+    single pass over the data.
+
+    Parameters
+    ----------
+    data: np.ndarray(float)
+        (n, n_wave) intensity of each spatial element (fibre or spaxel).
+    positions: np.ndarray(float)
+        (n_axes, n) coordinates of each spatial element.
+    power: float or iterable, default=1.0
+        Power(s) of the intensity used as weights.
+    wavelength_step: int, default=1
+        Number of wavelength points of each bin. The COM of every point
+        within a bin is replaced by `stat` over the bin.
+    stat: function, default=np.nanmedian
+        Function used to combine the COM within each wavelength bin. If it
+        accepts the `axis` keyword, it is called once for all bins;
+        otherwise, it is applied to each bin with `np.apply_along_axis`.
+
+    Returns
+    -------
+    com: np.ndarray(float)
+        (n_power, n_axes, n_wave) centre of mass, or (n_axes, n_wave) if a
+        single power is provided.
+    """
+    powers = np.atleast_1d(power)
+    positions = np.atleast_2d(positions)
+    n_wave = data.shape[1]
+    # Coordinates and normalization computed with the same product
+    positions = np.vstack((positions, np.ones(positions.shape[1])))
+    com = np.empty((powers.size, positions.shape[0] - 1, n_wave))
+    powered_data = None
+    for i, p in enumerate(powers):
+        if i > 0 and p == powers[i - 1] + 1:
+            # Reuse the previous power
+            powered_data *= data
+        else:
+            powered_data = data ** p
+        sums = positions @ np.where(np.isnan(powered_data), 0, powered_data)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            com[i] = sums[:-1] / sums[-1]
+
+    if wavelength_step > 1:
+        n_full = n_wave // wavelength_step * wavelength_step
+        binned = com[..., :n_full].reshape(
+            *com.shape[:-1], -1, wavelength_step)
+        com[..., :n_full] = np.repeat(_reduce_last_axis(stat, binned),
+                                      wavelength_step, axis=-1)
+        if n_full < n_wave:
+            com[..., n_full:] = _reduce_last_axis(
+                stat, com[..., n_full:])[..., np.newaxis]
+    if np.ndim(power) == 0:
+        return com[0]
+    return com
+
+
 def growth_curve_1d(f, x, y):
     """TODO"""
     r2 = x**2 + y**2
@@ -566,6 +764,59 @@ def pixel_in_circle(pixel_pos, pixel_size, circle_pos, circle_radius):
         area_pixel = pixel_size**2
     area_fraction = area_pixel / (circle_area + 1e-100)
     return area_pixel, area_fraction
+
+
+def _circle_quadrant_area(x, y, circle_radius):
+    """Signed area of a circle centred at the origin within [0, x] x [0, y]."""
+    sign = np.sign(x) * np.sign(y)
+    x = np.minimum(np.abs(x), circle_radius)
+    y = np.abs(y)
+    r2 = circle_radius**2
+
+    def primitive(t):
+        # Integral of sqrt(r^2 - t^2) from 0 to t
+        return 0.5 * (t * np.sqrt(np.clip(r2 - t**2, 0, None))
+                      + r2 * np.arcsin(np.clip(t / circle_radius, -1, 1)))
+
+    # Abscissa where the circle crosses the horizontal line at height y
+    t_cross = np.sqrt(np.clip(r2 - y**2, 0, None))
+    area = np.where(
+        x <= t_cross, x * y,
+        y * t_cross + primitive(x) - primitive(t_cross))
+    return sign * area
+
+
+def circle_rectangle_overlap(x_min, x_max, y_min, y_max, circle_pos=(0, 0),
+                             circle_radius=1.):
+    """Compute the area of a set of rectangles within a circle.
+
+    Vectorised (exact) computation of the overlap area between a circle and
+    axis-aligned rectangles. All rectangle limits are broadcasted against
+    each other, so that a full grid of pixels can be computed in one call.
+
+    Parameters
+    ----------
+    - x_min, x_max: np.ndarray or float
+        Limits of the rectangles along the first axis.
+    - y_min, y_max: np.ndarray or float
+        Limits of the rectangles along the second axis.
+    - circle_pos: tuple, default=(0, 0)
+        Position of the circle centre.
+    - circle_radius: float, default=1.
+        Radius of the circle.
+
+    Returns
+    -------
+    - area: np.ndarray
+        Area of each rectangle contained within the circle.
+    """
+    x_min, x_max = x_min - circle_pos[0], x_max - circle_pos[0]
+    y_min, y_max = y_min - circle_pos[1], y_max - circle_pos[1]
+    area = (_circle_quadrant_area(x_max, y_max, circle_radius)
+            - _circle_quadrant_area(x_min, y_max, circle_radius)
+            - _circle_quadrant_area(x_max, y_min, circle_radius)
+            + _circle_quadrant_area(x_min, y_min, circle_radius))
+    return area
 # ----------------------------------------------------------------------------------------------------------------------
 # Models and fitting
 # ----------------------------------------------------------------------------------------------------------------------
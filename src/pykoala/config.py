@@ -0,0 +1,113 @@
+"""
+Global configuration options of PyKOALA.
+
+The floating point precision used to store the intensity and variance of
+DataContainers (and the individual cubes created during the cubing process)
+can be set with `set_float_dtype`. Single precision (``np.float32``) halves
+the memory footprint of the data, while accumulators that require extra
+precision (e.g. running sums) keep using `ACCUMULATION_DTYPE`.
+
+Data products that are expensive to build (e.g. the merged sky line library)
+are cached in the directory returned by `get_cache_dir`, which can be set
+with the ``PYKOALA_CACHE_DIR`` environment variable.
+
+Example
+-------
+>>> import numpy as np
+>>> from pykoala import config
+>>> config.set_float_dtype(np.float32)
+"""
+# =============================================================================
+# Basics packages
+# =============================================================================
+import os
+import numpy as np
+
+# Floating point type used to store intensity and variance arrays. If None,
+# arrays are stored using their input type.
+_float_dtype = None
+# Floating point type used for accumulations that require extra precision
+ACCUMULATION_DTYPE = np.float64
+
+
+def set_float_dtype(dtype=None):
+    """Set the floating point type used to store intensity and variance arrays.
+
+    Parameters
+    ----------
+    - dtype: np.dtype or str, default=None
+        Floating point type (e.g. ``np.float32`` or ``np.float64``). If None,
+        arrays are stored using their input type.
+    """
+    global _float_dtype
+    if dtype is None:
+        _float_dtype = None
+        return
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'f':
+        raise ValueError(f"Input dtype {dtype} is not a floating point type")
+    _float_dtype = dtype
+
+
+def get_float_dtype(default=None):
+    """Return the floating point type used to store intensity and variance.
+
+    Parameters
+    ----------
+    - default: np.dtype, default=None
+        Type returned if no floating point type has been set.
+
+    Returns
+    -------
+    - dtype: np.dtype
+    """
+    if _float_dtype is None:
+        return default
+    return _float_dtype
+
+
+def as_float_array(array):
+    """Cast an array to the floating point type set by `set_float_dtype`.
+
+    The input array is returned without copying if no type has been set, if
+    it is not a numerical array, or if it already has the same precision
+    (regardless of its byte order).
+
+    Parameters
+    ----------
+    - array: np.ndarray or None
+        Input array.
+
+    Returns
+    -------
+    - array: np.ndarray or None
+    """
+    if array is None or _float_dtype is None:
+        return array
+    array_dtype = getattr(array, 'dtype', None)
+    if array_dtype is None:
+        return np.asarray(array, dtype=_float_dtype)
+    if array_dtype.kind not in 'fiu':
+        return array
+    if array_dtype.kind == 'f' and array_dtype.itemsize == _float_dtype.itemsize:
+        return array
+    return array.astype(_float_dtype)
+
+
+def get_cache_dir():
+    """Return the directory used to cache PyKOALA data products.
+
+    The directory is given by the ``PYKOALA_CACHE_DIR`` environment variable
+    or, if not set, by ``$XDG_CACHE_HOME/pykoala`` (``~/.cache/pykoala``).
+    The directory is not created by this function.
+
+    Returns
+    -------
+    - cache_dir: str
+    """
+    cache_dir = os.environ.get("PYKOALA_CACHE_DIR")
+    if cache_dir:
+        return os.path.expanduser(cache_dir)
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "pykoala")
@@ -4,7 +4,6 @@
 from scipy import interpolate
 from matplotlib import pyplot as plt
 import numpy as np
-import copy
 import os
 
 # =============================================================================
@@ -76,9 +75,20 @@ class AtmosphericExtCorrection(CorrectionBase):
         extinction_correction = np.interp(wavelength, self.extinction_correction_wave, self.extinction_correction)
         return 10**(0.4 * airmass * extinction_correction)
 
-    def apply(self, data_container, force_airmass=None, plot=False):
-        """Apply the Extinction Correction to a DataContainer"""
-        data_container_out = copy.deepcopy(data_container)
+    def apply(self, data_container, force_airmass=None, plot=False,
+              inplace=None):
+        """Apply the Extinction Correction to a DataContainer
+
+        If `inplace` is True, the input DataContainer is modified (see
+        `CorrectionBase.get_output_container`).
+        """
+        extinction, log_comments = self.get_correction_factor(
+            data_container, force_airmass=force_airmass)
+        return self.apply_correction_factor(data_container, extinction,
+                                            inplace, **log_comments)
+
+    def get_correction_factor(self, data_container, force_airmass=None):
+        """Return the extinction correction factor (see `CorrectionBase`)."""
         if force_airmass is None:
             airmass = data_container.info['airmass']
         else:
@@ -86,7 +96,7 @@ class AtmosphericExtCorrection(CorrectionBase):
 
         if self.extinction_correction is not None:
             self.corr_print(f"Applying model-based extinction correction to Data Container ({airmass:.2f} airmass)")
-            extinction = self.extinction(data_container_out.wavelength, airmass)
+            extinction = self.extinction(data_container.wavelength, airmass)
             if self.model_from_file:
                 comment = ' '.join(["- Data corrected for extinction using file :",
                                     self.extinction_file, f"| airmass={airmass:.2f}"])
@@ -96,17 +106,11 @@ class AtmosphericExtCorrection(CorrectionBase):
         else:
             raise AttributeError("Extinction correction not provided")
 
-        # Apply the correction
         if type(data_container) is Cube:
             extinction = np.expand_dims(extinction, axis=tuple(range(1, data_container.intensity.ndim)))
         elif type(data_container) is RSS:
             extinction = np.expand_dims(extinction, axis=0)
-
-        data_container_out.intensity *= extinction
-        data_container_out.variance *= extinction**2
-        self.log_correction(data_container_out, status='applied',
-                            comment=comment)
-        return data_container_out
+        return extinction, dict(comment=comment)
 
 
 # =============================================================================
@@ -116,10 +120,9 @@ class AtmosphericExtCorrection(CorrectionBase):
 def get_adr(data_container, max_adr=0.5, pol_deg=2, plot=False):
     """Computes the ADR for a given DataContainer."""
     # Centre of mass using multiple power of the intensity
-    com = []
-    for i in range(1, 5):
-        com.append(data_container.get_centre_of_mass(power=i))
-    com = np.array(com) * 3600
+    com = np.array(data_container.get_centre_of_mass(power=[1, 2, 3, 4]))
+    # Dimensions (power, axis, wavelength)
+    com = np.swapaxes(com, 0, 1) * 3600
     com -= np.nanmedian(com, axis=2)[:, :, np.newaxis]
     median_com = np.nanmedian(
         com, axis=0) - np.nanmedian(com, axis=(0, 2))[:, np.newaxis]
@@ -1,6 +1,8 @@
 """
 Parent CorrectionBase class
 """
+import numpy as np
+
 from pykoala.exceptions.exceptions import CorrectionClassError
 from abc import ABC, abstractmethod
 
@@ -8,7 +10,16 @@ from abc import ABC, abstractmethod
 class CorrectionBase(ABC):
     """
     Base class of an astronomical correction to a given data (RSS or CUBE).
+
+    Attributes
+    ----------
+    - inplace: bool, default=False
+        If True, `apply` modifies the input DataContainer instead of returning
+        a copy. Setting `CorrectionBase.inplace = True` enables this mode for
+        every correction of the pipeline, while setting it on an instance
+        only affects that correction.
     """
+    inplace = False
 
     @property
     @abstractmethod
@@ -32,6 +43,74 @@ class CorrectionBase(ABC):
     def apply(self):
         raise NotImplementedError("Each class needs to implement this method")
 
+    def get_output_container(self, data_container, inplace=None):
+        """Return the DataContainer where the correction will be applied.
+
+        Unless the correction is applied in place, the output is a copy of
+        the input that shares its intensity and variance arrays (see
+        `DataContainer.copy`). Therefore, corrections must assign new arrays
+        to the output instead of modifying them in place.
+
+        Parameters
+        ----------
+        - data_container: koala.DataContainer
+            Input DC.
+        - inplace: bool, default=None
+            If None, the value of the `inplace` attribute is used.
+
+        Returns
+        -------
+        - data_container_out: koala.DataContainer
+        """
+        if inplace is None:
+            inplace = self.inplace
+        if inplace:
+            return data_container
+        return data_container.copy(share_data=True)
+
+    def get_correction_factor(self, data_container, **kwargs):
+        """Return the multiplicative factor of the correction.
+
+        Multiplicative corrections multiply the intensity by a factor, and
+        the variance by its square. These corrections can be combined into a
+        single pass over the data using a `CorrectionPlan`.
+
+        Parameters
+        ----------
+        - data_container: koala.DataContainer
+            DC to be corrected.
+        - kwargs:
+            Additional arguments of the correction.
+
+        Returns
+        -------
+        - factor: np.ndarray or None
+            Array that can be broadcast to the intensity of the DC. If None,
+            the correction must not be applied.
+        - log_comments: dict
+            Additional comments passed to `log_correction`.
+        """
+        raise NotImplementedError(
+            f"{self.name} is not a multiplicative correction")
+
+    def apply_correction_factor(self, data_container, factor, inplace=None,
+                                **log_comments):
+        """Multiply the intensity (variance) of a DC by a factor (squared).
+
+        See `get_correction_factor` and `get_output_container`.
+
+        Returns
+        -------
+        - data_container_out: koala.DataContainer
+            Corrected DC.
+        """
+        data_container_out = self.get_output_container(data_container, inplace)
+        data_container_out.intensity = data_container_out.intensity * factor
+        data_container_out.variance = data_container_out.variance * factor**2
+        self.log_correction(data_container_out, status='applied',
+                            **log_comments)
+        return data_container_out
+
     def corr_print(self, msg, *args):
         """Print a message."""
         if self.verbose:
@@ -59,4 +138,199 @@ class CorrectionBase(ABC):
         for (k, v) in extra_comments.items():
             datacontainer.log(self.name, k + " " + str(v), tag='correction')
 
-        
+
+def expand_spectral_dims(spectral_array, data_container):
+    """Reshape a function of wavelength to match the data dimensions.
+
+    Parameters
+    ----------
+    - spectral_array: np.ndarray
+        Array defined along the wavelength axis of the DataContainer.
+    - data_container: koala.DataContainer
+        DC (RSS or Cube) whose intensity will be combined with the array.
+
+    Returns
+    -------
+    - array: np.ndarray
+        View of the input array that can be broadcast to the intensity.
+    """
+    if data_container.intensity.ndim == 3:
+        # Cubes store the wavelength along the first axis
+        return spectral_array[:, np.newaxis, np.newaxis]
+    return spectral_array[np.newaxis, :]
+
+
+def fibre_array(data=None, poly=None, n_wavelength=None, expand=False):
+    """Evaluate a (possibly compact) function of fibre and wavelength.
+
+    Fibre-based products (e.g. throughput or wavelength offset) can be
+    stored as a full 2D array (n_fibres x n_wavelength), as one value per
+    fibre, or as per-fibre polynomials of the normalised pixel coordinate
+    (from -1 to 1 along the wavelength axis).
+
+    Parameters
+    ----------
+    - data: np.ndarray, default=None
+        Either a 2D array, or a 1D array with one value per fibre.
+    - poly: np.ndarray, default=None
+        Polynomial coefficients of each fibre (increasing order), with
+        shape (n_fibres, deg + 1). Used if `data` is None.
+    - n_wavelength: int, default=None
+        Number of wavelength pixels. Required to evaluate polynomials or to
+        expand compact arrays.
+    - expand: bool, default=False
+        If True, return a (read-only) view with shape
+        (n_fibres, n_wavelength). Otherwise, the result can have a single
+        wavelength element to be applied by broadcasting.
+
+    Returns
+    -------
+    - array: np.ndarray or None
+    """
+    if data is None and poly is None:
+        return None
+    if data is None:
+        if n_wavelength is None:
+            raise ValueError("The number of wavelength pixels is required to"
+                             " evaluate the polynomials")
+        return np.polynomial.polynomial.polyval(
+            np.linspace(-1, 1, n_wavelength), np.asarray(poly).T)
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    if expand and data.shape[1] == 1:
+        if n_wavelength is None:
+            raise ValueError("The number of wavelength pixels is required to"
+                             " expand the array")
+        data = np.broadcast_to(data, (data.shape[0], n_wavelength))
+    return data
+
+
+def compact_fibre_array(data):
+    """Return a compact version of broadcast (constant along wavelength) views.
+
+    Arrays that do not change along the wavelength axis because they are
+    broadcast views (null stride) are reduced to one value per fibre.
+
+    Parameters
+    ----------
+    - data: np.ndarray or None
+
+    Returns
+    -------
+    - data: np.ndarray or None
+    - n_wavelength: int or None
+        Number of wavelength pixels of the input 2D array.
+    """
+    if data is None:
+        return None, None
+    data = np.asarray(data)
+    if data.ndim != 2:
+        return data, None
+    if data.strides[1] == 0:
+        return data[:, 0].copy(), data.shape[1]
+    return data, data.shape[1]
+
+
+class CorrectionPlan(CorrectionBase):
+    """Combination of multiplicative corrections applied in a single pass.
+
+    The factors of every correction (see
+    `CorrectionBase.get_correction_factor`) are multiplied together and
+    applied to the intensity and variance at once. Each correction is still
+    logged individually in the DataContainer.
+
+    Attributes
+    ----------
+    - corrections: list
+        List of (correction, kwargs) tuples, where kwargs are the additional
+        arguments passed to `get_correction_factor`.
+
+    Example
+    -------
+    >>> plan = CorrectionPlan()
+    >>> plan.add(throughput_corr).add(atm_ext_corr, force_airmass=1.2)
+    >>> rss = plan.apply(rss)
+    """
+    name = "CorrectionPlan"
+    verbose = False
+
+    def __init__(self, corrections=None, verbose=False):
+        self.verbose = verbose
+        self.corrections = []
+        if corrections is not None:
+            for correction in corrections:
+                self.add(correction)
+
+    def add(self, correction, **kwargs):
+        """Include a new correction in the plan.
+
+        Parameters
+        ----------
+        - correction: CorrectionBase
+            Multiplicative correction.
+        - kwargs:
+            Additional arguments passed to `correction.get_correction_factor`.
+
+        Returns
+        -------
+        - plan: CorrectionPlan
+            The plan itself, so that calls can be chained.
+        """
+        if not isinstance(correction, CorrectionBase):
+            raise CorrectionClassError(
+                f"Input correction must be a CorrectionBase: {correction}")
+        self.corrections.append((correction, kwargs))
+        return self
+
+    def get_correction_factor(self, data_container):
+        """Compute the combined factor of every correction in the plan.
+
+        Returns
+        -------
+        - factor: np.ndarray or None
+            Product of the individual factors.
+        - applied: list
+            List of (correction, log_comments) tuples of the corrections
+            that contribute to the factor.
+        """
+        factor = None
+        applied = []
+        for correction, kwargs in self.corrections:
+            correction_factor, log_comments = correction.get_correction_factor(
+                data_container, **kwargs)
+            if correction_factor is None:
+                continue
+            self.corr_print(f"Including {correction.name}")
+            if factor is None:
+                factor = correction_factor
+            else:
+                factor = factor * correction_factor
+            applied.append((correction, log_comments))
+        return factor, applied
+
+    def apply(self, data_container, inplace=None):
+        """Apply every correction of the plan to a DataContainer.
+
+        Parameters
+        ----------
+        - data_container: koala.DataContainer
+            DC to be corrected.
+        - inplace: bool, default=None
+            See `CorrectionBase.get_output_container`.
+
+        Returns
+        -------
+        - data_container_out: koala.DataContainer
+            Corrected DC.
+        """
+        factor, applied = self.get_correction_factor(data_container)
+        data_container_out = self.get_output_container(data_container, inplace)
+        if factor is None:
+            return data_container_out
+        data_container_out.intensity = data_container_out.intensity * factor
+        data_container_out.variance = data_container_out.variance * factor**2
+        for correction, log_comments in applied:
+            correction.log_correction(data_container_out, status='applied',
+                                      **log_comments)
+        return data_container_out
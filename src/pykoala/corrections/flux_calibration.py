@@ -576,7 +576,8 @@ class FluxCalibration(CorrectionBase):
         else:
             return response, None
 
-    def apply(self, data_container, response=None, response_units=None):
+    def apply(self, data_container, response=None, response_units=None,
+              inplace=None):
         """
         Computes the response curve from observed and reference spectra.
 
@@ -609,9 +610,22 @@ class FluxCalibration(CorrectionBase):
             Figure of the response curve plot, if plot is True.
         """
 
+        factor, log_comments = self.get_correction_factor(
+            data_container, response=response, response_units=response_units)
+        if factor is None:
+            return data_container
+        return self.apply_correction_factor(data_container, factor, inplace,
+                                            **log_comments)
+
+    def get_correction_factor(self, data_container, response=None,
+                              response_units=None):
+        """Return the inverse of the response (see `CorrectionBase`).
+
+        If the DataContainer has already been calibrated, the factor is None.
+        """
         if data_container.is_corrected(self.name):
             print("Data already calibrated")
-            return data_container
+            return None, {}
 
         if response is None:
             if self.response is None:
@@ -634,12 +648,8 @@ class FluxCalibration(CorrectionBase):
             response = response[np.newaxis, :]
         else:
             raise NameError(f"Unrecognised DataContainer of type : {type(data_container)}")
-        # Apply the correction
-        data_container.intensity /= response
-        data_container.variance /= response**2
-        self.log_correction(data_container, status='applied',
-                            units=str(response_units) + ' counts / (erg/s/AA/cm2)')
-        return data_container
+        return 1 / response, dict(
+            units=str(response_units) + ' counts / (erg/s/AA/cm2)')
 
     def save_response(self, fname, response, wavelength, units=None):
         """
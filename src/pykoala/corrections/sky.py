@@ -5,8 +5,8 @@ sky module containing...TODO
 # Basics packages
 # =============================================================================
 import numpy as np
-import copy
 import os
+import hashlib
 from time import time
 import matplotlib.pyplot as plt
 # from matplotlib.colors import LogNorm
@@ -23,10 +23,10 @@ from astropy import units as u
 # KOALA packages
 # =============================================================================
 # Modular
-from pykoala.ancillary import vprint
+from pykoala import config
 from pykoala.plotting.utils import new_figure, colour_map
 from pykoala.exceptions.exceptions import TelluricNoFileError
-from pykoala.corrections.correction import CorrectionBase
+from pykoala.corrections.correction import CorrectionBase, expand_spectral_dims
 from pykoala.corrections.throughput import Throughput
 from pykoala.corrections.wavelength import WavelengthOffset
 from pykoala.data_container import DataContainer
@@ -54,6 +54,12 @@ class BackgroundEstimator:
 
     mode(data, axis=0, n_bins=None, bin_range=None)
         Estimate the background and dispersion using the mode of the data distribution.
+
+    approx_percentile(data, percentiles=[16, 50, 84], axis=0, n_bins=100, n_iter=2)
+        Histogram-based approximation of `percentile`.
+
+    approx_mad(data, axis=0, n_bins=100, n_iter=2)
+        Histogram-based approximation of `mad`.
     """
 
     @staticmethod
@@ -181,28 +187,260 @@ class BackgroundEstimator:
         return sky_intensity, np.nan + sky_intensity
 
     @staticmethod
-    def mode(data, axis=0, n_bins=None, bin_range=None):
+    def _reduction_view(data, axis):
+        """Return a 2D view of `data` with the reduction axes last.
+
+        Returns
+        -------
+        data : np.ndarray
+            Array with shape (n_outputs, n_samples).
+        out_shape : tuple
+            Shape of the output arrays.
+        """
+        data = np.asarray(data)
+        if not np.issubdtype(data.dtype, np.floating):
+            data = data.astype(float)
+        axis = np.atleast_1d(axis) % data.ndim
+        data = np.moveaxis(data, axis, np.arange(-axis.size, 0))
+        out_shape = data.shape[:data.ndim - axis.size]
+        return data.reshape(int(np.prod(out_shape)), -1), out_shape
+
+    @staticmethod
+    def _histogram(data, low, high, n_bins):
+        """Histogram of each row of `data` within [low, high] (per row).
+
+        All rows are binned at once with a single call to `np.bincount`.
+        Values outside the range (or not finite) are not counted.
+
+        Returns
+        -------
+        counts : np.ndarray
+            Array with shape (n_rows, n_bins).
+        width : np.ndarray
+            Bin width of each row.
+        """
+        n_rows = data.shape[0]
+        width = (high - low) / n_bins
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bins = np.floor((data - low[:, np.newaxis]) / width[:, np.newaxis])
+            # Rows with a null range are assigned to the first bin
+            bins[width == 0] = 0
+            valid = ((data >= low[:, np.newaxis])
+                     & (data <= high[:, np.newaxis]))
+        bins = np.clip(np.where(valid, bins, 0), 0, n_bins - 1).astype(int)
+        bins += np.arange(n_rows)[:, np.newaxis] * n_bins
+        counts = np.bincount(bins[valid], minlength=n_rows * n_bins)
+        return counts.reshape(n_rows, n_bins), width
+
+    @classmethod
+    def _histogram_quantiles(cls, data, quantiles, n_bins=100, n_iter=2):
+        """Approximate quantiles of each row of a 2D array.
+
+        The bin containing each quantile is found from the cumulative
+        histogram of each row, and it is then refined (`n_iter` times in
+        total) by binning only the values within that bin. The value is
+        finally interpolated linearly within the last bin. The absolute error
+        is of the order of ``(max - min) / n_bins**n_iter``.
+
+        Returns
+        -------
+        values : np.ndarray
+            Array with shape (len(quantiles), n_rows).
+        """
+        n_rows = data.shape[0]
+        rows = np.arange(n_rows)
+        finite = np.isfinite(data)
+        n_valid = np.count_nonzero(finite, axis=1)
+        with np.errstate(invalid='ignore'):
+            low = np.nanmin(np.where(finite, data, np.inf), axis=1)
+            high = np.nanmax(np.where(finite, data, -np.inf), axis=1)
+        low[n_valid == 0] = 0
+        high[n_valid == 0] = 0
+        width = (high - low) / n_bins
+        # Non-finite values are stored in an extra bin
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bins = np.floor((data - low[:, np.newaxis])
+                            / np.where(width > 0, width, 1)[:, np.newaxis])
+        bins = np.where(finite, np.clip(bins, 0, n_bins - 1), n_bins
+                        ).astype(int)
+        counts = np.bincount(
+            (bins + rows[:, np.newaxis] * (n_bins + 1)).ravel(),
+            minlength=n_rows * (n_bins + 1)).reshape(n_rows, n_bins + 1)
+        counts = counts[:, :n_bins]
+        cumulative = np.cumsum(counts, axis=1)
+
+        def order_statistic(rank):
+            # Approximate value of the `rank`-th (1-based) smallest element
+            index = np.minimum(
+                np.count_nonzero(cumulative < rank[:, np.newaxis], axis=1),
+                n_bins - 1)
+            n_bin = counts[rows, index]
+            n_below = cumulative[rows, index] - n_bin
+            bin_low = low + index * width
+            bin_width = width
+            if n_iter > 1:
+                row, col = np.nonzero(bins == index[:, np.newaxis])
+                bin_values = data[row, col]
+            for _ in range(n_iter - 1):
+                bin_width = bin_width / n_bins
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    sub_bins = np.floor(
+                        (bin_values - bin_low[row])
+                        / np.where(bin_width > 0, bin_width, 1)[row])
+                sub_bins = np.clip(sub_bins, 0, n_bins - 1).astype(int)
+                sub_counts = np.bincount(
+                    sub_bins + row * n_bins,
+                    minlength=n_rows * n_bins).reshape(n_rows, n_bins)
+                sub_cumulative = n_below[:, np.newaxis] + np.cumsum(
+                    sub_counts, axis=1)
+                sub_index = np.minimum(np.count_nonzero(
+                    sub_cumulative < rank[:, np.newaxis], axis=1), n_bins - 1)
+                n_bin = sub_counts[rows, sub_index]
+                n_below = sub_cumulative[rows, sub_index] - n_bin
+                bin_low = bin_low + sub_index * bin_width
+                keep = sub_bins == sub_index[row]
+                row, bin_values = row[keep], bin_values[keep]
+            # Assume that the values are evenly spread within the bin
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fraction = np.clip(np.where(
+                    n_bin > 0, (rank - n_below - 0.5) / n_bin, 0.5), 0, 1)
+            return bin_low + fraction * bin_width
+
+        values = np.empty((len(quantiles), n_rows))
+        for i, quantile in enumerate(quantiles):
+            # Interpolate between the two closest order statistics (same
+            # convention as np.quantile)
+            rank = quantile * (np.maximum(n_valid, 1) - 1) + 1
+            rank_low = np.floor(rank)
+            values[i] = order_statistic(rank_low)
+            interp = rank > rank_low
+            if interp.any():
+                values[i] += (rank - rank_low) * (
+                    order_statistic(rank_low + 1) - values[i])
+            values[i, n_valid == 0] = np.nan
+        return values
+
+    @classmethod
+    def approx_percentile(cls, data, percentiles=[16, 50, 84], axis=0,
+                          n_bins=100, n_iter=2):
+        """
+        Approximate `percentile` estimator based on histograms.
+
+        The percentiles are estimated from the histogram of the data along
+        `axis`, which is built for all the outputs at once with `np.bincount`.
+        The computational cost scales linearly with the number of elements.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The input data array from which to compute the background and dispersion.
+        percentiles : list of float, optional
+            The percentiles to use for computation. Default is [16, 50, 84].
+        axis : int or tuple of int, optional
+            The axis along which to compute the percentiles. Default is 0.
+        n_bins : int, optional
+            Number of histogram bins. Default is 100.
+        n_iter : int, optional
+            Number of histogram refinements. The error is bounded by
+            ``(max - min) / n_bins**n_iter``. Default is 2.
+
+        Returns
+        -------
+        background : np.ndarray
+            The computed background (median) of the data.
+        background_sigma : np.ndarray
+            The dispersion (half the interpercentile range) of the data.
+        """
+        data, out_shape = cls._reduction_view(data, axis)
+        plow, background, pup = cls._histogram_quantiles(
+            data, np.asarray(percentiles) / 100, n_bins, n_iter)
+        background_sigma = (pup - plow) / 2
+        return background.reshape(out_shape), background_sigma.reshape(out_shape)
+
+    @classmethod
+    def approx_mad(cls, data, axis=0, n_bins=100, n_iter=2):
+        """
+        Approximate `mad` estimator based on histograms.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            The input data array from which to compute the background and dispersion.
+        axis : int or tuple of int, optional
+            The axis along which to compute the median and MAD. Default is 0.
+        n_bins : int, optional
+            Number of histogram bins. Default is 100.
+        n_iter : int, optional
+            Number of histogram refinements. Default is 2.
+
+        Returns
+        -------
+        background : np.ndarray
+            The computed background (median) of the data.
+        background_sigma : np.ndarray
+            The dispersion (scaled MAD) of the data.
+        """
+        data, out_shape = cls._reduction_view(data, axis)
+        background = cls._histogram_quantiles(data, [0.5], n_bins, n_iter)[0]
+        mad = cls._histogram_quantiles(
+            np.abs(data - background[:, np.newaxis]), [0.5], n_bins, n_iter)[0]
+        background_sigma = 1.4826 * mad
+        return background.reshape(out_shape), background_sigma.reshape(out_shape)
+
+    @classmethod
+    def mode(cls, data, axis=0, n_bins=None, bin_range=None):
         """
         Estimate the background and dispersion using the mode of the data distribution.
 
+        The histogram of the data along `axis` is built for all the outputs at
+        once with `np.bincount`, and the mode is estimated by fitting a
+        parabola to the highest bin and its neighbours.
+
         Parameters
         ----------
         data : np.ndarray
             The input data array from which to compute the background and dispersion.
-        axis : int, optional
+        axis : int or tuple of int, optional
             The axis along which to compute the mode. Default is 0.
         n_bins : int, optional
-            The number of bins to use for the histogram. Default is None.
+            The number of bins to use for the histogram. If None, it is set
+            to the square root of the number of values (with a minimum of 10).
         bin_range : tuple of float, optional
-            The range of values for the histogram bins. Default is None.
+            The range of values for the histogram bins. If None, the range
+            spans 3 times the dispersion around the (approximate) median.
 
-        Raises
-        ------
-        NotImplementedError
-            This method is not yet implemented.
+        Returns
+        -------
+        background : np.ndarray
+            The computed background (mode) of the data.
+        background_sigma : np.ndarray
+            The dispersion (half the 16-84 interpercentile range) of the data.
         """
-        # TODO: Implement mode estimation method
-        raise NotImplementedError("Sorry, not implemented :(")
+        data, out_shape = cls._reduction_view(data, axis)
+        plow, median, pup = cls._histogram_quantiles(data, [.16, .5, .84])
+        background_sigma = (pup - plow) / 2
+        if n_bins is None:
+            n_bins = max(int(np.sqrt(data.shape[1])), 10)
+        if bin_range is None:
+            low = median - 3 * background_sigma
+            high = median + 3 * background_sigma
+        else:
+            low = np.full(data.shape[0], fill_value=bin_range[0], dtype=float)
+            high = np.full(data.shape[0], fill_value=bin_range[1], dtype=float)
+        counts, width = cls._histogram(data, low, high, n_bins)
+        rows = np.arange(data.shape[0])
+        peak = np.argmax(counts, axis=1)
+        # Parabolic interpolation around the peak
+        left = counts[rows, np.clip(peak - 1, 0, n_bins - 1)]
+        right = counts[rows, np.clip(peak + 1, 0, n_bins - 1)]
+        centre = counts[rows, peak]
+        curvature = left - 2 * centre + right
+        with np.errstate(invalid='ignore', divide='ignore'):
+            offset = np.where(curvature < 0,
+                              0.5 * (left - right) / curvature, 0)
+        background = low + (peak + 0.5 + np.clip(offset, -0.5, 0.5)) * width
+        background[~np.isfinite(median)] = np.nan
+        return background.reshape(out_shape), background_sigma.reshape(out_shape)
 
 
 # =============================================================================
@@ -269,30 +507,120 @@ class ContinuumEstimator:
     default_min_separation = 10
 
     @classmethod
-    def lower_envelope(self, x, y, min_separation=None):
+    def lower_envelope(cls, x, y, min_separation=None):
         '''
         Fit lower envelope of a single spectrum:
         1) Find local minima, with a minimum separation `min_separation`.
         2) Interpolate linearly between them.
         3) Add "typical" (~median) offset.
+
+        See `lower_envelope_2d` for a version that processes several spectra
+        at once.
         '''
-        if min_separation is None:
-            min_separation = self.default_min_separation
-        valleys = []
-        y[np.isnan(y)] = np.inf
-        for i in range(min_separation, y.size-min_separation-1):
-            if np.argmin(y[i-min_separation:i+min_separation+1]) == min_separation:
-                valleys.append(i)
-        y[~np.isfinite(y)] = np.nan
+        continuum, offset = cls.lower_envelope_2d(
+            x, np.asarray(y)[np.newaxis], min_separation)
+        return continuum[0], offset[0]
 
-        continuum = np.fmin(y, np.interp(x, x[valleys], y[valleys]))
+    @classmethod
+    def lower_envelope_2d(cls, x, y, min_separation=None):
+        '''
+        Fit the lower envelope of a set of spectra that share the same
+        wavelength array (e.g. the intensity of an RSS).
 
-        offset = y - continuum
-        offset = np.nanpercentile(offset[offset > 0], np.linspace(1, 50, 51))
-        density = (np.arange(offset.size) + 1) / offset
-        offset = np.median(offset[density > np.max(density)/2])
+        This is equivalent to calling `lower_envelope` on each spectrum, but
+        the local minima are found with a sliding minimum filter and the
+        interpolation and offset estimation are done for all spectra at once.
 
-        return continuum+offset, offset
+        Parameters
+        ----------
+        - x: np.ndarray
+            1D array with the wavelength of each pixel.
+        - y: np.ndarray
+            2D array of spectra with shape (n_spectra, x.size).
+        - min_separation: int, default=None
+            Minimum separation (in pixels) between local minima. If None,
+            `default_min_separation` is used.
+
+        Returns
+        -------
+        - continuum: np.ndarray
+            Lower envelope plus the typical offset of each spectrum.
+        - offset: np.ndarray
+            1D array with the typical offset of each spectrum.
+        '''
+        if min_separation is None:
+            min_separation = cls.default_min_separation
+        x = np.asarray(x)
+        y = np.atleast_2d(y)
+        n_spectra, n_pixels = y.shape
+        # Non-finite values never count as local minima
+        finite_y = np.where(np.isfinite(y), y, np.nan)
+        y_min = np.where(np.isnan(y), np.inf, y)
+
+        # 1) Local minima: y[i] must be strictly lower than the
+        # `min_separation` pixels on its left and lower or equal than those on
+        # its right (i.e. the first occurrence of the minimum of the window).
+        pixels = np.arange(min_separation, n_pixels - min_separation - 1)
+        valleys = np.zeros(y.shape, dtype=bool)
+        if pixels.size > 0:
+            if min_separation > 0:
+                # Minimum of y[k: k + min_separation] stored at k + ms // 2
+                running_min = scipy.ndimage.minimum_filter1d(
+                    y_min, min_separation, axis=1)
+                centre = min_separation // 2
+                left_min = running_min[:, pixels - min_separation + centre]
+                right_min = running_min[:, pixels + 1 + centre]
+                valleys[:, pixels] = ((y_min[:, pixels] < left_min)
+                                      & (y_min[:, pixels] <= right_min))
+            else:
+                valleys[:, pixels] = True
+
+        # 2) Linear interpolation between the closest minima of each pixel,
+        # extrapolating as a constant beyond the first/last minimum
+        index = np.arange(n_pixels)
+        previous = np.maximum.accumulate(
+            np.where(valleys, index, -1), axis=1)
+        following = np.minimum.accumulate(
+            np.where(valleys, index, n_pixels)[:, ::-1], axis=1)[:, ::-1]
+        has_valleys = valleys.any(axis=1, keepdims=True)
+        previous = np.where(previous < 0, following, previous)
+        following = np.where(following == n_pixels, previous, following)
+        previous[~has_valleys[:, 0]] = 0
+        following[~has_valleys[:, 0]] = 0
+
+        rows = np.arange(n_spectra)[:, np.newaxis]
+        y_previous = y_min[rows, previous]
+        y_following = y_min[rows, following]
+        x_previous = x[previous]
+        dx = x[following] - x_previous
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = np.where(dx != 0, (y_following - y_previous) / dx, 0)
+        envelope = y_previous + slope * (x[np.newaxis] - x_previous)
+        envelope[~has_valleys[:, 0]] = np.nan
+        continuum = np.fmin(finite_y, envelope)
+
+        # 3) Typical offset: median of the positive residuals percentiles
+        # around the highest density region
+        residuals = finite_y - continuum
+        residuals = np.sort(np.where(residuals > 0, residuals, np.inf), axis=1)
+        n_positive = np.count_nonzero(np.isfinite(residuals), axis=1)
+        # Linear interpolation between order statistics (as np.percentile)
+        position = (np.linspace(1, 50, 51)[np.newaxis] / 100
+                    * (n_positive[:, np.newaxis] - 1))
+        position = np.clip(position, 0, None)
+        lower = np.floor(position).astype(int)
+        upper = np.minimum(lower + 1, np.maximum(n_positive[:, np.newaxis] - 1, 0))
+        with np.errstate(invalid='ignore'):
+            percentiles = residuals[rows, lower] + (
+                residuals[rows, upper] - residuals[rows, lower]) * (
+                    position - lower)
+            percentiles[n_positive == 0] = np.nan
+            density = (np.arange(percentiles.shape[1]) + 1) / percentiles
+            high_density = density > np.nanmax(density, axis=1,
+                                               keepdims=True) / 2
+        offset = np.nanmedian(np.where(high_density, percentiles, np.nan),
+                              axis=1)
+        return continuum + offset[:, np.newaxis], offset
 
 
 class ContinuumModel:
@@ -310,9 +638,10 @@ class ContinuumModel:
         print(f"> Find continuum for {n_spectra} spectra:")
         t0 = time()
 
-        for i in range(n_spectra):
-            self.intensity[i], self.scale[i] = ContinuumEstimator.lower_envelope(
-                dc.wavelength, dc.intensity[i], min_separation)
+        intensity, scale = ContinuumEstimator.lower_envelope_2d(
+            dc.wavelength, dc.intensity, min_separation)
+        self.intensity[:] = intensity
+        self.scale[:] = scale
 
         print(f"  Done ({time()-t0:.3g} s)")
         self.strong_sky_lines = self.detect_lines(dc)
@@ -374,12 +703,55 @@ class LSF_estimator:
 # Sky lines library
 # =============================================================================
 
-def uves_sky_lines():
+# Merged UVES line list of each set of source files (keyed by path,
+# modification time and size)
+_uves_sky_lines_memo = {}
+# Sky lines after blending and selection, see `SkyModel.load_sky_lines`
+_sky_lines_memo = {}
+
+
+def _uves_sky_lines_files():
+    """Return the paths to the UVES sky line tables."""
+    # Prefix of each table
+    prefix = ["346", "437", "580L", "580U", "800U", "860L", "860U"]
+    # Path to tables
+    data_path = os.path.join(
+        os.path.dirname(__file__), "..", "input_data", "sky_lines", "ESO-UVES")
+    return [os.path.join(data_path, f"gident_{p}.tfits") for p in prefix]
+
+
+def _files_stat_key(files):
+    """Return a key that identifies the current version of a set of files.
+
+    The key contains the path, modification time and size of each file.
+    """
+    key = []
+    for file in files:
+        if not os.path.isfile(file):
+            raise FileNotFoundError(f"File '{file}' could not be found")
+        file_stat = os.stat(file)
+        key.append((os.path.abspath(file), file_stat.st_mtime_ns,
+                    file_stat.st_size))
+    return tuple(key)
+
+
+def uves_sky_lines(use_cache=True):
     """
     Library of sky emission lines measured with UVES@VLT.
 
     For more details, see the `UVES Sky Spectrum <https://www.eso.org/observing/dfo/quality/UVES/pipeline/sky_spectrum.html>`_.
 
+    The merged list is stored as a binary file (``.npz``) in the PyKOALA cache
+    directory (see `pykoala.config.get_cache_dir`), keyed by the checksum of
+    the original tables, so that they are only parsed once. Within the same
+    process, the list is also kept in memory until the tables are modified.
+
+    Parameters
+    ----------
+    use_cache : bool, optional
+        If True (default), read the merged list from the cache directory
+        (creating it if needed). Otherwise, parse the original tables.
+
     Returns
     -------
     line_wavelength : np.ndarray
@@ -389,35 +761,167 @@ def uves_sky_lines():
     line_flux : np.ndarray
         Array containing the flux of each line expressed in 1e-16 ergs/s/A/cm^2/arcsec^2.
     """
-    # Prefix of each table
-    prefix = ["346", "437", "580L", "580U", "800U", "860L", "860U"]
-    # Path to tables
-    data_path = os.path.join(
-        os.path.dirname(__file__), "..", "input_data", "sky_lines", "ESO-UVES")
+    files = _uves_sky_lines_files()
+    memo_key = _files_stat_key(files)
+
+    if use_cache and memo_key in _uves_sky_lines_memo:
+        return tuple(arr.copy() for arr in _uves_sky_lines_memo[memo_key])
+
+    checksum = hashlib.sha1()
+    for file in files:
+        with open(file, "rb") as f:
+            checksum.update(f.read())
+    checksum = checksum.hexdigest()
+
+    cache_file = os.path.join(config.get_cache_dir(),
+                              f"uves_sky_lines_{checksum}.npz")
+    lines = None
+    if use_cache and os.path.isfile(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                lines = (cache['wavelength'], cache['fwhm'], cache['flux'])
+        except (OSError, ValueError, KeyError):
+            lines = None
+
+    if lines is None:
+        # Initialize arrays to store line properties
+        line_wavelength = np.empty(0)
+        line_fwhm = np.empty(0)
+        line_flux = np.empty(0)
+
+        # Read data from each file
+        for file in files:
+            with fits.open(file) as f:
+                wave = f[1].data['LAMBDA_AIR']
+                fwhm = f[1].data['FWHM']
+                flux = f[1].data['FLUX']
+
+                line_wavelength = np.hstack((line_wavelength, wave))
+                line_fwhm = np.hstack((line_fwhm, fwhm))
+                line_flux = np.hstack((line_flux, flux))
+
+        # Sort lines by wavelength
+        sort_pos = np.argsort(line_wavelength)
+        lines = (line_wavelength[sort_pos], line_fwhm[sort_pos],
+                 line_flux[sort_pos])
+        if use_cache:
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                tmp_file = cache_file + f".{os.getpid()}.tmp.npz"
+                np.savez(tmp_file, wavelength=lines[0], fwhm=lines[1],
+                         flux=lines[2])
+                os.replace(tmp_file, cache_file)
+            except OSError:
+                pass
+
+    if use_cache:
+        _uves_sky_lines_memo[memo_key] = lines
+    return tuple(arr.copy() for arr in lines)
+
+
+def blend_sky_lines(line_wavelength, line_fwhm, line_flux, resolution):
+    """
+    Blend the sky emission lines that cannot be resolved.
 
-    # Initialize arrays to store line properties
-    line_wavelength = np.empty(0)
-    line_fwhm = np.empty(0)
-    line_flux = np.empty(0)
+    Consecutive lines (sorted by wavelength) separated by less than (or
+    exactly) ``resolution`` are grouped in a single pass. Each group is
+    replaced by a single line at the mean wavelength, with the FWHM added in
+    quadrature and the total flux.
 
-    # Read data from each file
-    for p in prefix:
-        file = os.path.join(data_path, f"gident_{p}.tfits")
-        if not os.path.isfile(file):
-            raise FileNotFoundError(f"File '{file}' could not be found")
+    Parameters
+    ----------
+    line_wavelength : np.ndarray
+        Sorted wavelength of the lines.
+    line_fwhm : np.ndarray
+        FWHM of each line.
+    line_flux : np.ndarray
+        Flux of each line.
+    resolution : float
+        Wavelength resolution.
+
+    Returns
+    -------
+    line_wavelength : np.ndarray
+    line_fwhm : np.ndarray
+    line_flux : np.ndarray
+        Properties of the blended lines.
+    """
+    if line_wavelength.size == 0:
+        return line_wavelength, line_fwhm, line_flux
+    start = np.concatenate(
+        ([0], np.where(np.diff(line_wavelength) > resolution)[0] + 1))
+    n_lines = np.diff(np.append(start, line_wavelength.size))
+    blend_wavelength = np.add.reduceat(line_wavelength, start) / n_lines
+    blend_fwhm = np.sqrt(np.add.reduceat(line_fwhm**2, start))
+    blend_flux = np.add.reduceat(line_flux, start)
+    return blend_wavelength, blend_fwhm, blend_flux
+
+
+def batched_weighted_lstsq(design, data, weights, chunk_size=256):
+    """
+    Solve a weighted linear least-squares problem for a set of spectra.
 
-        with fits.open(file) as f:
-            wave = f[1].data['LAMBDA_AIR']
-            fwhm = f[1].data['FWHM']
-            flux = f[1].data['FLUX']
+    All spectra share the same design matrix. Spectra that also share the
+    same weights are solved with a single call to `np.linalg.lstsq`, while
+    the rest are solved in blocks of ``chunk_size`` spectra through their
+    normal equations. Only the pairs of overlapping (i.e. non-orthogonal by
+    construction) columns of the design matrix are used to build them.
 
-            line_wavelength = np.hstack((line_wavelength, wave))
-            line_fwhm = np.hstack((line_fwhm, fwhm))
-            line_flux = np.hstack((line_flux, flux))
+    Parameters
+    ----------
+    design : np.ndarray
+        Design matrix with shape (n_wavelength, n_params).
+    data : np.ndarray
+        Spectra with shape (n_spectra, n_wavelength). Pixels with null weight
+        must contain finite values (e.g. zero).
+    weights : np.ndarray
+        Weight of each pixel, with the same shape as ``data``.
+    chunk_size : int, optional
+        Number of spectra with different weights solved at once.
+        Default is 256.
+
+    Returns
+    -------
+    coefficients : np.ndarray
+        Best-fit coefficients with shape (n_spectra, n_params). Parameters
+        without any valid pixel are set to zero, and the coefficients of
+        spectra with a singular system of normal equations are set to NaN.
+    """
+    n_params = design.shape[1]
+    coefficients = np.zeros((data.shape[0], n_params))
+    common = np.all(weights == weights[:1], axis=1)
+    if common.any():
+        # Spectra sharing the same weights are solved in a single call
+        sqrt_w = np.sqrt(weights[np.argmax(common)])
+        coefficients[common] = np.linalg.lstsq(
+            design * sqrt_w[:, np.newaxis],
+            (data[common] * sqrt_w[np.newaxis]).T, rcond=None)[0].T
+    index = np.where(~common)[0]
+    if index.size == 0:
+        return coefficients
+    overlap = (design != 0).astype(float)
+    param_i, param_j = np.where(overlap.T @ overlap > 0)
+    pair_products = design[:, param_i] * design[:, param_j]
+    diagonal = np.arange(n_params)
+    for chunk in np.array_split(
+            index, int(np.ceil(index.size / chunk_size))):
+        normal = np.zeros((chunk.size, n_params, n_params))
+        normal[:, param_i, param_j] = weights[chunk] @ pair_products
+        rhs = (weights[chunk] * data[chunk]) @ design
+        # Parameters without valid pixels are set to zero
+        normal[:, diagonal, diagonal] += normal[:, diagonal, diagonal] <= 0
+        try:
+            coefficients[chunk] = np.linalg.solve(
+                normal, rhs[..., np.newaxis])[..., 0]
+        except np.linalg.LinAlgError:
+            # Solve each spectrum individually to isolate the singular ones
+            for i, row in enumerate(chunk):
+                try:
+                    coefficients[row] = np.linalg.solve(normal[i], rhs[i])
+                except np.linalg.LinAlgError:
+                    coefficients[row] = np.nan
+    return coefficients
 
-    # Sort lines by wavelength
-    sort_pos = np.argsort(line_wavelength)
-    return line_wavelength[sort_pos], line_fwhm[sort_pos], line_flux[sort_pos]
 
 # =============================================================================
 # Sky models
@@ -443,6 +947,8 @@ class SkyModel(object):
         1-D array representing the wavelength of a collection of sky emission
         lines expressed in angstrom. This is used for fitting the emission lines
         from the (continuum-substracted) intensity.
+    pca : SkyPCA
+        Sky principal components used by `substract_pca`.
     verbose : bool, optional
         If True, print messages during execution. Default is True.
 
@@ -451,8 +957,11 @@ class SkyModel(object):
     subtract(data, variance, axis=-1)
         Subtracts the sky model from the given data.
 
-    subtract_pca()
-        Placeholder for PCA subtraction method.
+    subtract_pca(data, variance, pca=None)
+        Subtracts a PCA sky model (see `SkyPCA`) from the given data.
+
+    fit_emission_lines_linear(intensity=None, variance=None, fwhm=None)
+        Fit the amplitude of the sky emission lines of one or many spectra.
 
     vprint(*messages)
         Print messages if `verbose` is True.
@@ -460,6 +969,7 @@ class SkyModel(object):
 
     verbose = True
     sky_lines = None
+    pca = None
 
     def __init__(self, **kwargs):
         """
@@ -476,6 +986,8 @@ class SkyModel(object):
                 Array representing the intensity of the sky model.
             - variance : np.ndarray
                 Array representing the variance associated with the sky model.
+            - pca : SkyPCA
+                Sky principal components used by `substract_pca`.
             - verbose : bool
                 If True, print messages during execution. Default is True.
         """
@@ -483,8 +995,13 @@ class SkyModel(object):
         self.intensity = kwargs.get('intensity', None)
         self.variance = kwargs.get('variance', None)
         self.continuum = kwargs.get('continuum', None)
+        self.pca = kwargs.get('pca', None)
         self.verbose = kwargs.get('verbose', True)
 
+    def vprint(self, *messages):
+        """Print messages if `verbose` is True."""
+        if self.verbose:
+            print(f"[{self.__class__.__name__}]", *messages)
 
     def substract(self, data, variance, axis=-1, verbose=False):
         """
@@ -523,13 +1040,50 @@ class SkyModel(object):
         var_subs = variance + skymodel_var
         return data_subs, var_subs
 
-    def substract_pca():
+    def substract_pca(self, data, variance, pca=None, wavelength_mask=None,
+                      chunk_size=256):
         """
-        Placeholder for PCA subtraction method.
+        Subtracts a PCA sky model from the given data.
 
-        This method is not yet implemented.
+        The sky of each spectrum is the linear combination of the mean sky and
+        the principal components (see `SkyPCA`) that best fits the data.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Data array (RSS or cube) from which the sky will be subtracted.
+        variance : np.ndarray
+            Array of variance data, used to weight the fit.
+        pca : SkyPCA, optional
+            Sky principal components. If None, the `pca` attribute is used.
+        wavelength_mask : np.ndarray, optional
+            Boolean array selecting the wavelengths used in the fit.
+            Default is None (all).
+        chunk_size : int, optional
+            Number of spectra solved at once. Default is 256.
+
+        Returns
+        -------
+        data_subs : np.ndarray
+            Data array after the sky model has been subtracted.
+        var_subs : np.ndarray
+            Variance array.
         """
-        pass
+        if pca is None:
+            pca = self.pca
+        if pca is None:
+            raise AttributeError("Sky model PCA has not been computed, see"
+                                 + " `SkyPCA`")
+        shape = data.shape
+        if data.ndim == 3:
+            data = data.reshape(shape[0], -1).T
+            variance = variance.reshape(shape[0], -1).T
+        sky, _ = pca.get_sky(data, variance, wavelength_mask, chunk_size)
+        data_subs = data - sky
+        if len(shape) == 3:
+            data_subs = data_subs.T.reshape(shape)
+            variance = variance.T.reshape(shape)
+        return data_subs, variance
 
     def remove_continuum(self, cont_estimator="median", cont_estimator_args=None):
         """
@@ -556,7 +1110,8 @@ class SkyModel(object):
             raise AttributeError("Sky model intensity has not been computed")
 
     def fit_emission_lines(self, window_size=100,
-                           resampling_wave=0.1, **fit_kwargs):
+                           resampling_wave=0.1, method='levmar',
+                           **fit_kwargs):
         """
         Fit emission lines to the continuum-subtracted spectrum.
 
@@ -566,14 +1121,42 @@ class SkyModel(object):
             Size of the wavelength window for fitting. Default is 100.
         resampling_wave : float, optional
             Wavelength resampling interval. Default is 0.1.
+        method : str, optional
+            Fitting method. If 'levmar' (default), the amplitude, centre and
+            width of the lines are fitted within each window using
+            `fitting.LevMarLSQFitter`. If 'linear', only the amplitudes are
+            fitted, keeping the centre and width of each line fixed (see
+            `fit_emission_lines_linear`, that receives ``fit_kwargs``).
 
         Returns
         -------
-        emission_model : models.Gaussian1D
-            Fitted emission line model.
+        emission_model : models.Gaussian1D or list
+            Fitted emission line model. If ``method='linear'``, it is a model
+            set with one Gaussian per line, or a list with the model set of
+            each spectrum if a set of spectra is fitted.
         emission_spectra : np.ndarray
             Emission spectra.
         """
+        if method == 'linear':
+            fwhm = fit_kwargs.get('fwhm', None)
+            if fwhm is None:
+                fwhm = self.sky_lines_fwhm
+            amplitudes, emission_spectra = self.fit_emission_lines_linear(
+                **fit_kwargs)
+            stddev = np.broadcast_to(np.asarray(fwhm, dtype=float),
+                                     self.sky_lines.shape
+                                     ) / (2 * np.sqrt(2 * np.log(2)))
+            emission_model = [
+                models.Gaussian1D(amplitude=spectrum_amplitudes,
+                                  mean=self.sky_lines, stddev=stddev,
+                                  n_models=self.sky_lines.size)
+                for spectrum_amplitudes in np.atleast_2d(amplitudes)]
+            if amplitudes.ndim == 1:
+                emission_model = emission_model[0]
+            return emission_model, emission_spectra
+        elif method != 'levmar':
+            raise NameError(f"Unknown emission line fitting method: {method}")
+
         assert self.intensity, "Sky Model intensity is None"
 
         if self.continuum is None:
@@ -631,6 +1214,109 @@ class SkyModel(object):
                 emission_model += g
         return emission_model, emission_spectra
 
+    def get_emission_line_matrix(self, fwhm=None, truncation=5.):
+        """
+        Compute the matrix of normalised Gaussian profiles of the sky lines.
+
+        Parameters
+        ----------
+        fwhm : float or np.ndarray, optional
+            FWHM of the lines (in the same units as the wavelength). It can be
+            a single value (e.g. the result of a line spread function fit) or
+            one value per line. If None, the FWHM of the sky lines table
+            loaded with `load_sky_lines` is used.
+        truncation : float, optional
+            Each profile is set to zero beyond ``truncation`` standard
+            deviations from the line centre. Default is 5.
+
+        Returns
+        -------
+        line_matrix : np.ndarray
+            Array of shape (n_wavelength, n_lines) containing the profile of
+            each line with unit amplitude.
+        """
+        if self.sky_lines is None:
+            raise AttributeError("Sky lines have not been loaded, see"
+                                 + " `load_sky_lines`")
+        if fwhm is None:
+            fwhm = self.sky_lines_fwhm
+        sigma = np.broadcast_to(
+            np.asarray(fwhm, dtype=float), self.sky_lines.shape
+            ) / (2 * np.sqrt(2 * np.log(2)))
+        wavelength = np.asarray(self.wavelength, dtype=float)
+        distance = ((wavelength[:, np.newaxis] - self.sky_lines[np.newaxis])
+                    / sigma[np.newaxis])
+        line_matrix = np.exp(-0.5 * distance**2)
+        line_matrix[np.abs(distance) > truncation] = 0
+        return line_matrix
+
+    def fit_emission_lines_linear(self, intensity=None, variance=None,
+                                  fwhm=None, truncation=5., chunk_size=256):
+        """
+        Fit the amplitude of the sky emission lines using linear least squares.
+
+        The centre and width of each line are fixed (see
+        `get_emission_line_matrix`), so the amplitudes are the solution of a
+        linear problem. All the spectra share the same line profiles, and
+        they are fitted simultaneously.
+
+        Parameters
+        ----------
+        intensity : np.ndarray, optional
+            Continuum-subtracted spectrum, or set of spectra with shape
+            (n_spectra, n_wavelength) (e.g. the intensity of an RSS). If None,
+            the sky model intensity is used.
+        variance : np.ndarray, optional
+            Variance associated to ``intensity``, used to weight the fit. If
+            None, all pixels have the same weight (if ``intensity`` is None,
+            the sky model variance is used).
+        fwhm : float or np.ndarray, optional
+            FWHM of the lines. See `get_emission_line_matrix`.
+        truncation : float, optional
+            Truncation of the line profiles in units of their standard
+            deviation. Default is 5.
+        chunk_size : int, optional
+            Number of spectra with different weights solved at once.
+            Default is 256.
+
+        Returns
+        -------
+        amplitudes : np.ndarray
+            Amplitude of each line, with shape (n_lines,) or
+            (n_spectra, n_lines).
+        emission_spectra : np.ndarray
+            Emission line model with the same shape as ``intensity``.
+        """
+        if intensity is None:
+            intensity = self.intensity
+            if variance is None:
+                variance = self.variance
+        if intensity is None:
+            raise AttributeError("Sky model intensity has not been computed")
+        intensity = np.asarray(intensity)
+        single_spectrum = intensity.ndim == 1
+        intensity = np.atleast_2d(intensity)
+
+        line_matrix = self.get_emission_line_matrix(fwhm, truncation)
+        # Pixel weights (masked pixels have null weight)
+        if variance is None:
+            weights = np.ones(intensity.shape[-1])
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weights = 1 / np.asarray(variance, dtype=float)
+        weights = np.where(np.isfinite(weights), weights, 0)
+        weights = weights * np.isfinite(intensity)
+        data = np.where(weights > 0, intensity, 0)
+
+        self.vprint(f"Fitting all emission lines ({self.sky_lines.size})"
+               + f" to {intensity.shape[0]} spectra")
+        amplitudes = batched_weighted_lstsq(line_matrix, data, weights,
+                                            chunk_size)
+        emission_spectra = amplitudes @ line_matrix.T
+        if single_spectrum:
+            return amplitudes[0], emission_spectra[0]
+        return amplitudes, emission_spectra
+
     def load_sky_lines(self, path_to_table=None, lines_pct=84., **kwargs):
         """
         Load sky lines from a file.
@@ -648,11 +1334,28 @@ class SkyModel(object):
         -------
         None
         """
+        delta_lambda = self.wavelength[1] - self.wavelength[0]
         if path_to_table is not None:
-            self.vprint(f"Loading input sky line table {path_to_table}")
             path_to_table = os.path.join(os.path.dirname(__file__),
                                          'input_data', 'sky_lines',
                                          path_to_table)
+            files = [path_to_table]
+        else:
+            files = _uves_sky_lines_files()
+        # The lines are reloaded if the tables or the wavelength grid change
+        wavelength = np.ascontiguousarray(self.wavelength, dtype=float)
+        key = (_files_stat_key(files), repr(sorted(kwargs.items())),
+               wavelength.shape,
+               hashlib.sha1(wavelength.tobytes()).hexdigest(),
+               float(lines_pct))
+        if key in _sky_lines_memo:
+            self.vprint("Using previously loaded sky lines")
+            self.sky_lines, self.sky_lines_fwhm, self.sky_lines_f = (
+                arr.copy() for arr in _sky_lines_memo[key])
+            return
+
+        if path_to_table is not None:
+            self.vprint(f"Loading input sky line table {path_to_table}")
             self.sky_lines, self.sky_lines_fwhm, self.sky_lines_f = np.loadtxt(
                 path_to_table, usecols=(0, 1, 2), unpack=True, **kwargs)
         else:
@@ -666,36 +1369,21 @@ class SkyModel(object):
         self.sky_lines_f = self.sky_lines_f[common_lines]
         self.vprint(f"Total number of sky lines: {self.sky_lines.size}")
         # Blend sky emission lines
-        delta_lambda = self.wavelength[1] - self.wavelength[0]
         self.vprint("Blending sky emission lines according to"
-                    + f"wavelength resolution ({delta_lambda} AA)")
-        unresolved_lines = np.where(np.diff(self.sky_lines) <= delta_lambda)[0]
-        while len(unresolved_lines) > 0:
-            self.sky_lines[unresolved_lines] = (
-                self.sky_lines[unresolved_lines] + self.sky_lines[unresolved_lines + 1]) / 2
-            self.sky_lines_fwhm[unresolved_lines] = np.sqrt(
-                self.sky_lines_fwhm[unresolved_lines]**2 +
-                self.sky_lines_fwhm[unresolved_lines + 1]**2
-            )
-            self.sky_lines_f[unresolved_lines] = (
-                self.sky_lines_f[unresolved_lines] +
-                self.sky_lines_f[unresolved_lines + 1]
-            )
-            self.sky_lines = np.delete(self.sky_lines, unresolved_lines)
-            self.sky_lines_fwhm = np.delete(
-                self.sky_lines_fwhm, unresolved_lines)
-            self.sky_lines_f = np.delete(self.sky_lines_f, unresolved_lines)
-            unresolved_lines = np.where(
-                np.diff(self.sky_lines) <= delta_lambda)[0]
-        self.vprint(
-            f"Total number of sky lines after blending: {self.sky_lines.size}")
+               + f"wavelength resolution ({delta_lambda} AA)")
+        self.sky_lines, self.sky_lines_fwhm, self.sky_lines_f = blend_sky_lines(
+            self.sky_lines, self.sky_lines_fwhm, self.sky_lines_f, delta_lambda)
+        self.vprint("Total number of sky lines after blending:"
+                    + f" {self.sky_lines.size}")
         # Remove faint lines
-        # self.vprint(f"Selecting the  sky lines after blending: {self.sky_lines.size}")
-        faint = np.where(self.sky_lines_f < np.nanpercentile(
-            self.sky_lines_f, lines_pct))[0]
-        self.sky_lines = np.delete(self.sky_lines, faint)
-        self.sky_lines_fwhm = np.delete(self.sky_lines_fwhm, faint)
-        self.sky_lines_f = np.delete(self.sky_lines_f, faint)
+        bright = ~(self.sky_lines_f < np.nanpercentile(self.sky_lines_f,
+                                                       lines_pct))
+        self.sky_lines = self.sky_lines[bright]
+        self.sky_lines_fwhm = self.sky_lines_fwhm[bright]
+        self.sky_lines_f = self.sky_lines_f[bright]
+        _sky_lines_memo[key] = (self.sky_lines.copy(),
+                                self.sky_lines_fwhm.copy(),
+                                self.sky_lines_f.copy())
 
     def plot_sky_model(self, show=False):
         """Plot the sky model
@@ -768,15 +1456,35 @@ class SkyOffset(SkyModel):
         self.exptime = dc.info['exptime']
         super().__init__()
 
-    def estimate_sky(self):
+    def estimate_sky(self, bckgr_estimator='percentile', bckgr_params=None):
         """
         Estimate the sky emission model.
 
         This method calculates the intensity and variance of the sky model using
         percentiles, then normalizes them by the exposure time.
+
+        Parameters
+        ----------
+        bckgr_estimator : str, optional
+            Background estimator method (see `BackgroundEstimator`), e.g.
+            'percentile', 'approx_percentile' or 'mode'. Default is
+            'percentile'.
+        bckgr_params : dict, optional
+            Parameters for the background estimator. Default is None.
         """
-        self.intensity, self.variance = BackgroundEstimator.percentile(
-            self.dc.intensity, percentiles=[16, 50, 84])
+        if bckgr_params is None:
+            bckgr_params = {}
+        else:
+            bckgr_params = dict(bckgr_params)
+        if hasattr(BackgroundEstimator, bckgr_estimator):
+            estimator = getattr(BackgroundEstimator, bckgr_estimator)
+        else:
+            raise NameError(
+                f"Input background estimator {bckgr_estimator} does not exist")
+        if bckgr_estimator in ('percentile', 'approx_percentile'):
+            bckgr_params.setdefault('percentiles', [16, 50, 84])
+        self.intensity, self.variance = estimator(
+            self.dc.intensity, **bckgr_params)
         self.intensity, self.variance = (
             self.intensity / self.exptime,
             self.variance / self.exptime)
@@ -806,7 +1514,8 @@ class SkyFromObject(SkyModel):
 
     def __init__(self, dc, bckgr_estimator='mad', bckgr_params=None,
                  source_mask_nsigma=3, remove_cont=False,
-                 cont_estimator='median', cont_estimator_args=None):
+                 cont_estimator='median', cont_estimator_args=None,
+                 chunk_size=None):
         """
         Initialize the SkyFromObject model.
 
@@ -826,14 +1535,18 @@ class SkyFromObject(SkyModel):
             Method to estimate the continuum signal. Default is 'median'.
         cont_estimator_args : dict, optional
             Arguments for the continuum estimator. Default is None.
+        chunk_size : int, optional
+            If provided and the input is a Cube, the background is estimated
+            in chunks of ``chunk_size`` wavelength pixels (see
+            `estimate_background`). Default is None.
         """
-        vprint(self,"Creating SkyModel from input Data Container")
+        self.vprint("Creating SkyModel from input Data Container")
         self.dc = dc
         # self.exptime = dc.info['exptime']
-        vprint(self,"Estimating sky background contribution...")
+        self.vprint("Estimating sky background contribution...")
 
         bckg, bckg_sigma = self.estimate_background(
-            bckgr_estimator, bckgr_params, source_mask_nsigma)
+            bckgr_estimator, bckgr_params, source_mask_nsigma, chunk_size)
         super().__init__(wavelength=self.dc.wavelength,
                          intensity=bckg,
                          variance=bckg_sigma**2)
@@ -841,18 +1554,26 @@ class SkyFromObject(SkyModel):
             self.vprint("Removing background continuum")
             self.remove_continuum(cont_estimator, cont_estimator_args)
 
-    def estimate_background(self, bckgr_estimator, bckgr_params=None, source_mask_nsigma=3):
+    def estimate_background(self, bckgr_estimator, bckgr_params=None,
+                            source_mask_nsigma=3, chunk_size=None):
         """
         Estimate the background.
 
         Parameters
         ----------
         bckgr_estimator : str
-            Background estimator method. Available methods: 'mad', 'percentile'.
+            Background estimator method. Available methods: 'mad', 'percentile',
+            'mode', 'approx_mad', 'approx_percentile'.
         bckgr_params : dict, optional
             Parameters for the background estimator. Default is None.
         source_mask_nsigma : float, optional
             Sigma level for masking sources. Default is 3.
+        chunk_size : int, optional
+            Only used for Cubes. If provided, the sources are masked using a
+            single spatial mask, computed from the white image, and the
+            background is estimated from the unmasked spaxels in chunks of
+            ``chunk_size`` wavelength pixels, so that the full cube is never
+            copied. Default is None.
 
         Returns
         -------
@@ -870,6 +1591,10 @@ class SkyFromObject(SkyModel):
             raise NameError(
                 f"Input background estimator {bckgr_estimator} does not exist")
 
+        if chunk_size is not None and isinstance(self.dc, Cube):
+            return self.estimate_background_chunked(
+                estimator, bckgr_params, source_mask_nsigma, chunk_size)
+
         data = self.dc.intensity.copy()
 
         if data.ndim == 3:
@@ -880,10 +1605,10 @@ class SkyFromObject(SkyModel):
             dims_to_expand = (0)
 
         if source_mask_nsigma is not None:
-            vprint(self,"Pre-estimating background using all data")
+            self.vprint("Pre-estimating background using all data")
             bckgr, bckgr_sigma = estimator(data, **bckgr_params)
-            vprint(self,
-                f"Applying sigma-clipping mask (n-sigma={source_mask_nsigma})")
+            self.vprint("Applying sigma-clipping mask"
+                        + f" (n-sigma={source_mask_nsigma})")
             source_mask = (data > np.expand_dims(bckgr, dims_to_expand) +
                            source_mask_nsigma
                            * np.expand_dims(bckgr_sigma, dims_to_expand))
@@ -892,6 +1617,260 @@ class SkyFromObject(SkyModel):
         bckgr, bckgr_sigma = estimator(data, **bckgr_params)
         return bckgr, bckgr_sigma
 
+    def estimate_background_chunked(self, estimator, bckgr_params=None,
+                                    source_mask_nsigma=3, chunk_size=100):
+        """
+        Estimate the background of a Cube in wavelength chunks.
+
+        The sources are identified only once, as the spaxels of the white
+        image above the background level by more than ``source_mask_nsigma``
+        times the background dispersion. The background is then estimated
+        from the remaining spaxels for each chunk of wavelengths.
+
+        Parameters
+        ----------
+        estimator : callable
+            Background estimator (see `BackgroundEstimator`).
+        bckgr_params : dict, optional
+            Parameters for the background estimator (the axis is set
+            internally). Default is None.
+        source_mask_nsigma : float, optional
+            Sigma level for masking sources. If None, all spaxels are used.
+            Default is 3.
+        chunk_size : int, optional
+            Number of wavelength pixels processed at once. Default is 100.
+
+        Returns
+        -------
+        np.ndarray
+            Estimated background.
+        np.ndarray
+            Estimated background standard deviation.
+        """
+        if bckgr_params is None:
+            bckgr_params = {}
+        bckgr_params = {key: value for key, value in bckgr_params.items()
+                        if key != "axis"}
+        if source_mask_nsigma is not None:
+            self.vprint("Building the source mask from the white image")
+            # Use the same amount of memory as each wavelength chunk
+            white_image = self.dc.get_white_image(
+                s_clip=None, memory_budget=4 * np.dtype(float).itemsize
+                * chunk_size * self.dc.n_rows * self.dc.n_cols)
+            white_bckgr, white_bckgr_sigma = estimator(
+                white_image.ravel(), axis=0, **bckgr_params)
+            sky_spaxels = ~(white_image > white_bckgr
+                            + source_mask_nsigma * white_bckgr_sigma)
+        else:
+            sky_spaxels = np.ones((self.dc.n_rows, self.dc.n_cols), dtype=bool)
+        self.vprint(f"Using {np.count_nonzero(sky_spaxels)} sky spaxels")
+
+        bckgr = np.full(self.dc.n_wavelength, fill_value=np.nan)
+        bckgr_sigma = np.full(self.dc.n_wavelength, fill_value=np.nan)
+        for start in range(0, self.dc.n_wavelength, chunk_size):
+            wave_slice = slice(start, start + chunk_size)
+            data = self.dc.get_section(wave_slice=wave_slice)[:, sky_spaxels]
+            bckgr[wave_slice], bckgr_sigma[wave_slice] = estimator(
+                data, axis=1, **bckgr_params)
+        return bckgr, bckgr_sigma
+
+
+# =============================================================================
+# Sky PCA
+# =============================================================================
+
+
+class SkyPCA(object):
+    """
+    Principal components of the sky emission learned from sky exposures.
+
+    The components are updated incrementally (see `partial_fit`), so that an
+    arbitrary number of exposures (e.g. all the `SkyOffset` frames of a
+    night) can be processed without stacking them in memory. Each update
+    combines the current components with the new spectra and computes a
+    (optionally randomised) truncated SVD.
+
+    Attributes
+    ----------
+    n_components : int
+        Number of principal components.
+    mean : np.ndarray
+        Mean sky spectrum.
+    components : np.ndarray
+        Sky eigenspectra, with shape (n_components, n_wavelength).
+    singular_values : np.ndarray
+        Singular values associated to each component.
+    n_spectra : int
+        Total number of spectra used to learn the components.
+    """
+
+    verbose = True
+
+    def __init__(self, n_components=10, svd_solver='randomized',
+                 n_oversamples=10, n_power_iter=2, random_state=None,
+                 verbose=True):
+        """
+        Initialize the SkyPCA.
+
+        Parameters
+        ----------
+        n_components : int, optional
+            Number of principal components. Default is 10.
+        svd_solver : str, optional
+            Either 'randomized' (default) or 'full'.
+        n_oversamples : int, optional
+            Additional random vectors used by the randomised SVD. Default is 10.
+        n_power_iter : int, optional
+            Number of power iterations of the randomised SVD. Default is 2.
+        random_state : int or np.random.Generator, optional
+            Seed of the randomised SVD. Default is None.
+        verbose : bool, optional
+            If True, print messages during execution. Default is True.
+        """
+        if svd_solver not in ('randomized', 'full'):
+            raise NameError(f"Unknown SVD solver {svd_solver}")
+        self.n_components = n_components
+        self.svd_solver = svd_solver
+        self.n_oversamples = n_oversamples
+        self.n_power_iter = n_power_iter
+        self.rng = np.random.default_rng(random_state)
+        self.verbose = verbose
+        self.mean = None
+        self.components = None
+        self.singular_values = None
+        self.n_spectra = 0
+
+    def vprint(self, *messages):
+        """Print messages if `verbose` is True."""
+        if self.verbose:
+            print("[SkyPCA]", *messages)
+
+    def _svd(self, matrix):
+        """Truncated SVD of ``matrix`` (returns S and Vt)."""
+        n_components = min(self.n_components, *matrix.shape)
+        n_random = n_components + self.n_oversamples
+        if self.svd_solver == 'full' or n_random >= min(matrix.shape):
+            _, s, vt = np.linalg.svd(matrix, full_matrices=False)
+            return s[:n_components], vt[:n_components]
+        # Randomised range finder (Halko et al. 2011)
+        q = matrix @ self.rng.standard_normal((matrix.shape[1], n_random))
+        q, _ = np.linalg.qr(q)
+        for _ in range(self.n_power_iter):
+            q, _ = np.linalg.qr(matrix.T @ q)
+            q, _ = np.linalg.qr(matrix @ q)
+        _, s, vt = np.linalg.svd(q.T @ matrix, full_matrices=False)
+        return s[:n_components], vt[:n_components]
+
+    def partial_fit(self, spectra):
+        """
+        Update the principal components with a new set of sky spectra.
+
+        Parameters
+        ----------
+        spectra : np.ndarray
+            Sky spectra with shape (n_spectra, n_wavelength). Non-finite
+            values are replaced by the mean value of each wavelength.
+
+        Returns
+        -------
+        self : SkyPCA
+        """
+        spectra = np.array(spectra, dtype=float, ndmin=2)
+        finite = np.isfinite(spectra)
+        with np.errstate(invalid='ignore'):
+            batch_mean = np.nansum(spectra, axis=0) / np.sum(finite, axis=0)
+        batch_mean = np.where(np.isfinite(batch_mean), batch_mean, 0)
+        spectra = np.where(finite, spectra, batch_mean[np.newaxis])
+        n_batch = spectra.shape[0]
+        if self.mean is None:
+            self.mean = np.zeros(spectra.shape[1])
+            self.components = np.zeros((0, spectra.shape[1]))
+            self.singular_values = np.zeros(0)
+        n_total = self.n_spectra + n_batch
+        # Combine the previous components with the new (centred) spectra and
+        # the correction due to the shift of the mean
+        matrix = np.vstack((
+            self.singular_values[:, np.newaxis] * self.components,
+            spectra - batch_mean[np.newaxis],
+            np.sqrt(self.n_spectra * n_batch / n_total)
+            * (self.mean - batch_mean)[np.newaxis]))
+        self.singular_values, self.components = self._svd(matrix)
+        self.mean = (self.n_spectra * self.mean + n_batch * batch_mean
+                     ) / n_total
+        self.n_spectra = n_total
+        return self
+
+    def fit_exposures(self, exposures):
+        """
+        Learn the principal components from a set of sky exposures.
+
+        The exposures are processed one at a time, so ``exposures`` can be a
+        generator that reads each file when needed.
+
+        Parameters
+        ----------
+        exposures : iterable
+            Iterable of `DataContainer` (e.g. RSS), `SkyModel` objects
+            with a ``dc`` attribute (e.g. `SkyOffset`) or intensity arrays.
+
+        Returns
+        -------
+        self : SkyPCA
+        """
+        t0 = time()
+        for n_exp, exposure in enumerate(exposures):
+            dc = getattr(exposure, 'dc', exposure)
+            intensity = np.asarray(getattr(dc, 'intensity', dc))
+            if intensity.ndim == 3:
+                intensity = intensity.reshape(intensity.shape[0], -1).T
+            self.partial_fit(intensity)
+            self.vprint(f"Exposure {n_exp + 1} added ({self.n_spectra}"
+                   + " sky spectra)")
+        self.vprint(f"Sky PCA updated ({time()-t0:.3g} s)")
+        return self
+
+    def get_sky(self, spectra, variance=None, wavelength_mask=None,
+                chunk_size=256):
+        """
+        Project a set of spectra onto the sky mean spectrum and components.
+
+        Parameters
+        ----------
+        spectra : np.ndarray
+            Spectra with shape (n_spectra, n_wavelength).
+        variance : np.ndarray, optional
+            Variance of the spectra, used to weight the fit. Default is None.
+        wavelength_mask : np.ndarray, optional
+            Boolean array selecting the wavelengths used in the fit (e.g.
+            those dominated by sky emission). Default is None (all).
+        chunk_size : int, optional
+            Number of spectra with different weights solved at once.
+            Default is 256.
+
+        Returns
+        -------
+        sky : np.ndarray
+            Sky model of each spectrum.
+        coefficients : np.ndarray
+            Coefficients of the mean spectrum and each component.
+        """
+        if self.components is None:
+            raise AttributeError("Sky PCA components have not been computed")
+        spectra = np.array(spectra, dtype=float, ndmin=2)
+        basis = np.vstack((self.mean[np.newaxis], self.components)).T
+        if variance is None:
+            weights = np.ones_like(spectra)
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weights = 1 / np.broadcast_to(variance, spectra.shape)
+            weights = np.where(np.isfinite(weights), weights, 0)
+        weights = weights * np.isfinite(spectra)
+        if wavelength_mask is not None:
+            weights = weights * wavelength_mask[np.newaxis]
+        data = np.where(weights > 0, spectra, 0)
+        coefficients = batched_weighted_lstsq(basis, data, weights, chunk_size)
+        return coefficients @ basis.T, coefficients
+
 
 # =============================================================================
 # Sky Substraction Correction
@@ -980,7 +1959,8 @@ class SkySubsCorrection(CorrectionBase):
             plt.close(fig)
         return fig
 
-    def apply(self, dc, pca=False, verbose=True, plot=False, **plot_kwargs):
+    def apply(self, dc, pca=False, verbose=True, plot=False, inplace=None,
+              **plot_kwargs):
         """
         Apply the sky emission correction to the datacube.
 
@@ -994,6 +1974,9 @@ class SkySubsCorrection(CorrectionBase):
             If True, print progress messages. Default is True.
         plot : bool, optional
             If True, generate and return plots of the correction. Default is False.
+        inplace : bool, optional
+            If True, the input DataContainer is modified. If None (default),
+            the `inplace` attribute is used.
         plot_kwargs : dict
             Additional keyword arguments for the plot.
 
@@ -1008,7 +1991,7 @@ class SkySubsCorrection(CorrectionBase):
         self.verbose = verbose
 
         # Copy input datacube to store the changes
-        dc_out = copy.deepcopy(dc)
+        dc_out = self.get_output_container(dc, inplace)
 
         self.corr_print("Applying sky subtraction")
 
@@ -1330,7 +2313,8 @@ class TelluricCorrection(CorrectionBase):
             plt.close(fig)
         return fig
 
-    def apply(self, rss, verbose=True, is_combined_cube=False, update=True):
+    def apply(self, rss, verbose=True, is_combined_cube=False, update=True,
+              inplace=None):
         """
         Apply the telluric correction to the input data.
 
@@ -1344,6 +2328,9 @@ class TelluricCorrection(CorrectionBase):
             Whether the input is a combined cube (default is False).
         update : bool, optional
             Whether to update the correction (default is True).
+        inplace : bool, optional
+            If True, the input data is modified. If None (default), the
+            `inplace` attribute is used.
 
         Returns
         -------
@@ -1351,19 +2338,21 @@ class TelluricCorrection(CorrectionBase):
             The corrected data.
         """
         self.verbose = verbose
+        telluric_correction, log_comments = self.get_correction_factor(
+            rss, update=update)
+        self.corr_print("Applying telluric correction to this star...")
+        return self.apply_correction_factor(rss, telluric_correction, inplace,
+                                            **log_comments)
 
+    def get_correction_factor(self, data_container, update=True):
+        """Return the telluric correction factor (see `CorrectionBase`)."""
         # Check wavelength
-        if not rss.wavelength.size == self.wlm.size or not np.allclose(rss.wavelength, self.wlm, equal_nan=True):
-            self.corr_vprint("Interpolating correction to input wavelength")
-            self.interpolate_model(rss.wavelength, update=update)
-
-        # Copy input RSS for storage the changes implemented in the task
-        rss_out = copy.deepcopy(rss)
-        self.corr_print("Applying telluric correction to this star...")
-        rss_out.intensity *= self.telluric_correction
-        rss_out.variance *= self.telluric_correction**2
-        self.log_correction(rss, status='applied')
-        return rss_out
+        if not data_container.wavelength.size == self.wlm.size or not np.allclose(
+                data_container.wavelength, self.wlm, equal_nan=True):
+            self.corr_print("Interpolating correction to input wavelength")
+            self.interpolate_model(data_container.wavelength, update=update)
+        return expand_spectral_dims(self.telluric_correction,
+                                    data_container), {}
 
     def interpolate_model(self, wavelength, update=True):
         """
@@ -1452,30 +2441,48 @@ class WaveletFilter(object):
         Relative wavelenght calibration. Offset, in pixels, with respect to the sky (from weighted cross-correlation).
     '''
 
-    def __init__(self, rss: RSS):
+    def __init__(self, rss: RSS, block_size=256, dtype=np.float32):
+        """
+        Parameters
+        ----------
+        - rss: RSS
+            Input Row-Stacked Spectra.
+        - block_size: int, default=256
+            Number of fibres processed at once. Operations along the fibre
+            axis (e.g. percentiles) are done in blocks of wavelengths that
+            use the same amount of memory.
+        - dtype: np.dtype, default=np.float32
+            Floating point type of the filtered intensity and the working
+            arrays. Cumulative sums are always computed in double precision.
+        """
+        n_fibres, n_wavelength = rss.intensity.shape
+        self.block_size = block_size
+        fibre_blocks = [slice(i, i + block_size)
+                        for i in range(0, n_fibres, block_size)]
 
         # 1. Estimate the FWHM of emission lines from the autocorrelation of the median (~ sky) spectrum.
 
-        x = np.nanmedian(rss.intensity, axis=0)  # median ~ sky spectrum
+        x = self._median_along_fibres(rss.intensity, n_fibres)  # median ~ sky spectrum
         x -= np.nanmean(x)
         x = scipy.signal.correlate(x, x, mode='same')
         h = (np.count_nonzero(x > 0.5*np.nanmax(x)) + 1) // 2
         # h = 0
         self.scale = 2*h + 1
+        s = self.scale
         print(f'> Wavelet filter scale: {self.scale} pixels')
 
         # 2. Apply a (mexican top hat) wavelet filter to detect features on that scale (i.e. filter out the continuum).
 
-        x = np.nancumsum(rss.intensity, axis=1)
-        self.filtered = (x[:, 2*self.scale:-self.scale] -
-                         x[:, self.scale:-2*self.scale]) / self.scale
-        self.filtered -= (x[:, 3*self.scale:] -
-                          x[:, :-3*self.scale]) / (3*self.scale)
+        self.filtered = np.empty((n_fibres, n_wavelength - 3*s), dtype=dtype)
+        for block in fibre_blocks:
+            x = np.nancumsum(rss.intensity[block], axis=1, dtype=np.float64)
+            self.filtered[block] = (x[:, 2*s:-s] - x[:, s:-2*s]) / s - (
+                x[:, 3*s:] - x[:, :-3*s]) / (3*s)
 
         # 3. Find regions actually dominated by sky lines (i.e. exclude lines from the target).
 
-        self.sky_lo, self.sky, self.sky_hi = np.nanpercentile(
-            self.filtered, [16, 50, 84], axis=0)
+        self.sky_lo, self.sky, self.sky_hi = self._median_along_fibres(
+            self.filtered, n_fibres, percentiles=[16, 50, 84])
         self.sky_weight = 1 - \
             np.exp(-.5 * (self.sky / np.fmax((self.sky - self.sky_lo),
                    (self.sky_hi - self.sky)))**2)
@@ -1485,24 +2492,25 @@ class WaveletFilter(object):
 
         # 4. Estimate fibre throughput from norm (standard deviation).
 
-        # should be irrelevant
-        self.filtered -= np.nanmean(self.filtered, axis=1)[:, np.newaxis]
-        self.filtered *= self.sky_weight
-        # self.fibre_throughput = np.nanstd(self.filtered, axis=1)
-        # self.fibre_throughput = np.nanmedian(self.filtered, axis=1)
-        # self.filtered /= self.fibre_throughput[:, np.newaxis]
-        self.filtered[~ np.isfinite(self.filtered)] = 0
-
-        # self.fibre_throughput = np.nanmedian(self.filtered / self.sky, axis=1)
-        x = np.exp(-.5 * ((self.filtered - self.sky) /
-                   (self.sky_hi - self.sky_lo))**2)
-        x *= self.sky_weight[np.newaxis, :]
-        # self.fibre_throughput = np.nanmean(x * self.filtered / self.sky[np.newaxis, :], axis=1) / np.nanmean(x)
-        x = np.where(x > 0.5, self.filtered / self.sky[np.newaxis, :], np.nan)
-        self.fibre_throughput = np.nanmedian(x, axis=1)
+        sky = self.sky.astype(dtype)
+        sky_weight = self.sky_weight.astype(dtype)
+        sky_width = (self.sky_hi - self.sky_lo).astype(dtype)
+        self.fibre_throughput = np.empty(n_fibres)
+        for block in fibre_blocks:
+            filtered = self.filtered[block]
+            # should be irrelevant
+            filtered -= np.nanmean(filtered, axis=1)[:, np.newaxis]
+            filtered *= sky_weight
+            filtered[~ np.isfinite(filtered)] = 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                x = np.exp(-.5 * ((filtered - sky) / sky_width)**2)
+                x *= sky_weight[np.newaxis, :]
+                x = np.where(x > 0.5, filtered / sky[np.newaxis, :], np.nan)
+            self.fibre_throughput[block] = np.nanmedian(x, axis=1)
         renorm = np.nanmedian(self.fibre_throughput)
         self.fibre_throughput /= renorm
-        self.filtered /= self.fibre_throughput[:, np.newaxis]
+        for block in fibre_blocks:
+            self.filtered[block] /= self.fibre_throughput[block, np.newaxis]
         self.sky *= renorm
         self.sky_lo *= renorm
         self.sky_hi *= renorm
@@ -1519,17 +2527,43 @@ class WaveletFilter(object):
         else:
             raise TypeError(f'  ERROR: wrong wavelength units ({x.unit})')
 
-        # mid = rss.intensity.shape[1] // 2
-        mid = self.wavelength.size // 2
-        s = self.scale
-        x = np.nanmedian(self.filtered, axis=0)
-        x[~ np.isfinite(x)] = 0
-        x = scipy.signal.fftconvolve(
-            self.filtered, x[np.newaxis, ::-1], mode='same', axes=1)[:, mid-s:mid+s+1]
-        idx = np.arange(x.shape[1])
-        weight = np.where(x > 0, x, 0)
+        # Only the lags within [-s, s] are needed: each one is the dot
+        # product of the filtered spectra with a shifted copy of the median
+        template = self._median_along_fibres(self.filtered, n_fibres)
+        template[~ np.isfinite(template)] = 0
+        n_filtered = template.size
+        lags = s - np.arange(2*s + 1)
+        index = np.arange(n_filtered)[:, np.newaxis] + lags[np.newaxis, :]
+        valid = (index >= 0) & (index < n_filtered)
+        shifted = np.where(valid, template[np.clip(index, 0, n_filtered - 1)],
+                           0).astype(dtype)
+        correlation = np.empty((n_fibres, lags.size))
+        for block in fibre_blocks:
+            correlation[block] = self.filtered[block] @ shifted
+        weight = np.where(correlation > 0, correlation, 0)
         self.fibre_offset = np.nansum(
-            (idx - s)[np.newaxis, :] * weight, axis=1) / np.nansum(weight, axis=1)
+            (np.arange(lags.size) - s)[np.newaxis, :] * weight, axis=1
+            ) / np.nansum(weight, axis=1)
+
+    def _median_along_fibres(self, data, n_fibres, percentiles=None):
+        """Median (or percentiles) along the fibre axis, in wavelength blocks.
+
+        Each block contains about ``block_size * n_wavelength`` elements.
+        """
+        n_wavelength = data.shape[1]
+        wave_block = max(1, self.block_size * n_wavelength // max(n_fibres, 1))
+        if percentiles is None:
+            result = np.empty(n_wavelength)
+        else:
+            result = np.empty((len(percentiles), n_wavelength))
+        for start in range(0, n_wavelength, wave_block):
+            block = slice(start, start + wave_block)
+            if percentiles is None:
+                result[block] = np.nanmedian(data[:, block], axis=0)
+            else:
+                result[:, block] = np.nanpercentile(
+                    data[:, block], percentiles, axis=0)
+        return result
 
     def qc_plots(self, show=False, save_as=None):
         '''
@@ -1561,10 +2595,109 @@ class WaveletFilter(object):
             fig.savefig(save_as)
 
     def get_throughput_object(self):
-        return Throughput(throughput_data=np.repeat(self.fibre_throughput[:, np.newaxis], self.wavelength.size + 3*self.scale, axis=1))
+        return Throughput(throughput_data=self.fibre_throughput,
+                          n_wavelength=self.wavelength.size + 3*self.scale)
 
     def get_wavelength_offset(self):
-        return WavelengthOffset(offset_data=np.repeat(self.fibre_offset[:, np.newaxis], self.wavelength.size + 3*self.scale, axis=1))
+        return WavelengthOffset(offset_data=self.fibre_offset,
+                                n_wavelength=self.wavelength.size + 3*self.scale)
+
+
+def segment_nansum(data, left, right):
+    """Sum the values of ``data`` within a set of segments along the last axis.
+
+    The segments are defined by the ``left`` (included) and ``right``
+    (excluded) indices, and they are all reduced at once using
+    `np.add.reduceat`. NaN values are ignored.
+
+    Parameters
+    ----------
+    - data: np.ndarray
+        Input array (e.g. a spectrum or a set of spectra).
+    - left: np.ndarray
+        1D array with the first index of each segment.
+    - right: np.ndarray
+        1D array with the last index (excluded) of each segment.
+
+    Returns
+    -------
+    - segment_sum: np.ndarray
+        Array with the same shape as ``data`` except for the last axis, which
+        contains one element per segment.
+    - segment_count: np.ndarray
+        Number of finite values within each segment.
+    """
+    data = np.asarray(data)
+    left = np.asarray(left, dtype=int)
+    right = np.asarray(right, dtype=int)
+    if left.size == 0:
+        empty = np.zeros(data.shape[:-1] + (0,))
+        return empty, empty.astype(int)
+    finite = np.isfinite(data)
+    # Pad the last axis so that every segment boundary is a valid index
+    padding = [(0, 0)] * (data.ndim - 1) + [(0, 1)]
+    values = np.pad(np.where(finite, data, 0), padding)
+    finite = np.pad(finite, padding).astype(int)
+    # Segments may not be sorted: reduce over the sorted boundaries
+    order = np.argsort(left, kind='stable')
+    boundaries = np.column_stack((left[order], right[order])).ravel()
+    sort_boundaries = np.argsort(boundaries, kind='stable')
+    segment_sum = np.add.reduceat(
+        values, boundaries[sort_boundaries], axis=-1)
+    segment_count = np.add.reduceat(
+        finite, boundaries[sort_boundaries], axis=-1)
+    # Position of each segment start within the sorted boundaries
+    position = np.empty_like(sort_boundaries)
+    position[sort_boundaries] = np.arange(sort_boundaries.size)
+    start = position[0::2]
+    end = position[1::2]
+    if np.any(end != start + 1):
+        raise ValueError("Overlapping segments are not supported")
+    segment_sum = segment_sum[..., start]
+    segment_count = segment_count[..., start]
+    # reduceat returns the first value for empty segments
+    empty = (right[order] <= left[order])
+    segment_sum[..., empty] = 0
+    segment_count[..., empty] = 0
+    # Restore the input order of the segments
+    unsort = np.empty_like(order)
+    unsort[order] = np.arange(order.size)
+    return segment_sum[..., unsort], segment_count[..., unsort]
+
+
+def line_centroids(wavelength, spectra, left, right):
+    """Compute the centroid and mean intensity of a set of emission lines.
+
+    The centroid of each line is weighted by the square of the intensity.
+    All lines (and spectra) are measured at once using `segment_nansum`.
+
+    Parameters
+    ----------
+    - wavelength: np.ndarray
+        1D wavelength array.
+    - spectra: np.ndarray
+        Spectrum or set of spectra (with shape (n_spectra, wavelength.size)).
+    - left: np.ndarray
+        First index of each line.
+    - right: np.ndarray
+        Last index (excluded) of each line.
+
+    Returns
+    -------
+    - line_wavelength: np.ndarray
+        Intensity-weighted centroid of each line.
+    - line_intensity: np.ndarray
+        Mean intensity of each line.
+    """
+    spectra = np.asarray(spectra)
+    weight = spectra**2
+    weight_sum, _ = segment_nansum(weight, left, right)
+    wave_sum, _ = segment_nansum(weight * wavelength, left, right)
+    intensity_sum, intensity_count = segment_nansum(spectra, left, right)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        line_wavelength = wave_sum / weight_sum
+        line_intensity = intensity_sum / intensity_count
+    return line_wavelength, line_intensity
 
 
 class SkySelfCalibration(CorrectionBase):
@@ -1599,13 +2732,13 @@ class SkySelfCalibration(CorrectionBase):
         self.continuum.strong_sky_lines.add_column(
             0.*u.Angstrom, name='sky_wavelength')
         self.continuum.strong_sky_lines.add_column(0., name='sky_intensity')
-        for line in self.continuum.strong_sky_lines:
-            wavelength = self.dc.wavelength[line['left']:line['right']]
-            spectrum = sky_lines[line['left']:line['right']]
-            weight = spectrum**2
-            line['sky_wavelength'] = np.nansum(
-                weight*wavelength) / np.nansum(weight)
-            line['sky_intensity'] = np.nanmean(spectrum)
+        sky_wavelength, sky_intensity = line_centroids(
+            self.dc.wavelength.to_value(u.Angstrom), sky_lines,
+            self.continuum.strong_sky_lines['left'],
+            self.continuum.strong_sky_lines['right'])
+        self.continuum.strong_sky_lines['sky_wavelength'] = (
+            sky_wavelength * u.Angstrom)
+        self.continuum.strong_sky_lines['sky_intensity'] = sky_intensity
 
     # TODO: Don't assume RSS format (intensity[spec_id, wavelength])
 
@@ -1618,39 +2751,45 @@ class SkySelfCalibration(CorrectionBase):
         self.relative_throughput_err = np.zeros(n_spectra)
         print(f"> Calibrating for {n_spectra} spectra:")
         t0 = time()
-        for spec_id in range(n_spectra):
-            line_wavelength, line_intensity = self.measure_lines(spec_id)
-            y = line_wavelength - \
-                self.continuum.strong_sky_lines['sky_wavelength']
-            self.wavelength_offset[spec_id] = stats.biweight.biweight_location(
-                y)
-            self.wavelength_offset_err[spec_id] = stats.biweight.biweight_scale(
-                y)
-            y = line_intensity / \
-                self.continuum.strong_sky_lines['sky_intensity']
-            self.relative_throughput[spec_id] = stats.biweight.biweight_location(
-                y)
-            self.relative_throughput_err[spec_id] = stats.biweight.biweight_scale(
-                y)
+        # Measure all lines in all spectra at once
+        line_wavelength, line_intensity = self.measure_lines()
+        y = line_wavelength - \
+            self.continuum.strong_sky_lines['sky_wavelength'][np.newaxis]
+        self.wavelength_offset[:] = stats.biweight.biweight_location(
+            y, axis=1)
+        self.wavelength_offset_err[:] = stats.biweight.biweight_scale(
+            y, axis=1)
+        y = line_intensity / \
+            self.continuum.strong_sky_lines['sky_intensity'][np.newaxis]
+        self.relative_throughput[:] = stats.biweight.biweight_location(
+            y, axis=1)
+        self.relative_throughput_err[:] = stats.biweight.biweight_scale(
+            y, axis=1)
         print(f"  Done ({time()-t0:.3g} s)")
 
-    def measure_lines(self, spec_id):
-        intensity = self.dc.intensity[spec_id]
-        continuum = self.continuum.intensity[spec_id]
-        sky_wavelength = self.continuum.strong_sky_lines['sky_wavelength'].to_value(
-            u.Angstrom)
-        line_wavelength = np.zeros_like(sky_wavelength)
-        sky_intensity = self.continuum.strong_sky_lines['sky_intensity']
-        line_intensity = np.zeros_like(sky_intensity)
-        wavelength = self.dc.wavelength.to_value(u.Angstrom)
-        for i, line in enumerate(self.continuum.strong_sky_lines):
-            section_wavelength = wavelength[line['left']:line['right']]
-            section_intensity = (
-                intensity - continuum)[line['left']:line['right']]
-            weight = section_intensity**2
-            line_wavelength[i] = np.nansum(
-                weight*section_wavelength) / np.nansum(weight)
-            line_intensity[i] = np.nanmean(section_intensity)
+    def measure_lines(self, spec_id=None):
+        """Measure the centroid and mean intensity of the strong sky lines.
+
+        Parameters
+        ----------
+        - spec_id: int or array-like, default=None
+            Spectra to be measured. If None, all spectra are measured.
+
+        Returns
+        -------
+        - line_wavelength: astropy.units.Quantity
+            Centroid of each line, with shape (n_spectra, n_lines) (or
+            (n_lines,) if a single spectrum is selected).
+        - line_intensity: np.ndarray
+            Mean intensity of each line.
+        """
+        if spec_id is None:
+            spec_id = slice(None)
+        residuals = self.dc.intensity[spec_id] - self.continuum.intensity[spec_id]
+        line_wavelength, line_intensity = line_centroids(
+            self.dc.wavelength.to_value(u.Angstrom), residuals,
+            self.continuum.strong_sky_lines['left'],
+            self.continuum.strong_sky_lines['right'])
         return line_wavelength*u.Angstrom, line_intensity
 
     def apply(self, rss, verbose=True, is_combined_cube=False, update=True):
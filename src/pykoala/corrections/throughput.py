@@ -3,7 +3,6 @@
 # =============================================================================
 from os import path
 import numpy as np
-import copy
 from astropy.io import fits
 from scipy.ndimage import median_filter
 # from scipy.ndimage import gaussian_filter
@@ -15,26 +14,85 @@ from scipy.ndimage import median_filter
 # KOALA packages
 # =============================================================================
 # Modular
-from pykoala.corrections.correction import CorrectionBase
+from pykoala.corrections.correction import (CorrectionBase, fibre_array,
+                                             compact_fibre_array)
 from pykoala.rss import RSS
 from pykoala import ancillary
 
 
 class Throughput(object):
-    def __init__(self, path=None, throughput_data=None, throughput_error=None):
+    """Fibre throughput class.
+
+    The throughput can be stored as a full 2D array (n_fibres x
+    n_wavelengths) or in a compact form: one value per fibre (e.g. a 1D
+    array or a broadcast view) or per-fibre polynomials (see
+    `correction.fibre_array`). Compact throughputs are applied by
+    broadcasting, and they are only expanded when saved into a FITS file.
+
+    Attributes
+    ----------
+    - throughput_data: np.ndarray
+        Throughput (full or one value per fibre).
+    - throughput_error: np.ndarray
+        Error of the throughput (full or one value per fibre).
+    - throughput_poly: np.ndarray
+        Polynomial coefficients of each fibre, used if `throughput_data`
+        is None.
+    - n_wavelength: int
+        Number of wavelength pixels.
+    """
+    throughput_data = None
+    throughput_error = None
+    throughput_poly = None
+    n_wavelength = None
+
+    def __init__(self, path=None, throughput_data=None, throughput_error=None,
+                 throughput_poly=None, n_wavelength=None):
         self.path = path
-        self.throughput_data = throughput_data
-        self.throughput_error = throughput_error
+        self.throughput_data, data_n_wavelength = compact_fibre_array(
+            throughput_data)
+        self.throughput_error, _ = compact_fibre_array(throughput_error)
+        self.throughput_poly = throughput_poly
+        self.n_wavelength = n_wavelength
+        if self.n_wavelength is None:
+            self.n_wavelength = data_n_wavelength
 
         if self.path is not None and self.throughput_data is None:
             self.load_fits()
 
+    def get_throughput_data(self, n_wavelength=None, expand=False):
+        """Return the throughput as an array that broadcasts to the RSS shape.
+
+        Parameters
+        ----------
+        - n_wavelength: int, default=None
+            Number of wavelength pixels. If None, `n_wavelength` is used.
+        - expand: bool, default=False
+            If True, return an (n_fibres x n_wavelength) view.
+
+        Returns
+        -------
+        - throughput: np.ndarray
+        """
+        if n_wavelength is None:
+            n_wavelength = self.n_wavelength
+        return fibre_array(self.throughput_data, self.throughput_poly,
+                           n_wavelength, expand)
+
+    def get_throughput_error(self, n_wavelength=None, expand=False):
+        """Return the throughput error (see `get_throughput_data`)."""
+        if n_wavelength is None:
+            n_wavelength = self.n_wavelength
+        return fibre_array(self.throughput_error, None, n_wavelength, expand)
+
     def tofits(self, output_path):
         primary = fits.PrimaryHDU()
-        thr = fits.ImageHDU(data=self.throughput_data,
-                            name='THROU')
-        thr_err = fits.ImageHDU(data=self.throughput_error,
-                                name='THROUERR')
+        thr = fits.ImageHDU(data=np.ascontiguousarray(
+            self.get_throughput_data(expand=True)), name='THROU')
+        thr_err = self.get_throughput_error(expand=True)
+        if thr_err is not None:
+            thr_err = np.ascontiguousarray(thr_err)
+        thr_err = fits.ImageHDU(data=thr_err, name='THROUERR')
         hdul = fits.HDUList([primary, thr, thr_err])
         hdul.writeto(output_path, overwrite=True)
         hdul.close(verbose=True)
@@ -52,6 +110,7 @@ class Throughput(object):
         with fits.open(self.path) as hdul:
             self.throughput_data = hdul[1].data
             self.throughput_error = hdul[2].data
+        self.n_wavelength = self.throughput_data.shape[-1]
 
 
 class ThroughputCorrection(CorrectionBase):
@@ -68,7 +127,7 @@ class ThroughputCorrection(CorrectionBase):
     name : str
         Correction name, to be recorded in the log.
     throughput : Throughput
-        2D fibre throughput (n_fibres x n_wavelengths).
+        Fibre throughput (n_fibres x n_wavelengths, or a compact form).
     verbose: bool
         False by default.
     """
@@ -146,7 +205,7 @@ class ThroughputCorrection(CorrectionBase):
                                 throughput_error=throughput_error)
         return throughput
 
-    def apply(self, rss, throughput=None, plot=True):
+    def apply(self, rss, throughput=None, plot=True, inplace=None):
         """Apply a 2D throughput model to a RSS.
 
         Parameters
@@ -156,6 +215,9 @@ class ThroughputCorrection(CorrectionBase):
         throughput: Throughput
             Throughput object to be applied.
         plot : bool, optional, default=True
+        inplace : bool, optional, default=None
+            If True, the input RSS is modified. If None, the `inplace`
+            attribute is used.
 
         Returns
         -------
@@ -163,9 +225,15 @@ class ThroughputCorrection(CorrectionBase):
             Corrected RSS object.
         """
 
-        if throughput is None and self.throughput is not None:
+        factor, log_comments = self.get_correction_factor(rss, throughput)
+        return self.apply_correction_factor(rss, factor, inplace,
+                                            **log_comments)
+
+    def get_correction_factor(self, rss, throughput=None):
+        """Return the inverse of the throughput (see `CorrectionBase`)."""
+        if throughput is None:
             throughput = self.throughput
-        else:
+        if throughput is None:
             raise RuntimeError("Throughput not provided!")
 
         if type(throughput) is not Throughput:
@@ -176,15 +244,7 @@ class ThroughputCorrection(CorrectionBase):
             raise ValueError(
                 "Throughput can only be applied to RSS data:\n input {}"
                 .format(type(rss)))
-        # =============================================================================
-        # Copy input RSS for storage the changes implemented in the task
-        # =============================================================================
-        rss_out = copy.deepcopy(rss)
-
-        rss_out.intensity = rss_out.intensity / throughput.throughput_data
-        rss_out.variance = rss_out.variance / throughput.throughput_data**2
-        self.log_correction(rss_out, status='applied')
-        return rss_out
+        return 1 / throughput.get_throughput_data(rss.wavelength.size), {}
 
 # =============================================================================
 # Mr Krtxo \(ﾟ▽ﾟ)/
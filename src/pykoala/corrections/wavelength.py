@@ -1,38 +1,80 @@
 import os
+import hashlib
 import numpy as np
-import copy
 from astropy.io import fits
 
-from pykoala.corrections.correction import CorrectionBase
+from pykoala.corrections.correction import (CorrectionBase, fibre_array,
+                                             compact_fibre_array)
 from pykoala.rss import RSS
-from pykoala.ancillary import flux_conserving_interpolation
+from pykoala.ancillary import flux_conserving_operator, flux_conserving_interpolation_2d
 
 
 class WavelengthOffset(object):
     """Wavelength offset class.
 
-    This class stores a 2D wavelength offset.
+    This class stores a 2D wavelength offset. As `Throughput`, the offset
+    can also be stored in a compact form (one value per fibre or per-fibre
+    polynomials, see `correction.fibre_array`), which is only expanded when
+    saved into a FITS file.
 
     Attributes
     ----------
-    offset_data : wavelength offset, in pixels
+    offset_data : wavelength offset, in pixels (full or one value per fibre)
     offset_error : standard deviation of `offset_data`
+    offset_poly : polynomial coefficients of each fibre, used if `offset_data` is None
+    n_wavelength : number of wavelength pixels
     """
     offset_data = None
     offset_error = None
+    offset_poly = None
+    n_wavelength = None
 
-    def __init__(self, path=None, offset_data=None, offset_error=None):
+    def __init__(self, path=None, offset_data=None, offset_error=None,
+                 offset_poly=None, n_wavelength=None):
         self.path = path
-        self.offset_data = offset_data
-        self.offset_error = offset_error
+        self.offset_data, data_n_wavelength = compact_fibre_array(offset_data)
+        self.offset_error, _ = compact_fibre_array(offset_error)
+        self.offset_poly = offset_poly
+        self.n_wavelength = n_wavelength
+        if self.n_wavelength is None:
+            self.n_wavelength = data_n_wavelength
 
         if self.path is not None and self.offset_data is None:
             self.load_fits()
 
+    def get_offset_data(self, n_wavelength=None, expand=False):
+        """Return the offset as an array that broadcasts to the RSS shape.
+
+        Parameters
+        ----------
+        n_wavelength : int, optional
+            Number of wavelength pixels. If None, `n_wavelength` is used.
+        expand : bool, optional
+            If True, return an (n_fibres x n_wavelength) view.
+
+        Returns
+        -------
+        offset : np.ndarray
+        """
+        if n_wavelength is None:
+            n_wavelength = self.n_wavelength
+        return fibre_array(self.offset_data, self.offset_poly, n_wavelength,
+                           expand)
+
+    def get_offset_error(self, n_wavelength=None, expand=False):
+        """Return the offset error (see `get_offset_data`)."""
+        if n_wavelength is None:
+            n_wavelength = self.n_wavelength
+        return fibre_array(self.offset_error, None, n_wavelength, expand)
+
     def tofits(self, output_path):
         primary = fits.PrimaryHDU()
-        data = fits.ImageHDU(data=self.offset_data, name='OFFSET')
-        error = fits.ImageHDU(data=self.offset_error, name='OFFSET_ERR')
+        data = fits.ImageHDU(data=np.ascontiguousarray(
+            self.get_offset_data(expand=True)), name='OFFSET')
+        error = self.get_offset_error(expand=True)
+        if error is not None:
+            error = np.ascontiguousarray(error)
+        error = fits.ImageHDU(data=error, name='OFFSET_ERR')
         hdul = fits.HDUList([primary, data, error])
         hdul.writeto(output_path, overwrite=True)
         hdul.close(verbose=True)
@@ -50,6 +92,7 @@ class WavelengthOffset(object):
         with fits.open(self.path) as hdul:
             self.offset_data = hdul[1].data
             self.offset_error = hdul[2].data
+        self.n_wavelength = self.offset_data.shape[-1]
 
 
 class WavelengthCorrection(CorrectionBase):
@@ -62,13 +105,15 @@ class WavelengthCorrection(CorrectionBase):
     name : str
         Correction name, to be recorded in the log.
     offset : WavelengthOffset
-        2D wavelength offset (n_fibres x n_wavelengths)
+        Wavelength offset (n_fibres x n_wavelengths, or a compact form)
     verbose: bool
         False by default.
     """
     name = "WavelengthCorrection"
     offset = None
     verbose = False
+    _operator = None
+    _operator_key = None
 
     def __init__(self, **kwargs):
         super().__init__()
@@ -77,13 +122,16 @@ class WavelengthCorrection(CorrectionBase):
         self.offset = kwargs.get('offset', WavelengthOffset(path=path))
         assert isinstance(self.offset, WavelengthOffset)
 
-    def apply(self, rss):
+    def apply(self, rss, inplace=None):
         """Apply a 2D wavelength offset model to a RSS.
 
         Parameters
         ----------
         rss : RSS
             Original Row-Stacked-Spectra object to be corrected.
+        inplace : bool, optional, default=None
+            If True, the input RSS is modified. If None, the `inplace`
+            attribute is used.
 
         Returns
         -------
@@ -93,15 +141,44 @@ class WavelengthCorrection(CorrectionBase):
 
         assert isinstance(rss, RSS)
 
-        rss_out = copy.deepcopy(rss)
-        x = np.arange(rss.wavelength.size)
-        for i in range(rss.intensity.shape[0]):
-            rss_out.intensity[i] = flux_conserving_interpolation(
-                x, x - self.offset.offset_data[i], rss.intensity[i])
+        rss_out = self.get_output_container(rss, inplace)
+        intensity, variance = flux_conserving_interpolation_2d(
+            None, None, rss.intensity, rss.variance,
+            operator=self.get_operator(rss.wavelength.size))
+        rss_out.intensity = intensity.astype(rss.intensity.dtype, copy=False)
+        rss_out.variance = variance.astype(rss.variance.dtype, copy=False)
 
         self.log_correction(rss_out, status='applied')
         return rss_out
 
+    def get_operator(self, n_wavelength):
+        """Return the sparse operator that resamples every fibre.
+
+        The operator (see `ancillary.flux_conserving_operator`) only depends
+        on the offset and the number of wavelength pixels, so it is computed
+        once and reused for every RSS sharing the same offset. The cached
+        operator is identified by the contents of the offset, so that it is
+        recomputed whenever the offset is modified.
+
+        Parameters
+        ----------
+        n_wavelength : int
+            Number of wavelength pixels of the RSS.
+
+        Returns
+        -------
+        operator : scipy.sparse.csr_matrix
+        """
+        offset = np.ascontiguousarray(
+            self.offset.get_offset_data(n_wavelength))
+        key = (n_wavelength, offset.shape, offset.dtype.str,
+               hashlib.sha1(offset.tobytes()).hexdigest())
+        if self._operator is None or self._operator_key != key:
+            x = np.arange(n_wavelength)
+            self._operator = flux_conserving_operator(x, x - offset)
+            self._operator_key = key
+        return self._operator
+
 # =============================================================================
 # Mr Krtxo \(ﾟ▽ﾟ)/
 #                                                       ... Paranoy@ Rulz! ;^D
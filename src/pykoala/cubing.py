@@ -3,8 +3,12 @@
 # =============================================================================
 import numpy as np
 import copy
+import os
+import tempfile
 
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 # =============================================================================
 # Astropy and associated packages
 # =============================================================================
@@ -15,10 +19,18 @@ from astropy.coordinates import SkyCoord
 # KOALA packages
 # =============================================================================
 from pykoala import ancillary
-from pykoala.data_container import DataContainer
+from pykoala import config
+from pykoala.data_container import DataContainer, DataMask
 from pykoala.plotting import qc_plot
 from pykoala import __version__
 from scipy.special import erf
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+# Default memory budget (GB) used when stacking out-of-core cubes
+DEFAULT_MEMORY_BUDGET_GB = 1.0
+# Approximate number of stack-sized arrays allocated by the stacking methods
+STACKING_MEMORY_FACTOR = 8
 
 class CubeStacking:
     """Collection of cubing stacking methods.
@@ -109,21 +121,156 @@ class CubeStacking:
         stacked_variance = np.nansum(variances, axis=0) / cubes.shape[0]**2
         return stacked_cube, stacked_variance
 
+    def sigma_clipping_chunked(cubes: np.ndarray, variances: np.ndarray,
+                               slab_size=None, n_threads=None,
+                               memory_budget=None, **kwargs):
+        """Perform cube stacking using STD clipping over wavelength slabs.
+
+        Equivalent to `sigma_clipping`, but the stack is processed in slabs
+        along the wavelength axis so that the temporary arrays are bounded by
+        the size of one slab.
+
+        Parameters
+        ----------
+        - cubes: np.ndarray
+            See `sigma_clipping`.
+        - variances: np.ndarray
+            See `sigma_clipping`.
+        - slab_size: int, optional
+            Number of wavelength pixels per slab.
+        - n_threads: int, optional
+            Number of threads used to process the slabs.
+        - memory_budget: float, optional
+            Memory budget (bytes) used to set the slab size when `slab_size`
+            is not provided.
+        - kwargs:
+            Additional arguments passed to `sigma_clipping`.
+
+        Returns
+        -------
+        - stacked_cube: np.ndarray
+        - stacked_variance: np.ndarray
+        """
+        return stack_in_wavelength_slabs(
+            CubeStacking.sigma_clipping, cubes, variances,
+            memory_budget=memory_budget, slab_size=slab_size,
+            n_threads=n_threads, **kwargs)
+
+    def mad_clipping_chunked(cubes: np.ndarray, variances: np.ndarray,
+                             slab_size=None, n_threads=None,
+                             memory_budget=None, **kwargs):
+        """Perform cube stacking using MAD clipping over wavelength slabs.
+
+        Equivalent to `mad_clipping`, but the stack is processed in slabs
+        along the wavelength axis so that the temporary arrays are bounded by
+        the size of one slab.
+
+        Parameters
+        ----------
+        - cubes: np.ndarray
+            See `mad_clipping`.
+        - variances: np.ndarray
+            See `mad_clipping`.
+        - slab_size: int, optional
+            Number of wavelength pixels per slab.
+        - n_threads: int, optional
+            Number of threads used to process the slabs.
+        - memory_budget: float, optional
+            Memory budget (bytes) used to set the slab size when `slab_size`
+            is not provided.
+        - kwargs:
+            Additional arguments passed to `mad_clipping`.
+
+        Returns
+        -------
+        - stacked_cube: np.ndarray
+        - stacked_variance: np.ndarray
+        """
+        return stack_in_wavelength_slabs(
+            CubeStacking.mad_clipping, cubes, variances,
+            memory_budget=memory_budget, slab_size=slab_size,
+            n_threads=n_threads, **kwargs)
+
 # -------------------------------------------
 # Fibre Interpolation and cube reconstruction
 # -------------------------------------------
 
 class InterpolationKernel(object):
+    """Base class of the fibre interpolation kernels.
+
+    Attributes
+    ----------
+    - scale: float
+        Kernel scale in pixels.
+    - truncation_radius: float
+        Truncation radius in units of the scale.
+    - pixel_scale_arcsec: float
+        Pixel size in arcseconds.
+    - phase_resolution: int, default=None
+        If provided, the kernel weights are stored in a lookup table indexed
+        by the sub-pixel phase of the kernel centre, quantised in
+        `phase_resolution` steps per pixel (see `cached_kernel_2D`). The
+        kernel centre is then displaced by at most 0.5 / phase_resolution
+        pixels along each axis.
+    """
     def __init__(self, scale, *args, **kwargs):
         self.scale = scale
         self.truncation_radius = kwargs.get("truncation_radius", 1.0)
         self.pixel_scale_arcsec = kwargs.get("pixel_scale_arcsec")
+        self.phase_resolution = kwargs.get("phase_resolution", None)
+        self._phase_tables = {}
 
     def truncation_normalization(self):
         pass
-        
+
     def kernel(self, z):
-        pass  
+        pass
+
+    def cached_kernel_2D(self, x_edges, y_edges):
+        """Evaluate `kernel_2D` using the sub-pixel phase lookup table.
+
+        The input edges must be evenly spaced by one pixel. The weights only
+        depend on the fractional pixel offset of the kernel centre, so they
+        are computed once for each quantised phase over a box that contains
+        the full kernel, and then sliced. If `phase_resolution` is None or the
+        edges fall outside the tabulated box, `kernel_2D` is used directly.
+
+        Parameters
+        ----------
+        - x_edges: np.ndarray
+            Pixel edges along the first axis (rows) relative to the kernel
+            centre.
+        - y_edges: np.ndarray
+            Pixel edges along the second axis (columns) relative to the kernel
+            centre.
+
+        Returns
+        -------
+        - weights: np.ndarray
+            Kernel weights of each pixel. When read from the lookup table, the
+            array is read-only.
+        """
+        if self.phase_resolution is None:
+            return self.kernel_2D(x_edges, y_edges)
+        resolution = int(self.phase_resolution)
+        n_x, phase_x = divmod(int(np.round((x_edges[0] + 0.5) * resolution)),
+                              resolution)
+        n_y, phase_y = divmod(int(np.round((y_edges[0] + 0.5) * resolution)),
+                              resolution)
+        half_size = int(np.ceil(self.scale * self.truncation_radius)) + 4
+        if (n_x < -half_size or n_x + x_edges.size - 1 > half_size
+                or n_y < -half_size or n_y + y_edges.size - 1 > half_size):
+            return self.kernel_2D(x_edges, y_edges)
+
+        table = self._phase_tables.get((phase_x, phase_y))
+        if table is None:
+            table_edges = np.arange(-half_size, half_size + 1) - 0.5
+            table = self.kernel_2D(table_edges + phase_x / resolution,
+                                   table_edges + phase_y / resolution)
+            table.flags.writeable = False
+            self._phase_tables[(phase_x, phase_y)] = table
+        return table[n_x + half_size: n_x + half_size + x_edges.size - 1,
+                     n_y + half_size: n_y + half_size + y_edges.size - 1]
 
 class ParabolicKernel(InterpolationKernel):
     def __init__(self, scale, *args, **kwargs):
@@ -205,15 +352,13 @@ class DrizzlingKernel(TopHatKernel):
         pass
 
     def kernel_2D(self, x_edges, y_edges):
-        weights = np.zeros((x_edges.size - 1, y_edges.size - 1))
         # x == rows, y == columns
-        pix_edge_x, pix_edge_y = np.meshgrid(x_edges[:-1], y_edges[:-1])
-        for i, (px, py) in enumerate(
-            zip(pix_edge_x.flatten(), pix_edge_y.flatten())):
-            _, area_fraction = ancillary.pixel_in_circle(
-                (px, py), pixel_size=1, circle_pos=(0, 0),
-                circle_radius=self.scale / 2)
-            weights[np.unravel_index(i, weights.shape)] = area_fraction
+        circle_radius = self.scale / 2
+        area = ancillary.circle_rectangle_overlap(
+            x_edges[:-1, np.newaxis], x_edges[1:, np.newaxis],
+            y_edges[np.newaxis, :-1], y_edges[np.newaxis, 1:],
+            circle_radius=circle_radius)
+        weights = area / (np.pi * circle_radius**2)
         return weights
 
 # ------------------------------------------------------------------------------
@@ -304,7 +449,7 @@ def interpolate_fibre(fib_spectra, fib_variance, cube, cube_var, cube_weight,
         row_edges = np.arange(rows_min - 0.5, rows_max + 1.5, 1.0)
         pos_col_edges = (column_edges - kernel_centre_cols)
         pos_row_edges = (row_edges - kernel_centre_rows)
-        w = kernel.kernel_2D(pos_row_edges, pos_col_edges)
+        w = kernel.cached_kernel_2D(pos_row_edges, pos_col_edges)
         w = w[np.newaxis]
         #print(w.sum())
         # Add spectra to cube
@@ -318,10 +463,208 @@ def interpolate_fibre(fib_spectra, fib_variance, cube, cube_var, cube_weight,
     return cube, cube_var, cube_weight
 
 
+def get_spectral_windows(n_wavelength, adr_cols=None, adr_rows=None,
+                         adr_pixel_frac=0.05):
+    """Split the spectral axis into windows of approximately constant ADR.
+
+    Parameters
+    ----------
+    n_wavelength: int
+        Number of spectral pixels.
+    adr_cols: (k,) np.array(float), optional, default=None
+        ADR along the x (ra)-axis expressed in pixels.
+    adr_rows: (k,) np.array(float), optional, default=None
+        ADR along the y (dec)-axis expressed in pixels.
+    adr_pixel_frac: float, optional, default=0.05
+        Maximum ADR variation, in pixels, allowed within each window.
+
+    Returns
+    -------
+    windows: list
+        List of tuples (wl_slice, adr_col, adr_row) containing the spectral
+        slice of each window and the median ADR offset (in pixels) along
+        columns and rows.
+    """
+    if adr_rows is None and adr_cols is None:
+        return [(slice(0, n_wavelength), 0., 0.)]
+    if adr_cols is None:
+        adr_cols = np.zeros(n_wavelength)
+    if adr_rows is None:
+        adr_rows = np.zeros(n_wavelength)
+    # Estimate spectral window
+    with np.errstate(divide='ignore'):
+        spectral_window = np.min(
+            (adr_pixel_frac / np.abs(adr_cols[0] - adr_cols[-1]),
+             adr_pixel_frac / np.abs(adr_rows[0] - adr_rows[-1]))
+            ) * n_wavelength
+    spectral_window = int(np.clip(spectral_window, 1, n_wavelength))
+    windows = []
+    for wl_range in range(0, n_wavelength, spectral_window):
+        wl_slice = slice(wl_range, wl_range + spectral_window)
+        windows.append((wl_slice, np.nanmedian(adr_cols[wl_slice]),
+                        np.nanmedian(adr_rows[wl_slice])))
+    return windows
+
+
+def build_weight_matrix(pix_pos_cols, pix_pos_rows, spatial_shape, kernel,
+                        adr_col=0., adr_row=0.):
+    """Compute the sparse fibre-to-spaxel interpolation weights.
+
+    Parameters
+    ----------
+    pix_pos_cols: (n_fibres,) np.array(float)
+        Fibre column pixel positions.
+    pix_pos_rows: (n_fibres,) np.array(float)
+        Fibre row pixel positions.
+    spatial_shape: tuple
+        Spatial shape of the cube (n_rows, n_cols).
+    kernel: pykoala.cubing.InterpolationKernel
+        Kernel object used to interpolate the data.
+    adr_col: float, default=0.
+        ADR offset along the columns expressed in pixels.
+    adr_row: float, default=0.
+        ADR offset along the rows expressed in pixels.
+
+    Returns
+    -------
+    weight_matrix: scipy.sparse.csr_matrix
+        (n_rows * n_cols, n_fibres) matrix containing the weight of each fibre
+        on every spaxel.
+    """
+    n_rows, n_cols = spatial_shape
+    kernel_offset = kernel.scale * kernel.truncation_radius
+    spaxel_idx, fibre_idx, weights = [], [], []
+    for fibre, (pos_cols, pos_rows) in enumerate(zip(pix_pos_cols,
+                                                     pix_pos_rows)):
+        kernel_centre_cols = pos_cols - adr_col
+        kernel_centre_rows = pos_rows - adr_row
+        if not (np.isfinite(kernel_centre_cols)
+                and np.isfinite(kernel_centre_rows)):
+            continue
+        cols_min = max(int(kernel_centre_cols - kernel_offset) - 2, 0)
+        cols_max = min(int(kernel_centre_cols + kernel_offset) + 2,
+                       n_cols - 1)
+        rows_min = max(int(kernel_centre_rows - kernel_offset) - 2, 0)
+        rows_max = min(int(kernel_centre_rows + kernel_offset) + 2,
+                       n_rows - 1)
+        if (cols_max <= cols_min) | (rows_max <= rows_min):
+            continue
+        column_edges = np.arange(cols_min - 0.5, cols_max + 1.5, 1.0)
+        row_edges = np.arange(rows_min - 0.5, rows_max + 1.5, 1.0)
+        w = kernel.cached_kernel_2D(row_edges - kernel_centre_rows,
+                             column_edges - kernel_centre_cols)
+        rows, cols = np.nonzero(w)
+        spaxel_idx.append((rows + rows_min) * n_cols + cols + cols_min)
+        fibre_idx.append(np.full(rows.size, fibre))
+        weights.append(w[rows, cols])
+
+    if len(weights) > 0:
+        spaxel_idx = np.concatenate(spaxel_idx)
+        fibre_idx = np.concatenate(fibre_idx)
+        weights = np.concatenate(weights)
+    weight_matrix = csr_matrix(
+        (weights, (spaxel_idx, fibre_idx)),
+        shape=(n_rows * n_cols, len(pix_pos_cols)))
+    return weight_matrix
+
+
+def get_weight_matrices(rss, wcs, kernel, adr_ra_arcsec=None,
+                        adr_dec_arcsec=None, adr_pixel_frac=0.05):
+    """Compute the fibre-to-spaxel weight matrices of a RSS.
+
+    A sparse weight matrix is computed for each spectral window of
+    (approximately) constant ADR. The result only depends on the fibre
+    positions, the ADR and the kernel, and therefore can be reused to
+    interpolate different versions (e.g. corrections) of the same exposure.
+
+    Parameters
+    ----------
+    rss: RSS
+        Target RSS.
+    wcs: astropy.wcs.WCS
+        WCS of the output datacube.
+    kernel: pykoala.cubing.InterpolationKernel
+        Kernel object used to interpolate the data.
+    adr_ra_arcsec: np.ndarray, optional, default=None
+        ADR along the RA axis expressed in arcseconds.
+    adr_dec_arcsec: np.ndarray, optional, default=None
+        ADR along the DEC axis expressed in arcseconds.
+    adr_pixel_frac: float, optional, default=0.05
+        See `get_spectral_windows`.
+
+    Returns
+    -------
+    weight_matrices: list
+        List of tuples (wl_slice, weight_matrix).
+    """
+    if adr_dec_arcsec is not None:
+        adr_dec_arcsec = adr_dec_arcsec / kernel.pixel_scale_arcsec
+    if adr_ra_arcsec is not None:
+        adr_ra_arcsec = adr_ra_arcsec / kernel.pixel_scale_arcsec
+    fibre_pixel_pos_cols, fibre_pixel_pos_rows = wcs.celestial.world_to_pixel(
+        SkyCoord(rss.info['fib_ra'], rss.info['fib_dec'], unit='deg')
+        )
+    windows = get_spectral_windows(rss.wavelength.size,
+                                   adr_cols=adr_ra_arcsec,
+                                   adr_rows=adr_dec_arcsec,
+                                   adr_pixel_frac=adr_pixel_frac)
+    weight_matrices = []
+    for wl_slice, adr_col, adr_row in windows:
+        weight_matrices.append((wl_slice, build_weight_matrix(
+            fibre_pixel_pos_cols, fibre_pixel_pos_rows,
+            wcs.celestial.array_shape, kernel,
+            adr_col=adr_col, adr_row=adr_row)))
+    return weight_matrices
+
+
+def interpolate_rss_sparse(intensity, variance, mask, weight_matrices,
+                           datacube, datacube_var, datacube_weight):
+    """Interpolate the RSS data into a datacube using sparse weight matrices.
+
+    Parameters
+    ----------
+    intensity: (n_fibres, k) np.ndarray
+        RSS intensity.
+    variance: (n_fibres, k) np.ndarray
+        RSS variance.
+    mask: (n_fibres, k) np.ndarray
+        Boolean mask of the pixels to discard.
+    weight_matrices: list
+        List of tuples (wl_slice, weight_matrix) (see `get_weight_matrices`).
+    datacube: (k, n, m) np.ndarray
+        Cube to interpolate fibre spectra.
+    datacube_var: (k, n, m) np.ndarray
+        Cube to interpolate fibre variance.
+    datacube_weight: (k, n, m) np.ndarray
+        Cube to store fibre spectral weights.
+
+    Returns
+    -------
+    datacube
+    datacube_var
+    datacube_weight
+    """
+    # Set NaNs to 0 and discard pixels
+    nan_pixels = ~np.isfinite(intensity) | mask
+    intensity = np.where(nan_pixels, 0., intensity)
+    pixel_weights = (~nan_pixels).astype(float)
+    spatial_shape = datacube.shape[1:]
+    for wl_slice, weight_matrix in weight_matrices:
+        n_wave = intensity[:, wl_slice].shape[1]
+        datacube[wl_slice] += (weight_matrix @ intensity[:, wl_slice]
+                               ).T.reshape(n_wave, *spatial_shape)
+        datacube_var[wl_slice] += (weight_matrix.power(2)
+                                   @ variance[:, wl_slice]
+                                   ).T.reshape(n_wave, *spatial_shape)
+        datacube_weight[wl_slice] += (weight_matrix @ pixel_weights[:, wl_slice]
+                                      ).T.reshape(n_wave, *spatial_shape)
+    return datacube, datacube_var, datacube_weight
+
+
 def interpolate_rss(rss, wcs, kernel,
                     datacube=None, datacube_var=None, datacube_weight=None,
                     adr_ra_arcsec=None, adr_dec_arcsec=None, mask_flags=None,
-                    qc_plots=False):
+                    qc_plots=False, sparse=False, weight_matrices=None):
 
     """Perform fibre interpolation using a RSS into to a 3D datacube.
 
@@ -341,6 +684,13 @@ def interpolate_rss(rss, wcs, kernel,
     datacube_weight
     adr_ra
     adr_dec
+    sparse: bool, default=False
+        If True, the interpolation is performed as a product between the RSS
+        data and a set of sparse fibre-to-spaxel weight matrices (one per ADR
+        spectral window) instead of looping over every fibre.
+    weight_matrices: list, default=None
+        Precomputed weight matrices (see `get_weight_matrices`). If provided,
+        the sparse interpolation scheme will be used.
 
     Returns
     -------
@@ -351,7 +701,8 @@ def interpolate_rss(rss, wcs, kernel,
     """
     # Initialise cube data containers (intensity, variance, fibre weights)
     if datacube is None:
-        datacube = np.zeros(wcs.array_shape)
+        datacube = np.zeros(wcs.array_shape,
+                            dtype=config.get_float_dtype(default=float))
         print(f"[Cubing] Creating new datacube with dimensions: {wcs.array_shape}")
     if datacube_var is None:
         datacube_var = np.zeros_like(datacube)
@@ -380,6 +731,16 @@ def interpolate_rss(rss, wcs, kernel,
     else:
         qc_fig = None
 
+    if sparse or weight_matrices is not None:
+        if weight_matrices is None:
+            weight_matrices = get_weight_matrices(
+                rss, wcs, kernel, adr_ra_arcsec=adr_ra_arcsec,
+                adr_dec_arcsec=adr_dec_arcsec)
+        datacube, datacube_var, datacube_weight = interpolate_rss_sparse(
+            rss.intensity, rss.variance, mask, weight_matrices,
+            datacube, datacube_var, datacube_weight)
+        return datacube, datacube_var, datacube_weight, qc_fig
+
     for fibre in range(rss.intensity.shape[0]):
         offset_ra_pix = fibre_pixel_pos_cols[fibre]
         offset_dec_pix = fibre_pixel_pos_rows[fibre]
@@ -399,7 +760,12 @@ def build_cube(rss_set, wcs=None, wcs_params=None,
                         kernel=GaussianKernel,
                         kernel_size_arcsec=2.0,
                         kernel_truncation_radius=2.0,
-                        adr_set=None, mask_flags=None, qc_plots=False, **kwargs):
+                        kernel_phase_resolution=None,
+                        adr_set=None, mask_flags=None, qc_plots=False,
+                        sparse=False, weight_matrix_set=None,
+                        n_workers=None, executor=None,
+                        scratch_dir=None, max_memory_gb=None,
+                        incremental=False, **kwargs):
                
     """Create a Cube from a set of Raw Stacked Spectra (RSS).
 
@@ -413,9 +779,42 @@ def build_cube(rss_set, wcs=None, wcs_params=None,
         Interpolator kernel physical size in *arcseconds*.
     pixel_size_arcsec: float, default=0.7
         Cube pixel physical size in *arcseconds*.
+    kernel_phase_resolution: int, default=None
+        If provided, the kernel weights are tabulated as a function of the
+        sub-pixel phase of each fibre using this number of steps per pixel
+        (see `InterpolationKernel.cached_kernel_2D`).
     adr_set: (list, default=None)
         List containing the ADR correction for every RSS (it can contain None)
         in the form: [(ADR_ra_1, ADR_dec_1), (ADR_ra_2, ADR_dec_2), (None, None)]
+    sparse: bool, default=False
+        If True, use sparse fibre-to-spaxel weight matrices to interpolate
+        each RSS (see `interpolate_rss`).
+    weight_matrix_set: list, default=None
+        List containing the precomputed weight matrices for every RSS (see
+        `get_weight_matrices`). It can contain None for those RSS that
+        need to be computed.
+    n_workers: int, default=None
+        Number of processes used to interpolate the RSS set. If larger than
+        one, every RSS is interpolated by a process pool that writes into
+        shared-memory accumulators.
+    executor: concurrent.futures.Executor, default=None
+        User-provided process-based executor used instead of creating a new
+        process pool.
+    scratch_dir: str, default=None
+        If provided, the individual cubes of each RSS are stored in
+        memory-mapped scratch files within this directory instead of memory.
+    max_memory_gb: float, default=None
+        Approximate memory budget in GB. If the individual cubes do not fit
+        within this budget, they will be stored in memory-mapped scratch files
+        (in the system temporary directory unless `scratch_dir` is provided)
+        and stacked in wavelength slabs.
+    incremental: bool, default=False
+        If True, the individual cubes are combined using a weighted mean
+        (without clipping) whose sufficient statistics are stored in the
+        output Cube (see `IncrementalCubeStack`). This allows to add or remove
+        individual RSS later on (see `Cube.add_rss` and `Cube.remove_rss`).
+        The input `stack_method` is ignored, although `inv_var_weight` can be
+        provided through `stack_method_args`.
 
     Returns
     -------
@@ -441,63 +840,607 @@ def build_cube(rss_set, wcs=None, wcs_params=None,
         + f"\n Scale: {kernel_scale:.1f} (pixels)"
         + f"\n Truncation radius: {kernel_truncation_radius:.1f}")
     kernel = kernel(pixel_scale_arcsec=pixel_size, scale=kernel_scale,
-                    truncation_radius=kernel_truncation_radius)
+                    truncation_radius=kernel_truncation_radius,
+                    phase_resolution=kernel_phase_resolution)
     
-    # Create empty cubes for data, variance and weights - these will be filled and returned
-    print(f"[Cubing] Initialising new datacube with dimensions: {wcs.array_shape}")
-    all_datacubes = np.zeros((len(rss_set), *wcs.array_shape))
-    all_var = np.zeros_like(all_datacubes)
-    all_w = np.zeros_like(all_datacubes)
-    all_exp = np.zeros_like(all_datacubes)
-
-    # "Empty" array that will be used to store exposure times
-    exposure_times = np.zeros((len(rss_set)))
-
     # For each RSS two arrays containing the ADR over each axis might be provided
     # otherwise they will be set to None
     if adr_set is None:
         adr_set = [(None, None)] * len(rss_set)
+    if weight_matrix_set is None:
+        weight_matrix_set = [None] * len(rss_set)
 
-    for i, rss in enumerate(rss_set):
-        copy_rss = copy.deepcopy(rss)
-        exposure_times[i] = copy_rss.info['exptime']
+    # "Empty" array that will be used to store exposure times
+    exposure_times = np.array([rss.info['exptime'] for rss in rss_set],
+                              dtype=float)
+
+    # Create empty cubes for data, variance and weights - these will be filled and returned
+    print(f"[Cubing] Initialising new datacube with dimensions: {wcs.array_shape}")
+    all_shape = (len(rss_set), *wcs.array_shape)
+    parallel = executor is not None or (n_workers is not None and n_workers > 1)
+    if max_memory_gb is None:
+        memory_budget = None
+    else:
+        memory_budget = max_memory_gb * 1024**3
+    accumulators_dtype = np.dtype(config.get_float_dtype(default=float))
+    out_of_core = scratch_dir is not None or (
+        memory_budget is not None
+        and 3 * int(np.prod(all_shape)) * accumulators_dtype.itemsize
+        > memory_budget)
+    if out_of_core:
+        storage = 'memmap'
+        print("[Cubing] Storing individual cubes in memory-mapped scratch files")
+    elif parallel:
+        storage = 'shared_memory'
+    else:
+        storage = 'memory'
+    accumulators = CubeAccumulators(all_shape, storage=storage,
+                                    scratch_dir=scratch_dir,
+                                    dtype=accumulators_dtype)
+    try:
+        if parallel:
+            print(f"[Cubing] Interpolating RSS in parallel ({storage})")
+            own_executor = executor is None
+            if own_executor:
+                executor = ProcessPoolExecutor(max_workers=n_workers)
+            try:
+                futures = [executor.submit(
+                    _interpolate_rss_worker, i, rss, wcs, kernel,
+                    storage, accumulators.names, all_shape, accumulators_dtype,
+                    adr_set[i], mask_flags, qc_plots, sparse,
+                    weight_matrix_set[i]) for i, rss in enumerate(rss_set)]
+                for i, future in enumerate(futures):
+                    plots[f'rss_{i+1}'] = future.result()
+            finally:
+                if own_executor:
+                    executor.shutdown()
+        else:
+            for i, rss in enumerate(rss_set):
+                plots[f'rss_{i+1}'] = _interpolate_rss_into(
+                    i, copy.deepcopy(rss), wcs, kernel, accumulators,
+                    adr_set[i], mask_flags, qc_plots, sparse,
+                    weight_matrix_set[i])
+
+        # Stacking
+        stacking_method = kwargs.get("stack_method", CubeStacking.mad_clipping)
+        stacking_args = kwargs.get("stack_method_args", {})
+        if incremental:
+            print("[Cubing] Stacking individual cubes using an incremental"
+                  " weighted mean")
+            incremental_stack = IncrementalCubeStack(
+                wcs, kernel, mask_flags=mask_flags, sparse=sparse,
+                inv_var_weight=stacking_args.get("inv_var_weight", True))
+            for i in range(len(rss_set)):
+                incremental_stack.add_cube(accumulators.intensity[i],
+                                           accumulators.variance[i],
+                                           accumulators.weight[i])
+            datacube, datacube_var = incremental_stack.get_stack()
+        elif out_of_core:
+            print(f"[Cubing] Stacking individual cubes using {stacking_method.__name__}")
+            print(f"[Cubing] Additonal arguments for stacking: {stacking_args}")
+            datacube, datacube_var = stack_in_wavelength_slabs(
+                stacking_method, accumulators.intensity,
+                accumulators.variance, memory_budget=memory_budget,
+                **stacking_args)
+        else:
+            print(f"[Cubing] Stacking individual cubes using {stacking_method.__name__}")
+            print(f"[Cubing] Additonal arguments for stacking: {stacking_args}")
+            datacube, datacube_var = stacking_method(
+                accumulators.intensity, accumulators.variance,
+                **stacking_args)
+        if storage != 'memory':
+            # Make sure that the results do not point to the scratch buffers
+            datacube, datacube_var = np.array(datacube), np.array(datacube_var)
+        if qc_plots:
+            # Compute the fibre coverage and exposure time maps
+            plots[f'weights'] = qc_plot.qc_cubing(accumulators.weight,
+                                                  exposure_times)
+    finally:
+        accumulators.close(unlink=True)
 
-        # Interpolate RSS to data cube
-        datacube_i, datacube_var_i, datacube_weight_i, rss_plots = interpolate_rss(
-            copy_rss,
-            wcs=wcs,
-            kernel=kernel,
-            datacube=np.zeros(wcs.array_shape),
-            datacube_var=np.zeros(wcs.array_shape),
-            datacube_weight=np.zeros(wcs.array_shape),
-            adr_ra_arcsec=adr_set[i][0], adr_dec_arcsec=adr_set[i][1],
-            mask_flags=mask_flags,
-            qc_plots=qc_plots)
-        plots[f'rss_{i+1}'] = rss_plots
-        all_datacubes[i] = datacube_i / exposure_times[i]
-        all_var[i] = datacube_var_i / exposure_times[i]**2
-        all_w[i] = datacube_weight_i
-        all_exp[i] = datacube_weight_i * exposure_times[i]
-
-    # Stacking
-    stacking_method = kwargs.get("stack_method", CubeStacking.mad_clipping)
-    stacking_args = kwargs.get("stack_method_args", {})
-    print(f"[Cubing] Stacking individual cubes using {stacking_method.__name__}")
-    print(f"[Cubing] Additonal arguments for stacking: {stacking_args}")
-    datacube, datacube_var = stacking_method(
-        all_datacubes, all_var, **stacking_args)
     info = dict(kernel_size_arcsec=kernel_size_arcsec,
                 **kwargs.get('cube_info', {}))
     # Create WCS information
     hdul = build_hdul(intensity=datacube, variance=datacube_var, wcs=wcs)
     cube = Cube(hdul=hdul, info=info)
+    if incremental:
+        cube.incremental_stack = incremental_stack
     if qc_plots:
-        # Compute the fibre coverage and exposure time maps
-        plots[f'weights'] = qc_plot.qc_cubing(all_w, all_exp)
         return cube, plots
     return cube
 
 
+def get_spatial_tiles(spatial_shape, tile_shape):
+    """Split the spatial dimensions of a cube into rectangular tiles.
+
+    Parameters
+    ----------
+    - spatial_shape: tuple
+        Number of (rows, columns) of the cube.
+    - tile_shape: int or tuple
+        Maximum number of (rows, columns) of each tile.
+
+    Returns
+    -------
+    - tiles: list
+        List of (rows_slice, columns_slice) tuples.
+    """
+    tile_shape = np.broadcast_to(tile_shape, 2).astype(int)
+    return [(slice(row, min(row + tile_shape[0], spatial_shape[0])),
+             slice(col, min(col + tile_shape[1], spatial_shape[1])))
+            for row in range(0, spatial_shape[0], tile_shape[0])
+            for col in range(0, spatial_shape[1], tile_shape[1])]
+
+
+def select_rss_fibres(rss, fibres):
+    """Create a new RSS that only contains a subset of fibres.
+
+    Parameters
+    ----------
+    - rss: RSS
+        Input RSS.
+    - fibres: np.ndarray
+        Indices (or boolean mask) of the fibres to be selected.
+
+    Returns
+    -------
+    - new_rss: RSS
+    """
+    info = copy.deepcopy(rss.info)
+    info['fib_ra'] = np.asarray(rss.info['fib_ra'])[fibres]
+    info['fib_dec'] = np.asarray(rss.info['fib_dec'])[fibres]
+    new_rss = rss.__class__(intensity=rss.intensity[fibres],
+                            variance=rss.variance[fibres],
+                            wavelength=rss.wavelength, info=info,
+                            log=copy.deepcopy(rss.log))
+    new_rss.mask = DataMask(new_rss.intensity.shape,
+                            flag_map=copy.deepcopy(rss.mask.flag_map))
+    new_rss.mask.bitmask = rss.mask.bitmask[fibres]
+    return new_rss
+
+
+def build_cube_tiled(rss_set, wcs=None, wcs_params=None, tile_shape=64,
+                     n_tile_workers=None, kernel=GaussianKernel,
+                     kernel_size_arcsec=2.0, kernel_truncation_radius=2.0,
+                     adr_set=None, **kwargs):
+    """Create a Cube from a set of RSS by building independent spatial tiles.
+
+    The output WCS is split into spatial tiles (see `get_spatial_tiles`) that
+    are built independently with `build_cube`. The fibres of each RSS are
+    stored in a KD-tree so that every tile only receives the fibres whose
+    kernel (including the ADR displacement) overlaps with it. The memory
+    required scales with the size of the tiles instead of the size of the
+    whole mosaic.
+
+    Parameters
+    ----------
+    rss_set: list of RSS
+        List of Raw Stacked Spectra to interpolate.
+    wcs: astropy.wcs.WCS, default=None
+        WCS of the output cube.
+    wcs_params: dict, default=None
+        Parameters used to construct the WCS if `wcs` is not provided.
+    tile_shape: int or tuple, default=64
+        Maximum number of (rows, columns) of each tile.
+    n_tile_workers: int, default=None
+        Number of processes used to build the tiles in parallel. If None, or
+        lower than 2, tiles are built sequentially.
+    kernel, kernel_size_arcsec, kernel_truncation_radius, adr_set:
+        See `build_cube`.
+    **kwargs:
+        Additional arguments passed to `build_cube`. Neither `qc_plots` nor
+        `incremental` are supported.
+
+    Returns
+    -------
+    cube: Cube
+        Cube created by interpolating the set of RSS.
+    """
+    print('[Cubing] Starting tiled cubing process')
+    if wcs is None and wcs_params is None:
+        raise ValueError("User must provide either wcs or wcs_params values.")
+    if wcs is None and wcs_params is not None:
+        wcs = WCS(wcs_params)
+    if kwargs.get("qc_plots", False) or kwargs.get("incremental", False):
+        raise ValueError("Tiled cubing does not support qc_plots or"
+                         " incremental cubes")
+    if adr_set is None:
+        adr_set = [(None, None)] * len(rss_set)
+    pixel_size = wcs.celestial.pixel_scale_matrix.diagonal().mean()
+    pixel_size *= 3600
+    # Maximum distance (in pixels) between a fibre and the pixels it reaches
+    kernel_offset = (kernel_size_arcsec / pixel_size * kernel_truncation_radius
+                     + 3)
+
+    # Spatial index of the fibres of each RSS
+    fibre_trees = []
+    fibre_margins = []
+    for rss, adr in zip(rss_set, adr_set):
+        pix_cols, pix_rows = wcs.celestial.world_to_pixel(
+            SkyCoord(rss.info['fib_ra'], rss.info['fib_dec'], unit='deg'))
+        fibre_trees.append(cKDTree(np.column_stack((pix_rows, pix_cols))))
+        adr_offset = max([np.nanmax(np.abs(a)) for a in adr if a is not None],
+                         default=0.) / pixel_size
+        fibre_margins.append(kernel_offset + adr_offset)
+
+    tiles = get_spatial_tiles(wcs.array_shape[1:], tile_shape)
+    print(f"[Cubing] Building {len(tiles)} tiles of at most {tile_shape}"
+          " pixels")
+    tile_jobs = []
+    for rows, cols in tiles:
+        tile_centre = [(rows.start + rows.stop - 1) / 2,
+                       (cols.start + cols.stop - 1) / 2]
+        tile_half_size = [(rows.stop - rows.start) / 2,
+                          (cols.stop - cols.start) / 2]
+        tile_rss_set = []
+        for rss, tree, margin in zip(rss_set, fibre_trees, fibre_margins):
+            # Box query: first the enclosing square, then each axis
+            fibres = np.array(tree.query_ball_point(
+                tile_centre, r=max(tile_half_size) + margin, p=np.inf),
+                dtype=int)
+            in_tile = np.all(np.abs(tree.data[fibres] - tile_centre)
+                             <= np.array(tile_half_size) + margin, axis=1)
+            fibres = np.sort(fibres[in_tile])
+            tile_rss_set.append(select_rss_fibres(rss, fibres))
+        # Tiles without fibres are also built, so that they contain the same
+        # values as the pixels without data of `build_cube`
+        tile_jobs.append(((rows, cols), tile_rss_set,
+                          wcs[:, rows, cols]))
+
+    dtype = config.get_float_dtype(default=float)
+    intensity = np.full(wcs.array_shape, fill_value=np.nan, dtype=dtype)
+    variance = np.full(wcs.array_shape, fill_value=np.nan, dtype=dtype)
+    cube_args = dict(kernel=kernel, kernel_size_arcsec=kernel_size_arcsec,
+                     kernel_truncation_radius=kernel_truncation_radius,
+                     adr_set=adr_set, **kwargs)
+    if n_tile_workers is not None and n_tile_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_tile_workers) as executor:
+            futures = [executor.submit(_build_cube_tile, *job, cube_args)
+                       for job in tile_jobs]
+            tile_results = (future.result() for future in futures)
+            for (rows, cols), tile_intensity, tile_variance in tile_results:
+                intensity[:, rows, cols] = tile_intensity
+                variance[:, rows, cols] = tile_variance
+    else:
+        for job in tile_jobs:
+            (rows, cols), tile_intensity, tile_variance = _build_cube_tile(
+                *job, cube_args)
+            intensity[:, rows, cols] = tile_intensity
+            variance[:, rows, cols] = tile_variance
+
+    info = dict(kernel_size_arcsec=kernel_size_arcsec,
+                **kwargs.get('cube_info', {}))
+    hdul = build_hdul(intensity=intensity, variance=variance, wcs=wcs)
+    return Cube(hdul=hdul, info=info)
+
+
+def _build_cube_tile(tile, rss_set, wcs, cube_args):
+    """Build a single tile of `build_cube_tiled`."""
+    cube = build_cube(rss_set, wcs=wcs, **cube_args)
+    return tile, cube.intensity, cube.variance
+
+
+class CubeAccumulators(object):
+    """Per-exposure intensity, variance and weight cubes used by `build_cube`.
+
+    Attributes
+    ----------
+    - shape: tuple
+        Shape of each accumulator (n_rss, n_wave, n_rows, n_cols).
+    - storage: str, default='memory'
+        Type of buffer used to store the data. It can be 'memory' (numpy
+        arrays), 'shared_memory' (`multiprocessing.shared_memory` buffers that
+        can be attached from other processes) or 'memmap' (`numpy.memmap`
+        scratch files).
+    - names: list
+        Names of the shared memory blocks or paths to the scratch files. If
+        provided during initialisation, the existing buffers will be attached
+        instead of creating new ones.
+    - dtype: np.dtype, default=None
+        Floating point type of the accumulators. If None, the type set in
+        `pykoala.config` is used (float64 by default).
+    - intensity, variance, weight: np.ndarray
+        Arrays containing the individual cubes.
+    """
+    def __init__(self, shape, storage='memory', names=None, scratch_dir=None,
+                 dtype=None):
+        self.shape = shape
+        self.storage = storage
+        if dtype is None:
+            dtype = config.get_float_dtype(default=float)
+        self.dtype = np.dtype(dtype)
+        self._handles = []
+        self._scratch_dir = None
+        nbytes = int(np.prod(shape)) * self.dtype.itemsize
+        create = names is None
+        if storage == 'memory':
+            arrays = [np.zeros(shape, dtype=self.dtype) for _ in range(3)]
+        elif storage == 'shared_memory':
+            if create:
+                self._handles = [shared_memory.SharedMemory(
+                    create=True, size=nbytes) for _ in range(3)]
+            else:
+                self._handles = [shared_memory.SharedMemory(name=name)
+                                 for name in names]
+            arrays = [np.ndarray(shape, dtype=self.dtype, buffer=shm.buf)
+                      for shm in self._handles]
+            names = [shm.name for shm in self._handles]
+        elif storage == 'memmap':
+            if create:
+                self._scratch_dir = tempfile.TemporaryDirectory(
+                    prefix='pykoala_cubing_', dir=scratch_dir)
+                names = [os.path.join(self._scratch_dir.name, f"{key}.dat")
+                         for key in ("intensity", "variance", "weight")]
+                mode = 'w+'
+            else:
+                mode = 'r+'
+            arrays = [np.memmap(name, dtype=self.dtype, mode=mode,
+                                shape=shape)
+                      for name in names]
+        else:
+            raise NameError(f"Unrecognized storage type: {storage}")
+        if create and storage == 'shared_memory':
+            for array in arrays:
+                array[:] = 0.
+        self.names = names
+        self.intensity, self.variance, self.weight = arrays
+
+    def close(self, unlink=False):
+        """Release the buffers.
+
+        Parameters
+        ----------
+        - unlink: bool, default=False
+            If True, shared memory blocks and scratch files are destroyed.
+        """
+        if self.storage == 'memmap':
+            for array in (self.intensity, self.variance, self.weight):
+                array.flush()
+        # Remove every reference to the buffers before closing them
+        self.intensity = self.variance = self.weight = None
+        for shm in self._handles:
+            shm.close()
+            if unlink:
+                shm.unlink()
+        self._handles = []
+        if unlink and self._scratch_dir is not None:
+            self._scratch_dir.cleanup()
+            self._scratch_dir = None
+
+
+class IncrementalCubeStack(object):
+    """Sufficient statistics of a weighted-mean stack of cubes.
+
+    This class stores the weighted sum of the individual cubes, the sum of
+    weights and the sum of variances, so that a new RSS can be added to (or
+    removed from) the stack in a time proportional to the interpolation of
+    that RSS alone. Note that, unlike `CubeStacking` methods, no clipping is
+    applied since the clipped mean cannot be updated incrementally.
+
+    Attributes
+    ----------
+    - wcs: astropy.wcs.WCS
+        WCS of the cube.
+    - kernel: InterpolationKernel
+        Kernel used to interpolate the RSS.
+    - mask_flags: str or iterable, default=None
+        Mask flags used when interpolating the RSS.
+    - sparse: bool, default=False
+        See `interpolate_rss`.
+    - inv_var_weight: bool, default=True
+        If True, the cubes are weighted by their inverse variance (as in
+        `CubeStacking.mad_clipping`).
+    - weighted_sum: np.ndarray
+        Sum of the weighted individual cubes.
+    - weight_sum: np.ndarray
+        Sum of the weights.
+    - variance_sum: np.ndarray
+        Sum of the individual variances.
+    - n_cubes: np.ndarray
+        Number of cubes that contribute to each pixel.
+    - n_exposures: int
+        Number of cubes included in the stack.
+
+    Only the pixels covered by the interpolation kernel of each RSS (i.e.
+    with non-zero coverage weight) contribute to the stack.
+    """
+    def __init__(self, wcs, kernel, mask_flags=None, sparse=False,
+                 inv_var_weight=True):
+        self.wcs = wcs
+        self.kernel = kernel
+        self.mask_flags = mask_flags
+        self.sparse = sparse
+        self.inv_var_weight = inv_var_weight
+        # Running sums are always stored with extra precision
+        self.weighted_sum = np.zeros(wcs.array_shape,
+                                     dtype=config.ACCUMULATION_DTYPE)
+        self.weight_sum = np.zeros(wcs.array_shape,
+                                   dtype=config.ACCUMULATION_DTYPE)
+        self.variance_sum = np.zeros(wcs.array_shape,
+                                     dtype=config.ACCUMULATION_DTYPE)
+        self.n_cubes = np.zeros(wcs.array_shape, dtype=int)
+        self.n_exposures = 0
+
+    def add_cube(self, datacube, datacube_var, datacube_weight=None, sign=1):
+        """Include (or remove) an individual cube in the stack.
+
+        Parameters
+        ----------
+        - datacube: np.ndarray
+            Individual cube normalized by the exposure time.
+        - datacube_var: np.ndarray
+            Variance associated to datacube.
+        - datacube_weight: np.ndarray, default=None
+            Coverage weights of the interpolation. Pixels with null weight
+            are not included in the stack. If None, all pixels with finite
+            values are included.
+        - sign: int, default=1
+            Use 1 to add the cube and -1 to remove it from the stack.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self.inv_var_weight:
+                w = 1 / datacube_var
+            else:
+                w = np.ones_like(datacube)
+            weighted_cube = w * datacube
+        valid = np.isfinite(weighted_cube) & np.isfinite(w)
+        if datacube_weight is not None:
+            valid &= datacube_weight > 0
+        self.weighted_sum += sign * np.where(valid, weighted_cube, 0.)
+        self.weight_sum += sign * np.where(valid, w, 0.)
+        self.variance_sum += sign * np.where(valid, datacube_var, 0.)
+        self.n_cubes += sign * valid
+        self.n_exposures += sign
+
+    def interpolate(self, rss, adr=None, weight_matrices=None):
+        """Interpolate a RSS into an individual cube normalized by the exposure time.
+
+        Returns
+        -------
+        - datacube: np.ndarray
+        - datacube_var: np.ndarray
+        - datacube_weight: np.ndarray
+            Coverage weights of the interpolation.
+        """
+        if adr is None:
+            adr = (None, None)
+        accumulators = CubeAccumulators((1, *self.wcs.array_shape))
+        _interpolate_rss_into(0, rss, self.wcs, self.kernel, accumulators,
+                              adr, self.mask_flags, False, self.sparse,
+                              weight_matrices)
+        return (accumulators.intensity[0], accumulators.variance[0],
+                accumulators.weight[0])
+
+    def add_rss(self, rss, adr=None, weight_matrices=None):
+        """Interpolate a RSS and include it in the stack."""
+        self.add_cube(*self.interpolate(rss, adr, weight_matrices))
+
+    def remove_rss(self, rss, adr=None, weight_matrices=None):
+        """Interpolate a RSS and remove it from the stack.
+
+        The RSS, ADR and weight matrices must be the same used to include it.
+        """
+        if self.n_exposures < 1:
+            raise ValueError("The stack does not contain any exposure")
+        self.add_cube(*self.interpolate(rss, adr, weight_matrices), sign=-1)
+        # Remove the rounding residuals of pixels without contributions
+        empty = self.n_cubes == 0
+        self.weighted_sum[empty] = 0
+        self.weight_sum[empty] = 0
+        self.variance_sum[empty] = 0
+
+    def get_stack(self):
+        """Compute the stacked cube and variance.
+
+        Returns
+        -------
+        - stacked_cube: np.ndarray
+        - stacked_variance: np.ndarray
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stacked_cube = self.weighted_sum / self.weight_sum
+            stacked_variance = self.variance_sum / self.n_cubes**2
+        stacked_cube[self.n_cubes == 0] = np.nan
+        stacked_variance[self.n_cubes == 0] = np.nan
+        return stacked_cube, stacked_variance
+
+
+def stack_in_wavelength_slabs(stacking_method, cubes, variances,
+                              memory_budget=None, slab_size=None,
+                              n_threads=None, **stacking_args):
+    """Stack a set of cubes by processing consecutive wavelength slabs.
+
+    Parameters
+    ----------
+    - stacking_method: callable
+        Stacking method (see `CubeStacking`).
+    - cubes: (n_rss, n_wave, n_rows, n_cols) np.ndarray or np.memmap
+        Individual cubes to combine.
+    - variances: (n_rss, n_wave, n_rows, n_cols) np.ndarray or np.memmap
+        Variances associated to cubes.
+    - memory_budget: float, default=None
+        Approximate memory (in bytes) that can be used by each stacking step.
+        Only used when `slab_size` is not provided. If None, it is set to
+        `DEFAULT_MEMORY_BUDGET_GB`.
+    - slab_size: int, default=None
+        Number of wavelength pixels included in each slab.
+    - n_threads: int, default=None
+        Number of threads used to process the slabs concurrently. If None,
+        slabs are processed serially. Note that the memory required scales
+        with the number of threads.
+    - stacking_args:
+        Additional arguments passed to `stacking_method`.
+
+    Returns
+    -------
+    - stacked_cube: np.ndarray
+    - stacked_variance: np.ndarray
+    """
+    n_rss, n_wave = cubes.shape[:2]
+    if slab_size is None:
+        if memory_budget is None:
+            memory_budget = DEFAULT_MEMORY_BUDGET_GB * 1024**3
+        slab_nbytes = (STACKING_MEMORY_FACTOR * n_rss
+                       * np.prod(cubes.shape[2:]) * cubes.dtype.itemsize)
+        slab_size = memory_budget // slab_nbytes
+    slab_size = int(np.clip(slab_size, 1, n_wave))
+    print(f"[Cubing] Stacking in slabs of {slab_size} wavelength pixels")
+    stacked_cube = np.empty(cubes.shape[1:], dtype=cubes.dtype)
+    stacked_variance = np.empty(cubes.shape[1:], dtype=variances.dtype)
+
+    def stack_slab(wl_slice):
+        stacked_cube[wl_slice], stacked_variance[wl_slice] = stacking_method(
+            np.asarray(cubes[:, wl_slice]), np.asarray(variances[:, wl_slice]),
+            **stacking_args)
+
+    wl_slices = [slice(wl_range, wl_range + slab_size)
+                 for wl_range in range(0, n_wave, slab_size)]
+    if n_threads is not None and n_threads > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as thread_pool:
+            # Consume the iterator to propagate any exception
+            list(thread_pool.map(stack_slab, wl_slices))
+    else:
+        for wl_slice in wl_slices:
+            stack_slab(wl_slice)
+    return stacked_cube, stacked_variance
+
+
+def _interpolate_rss_into(index, rss, wcs, kernel, accumulators, adr,
+                          mask_flags, qc_plots, sparse, weight_matrices):
+    """Interpolate a RSS into the accumulators of `build_cube`.
+
+    The intensity, variance and weights are written (normalized by the
+    exposure time) into the position `index` of the accumulators.
+    """
+    datacube = accumulators.intensity[index]
+    datacube_var = accumulators.variance[index]
+    datacube_weight = accumulators.weight[index]
+    _, _, _, rss_plots = interpolate_rss(
+        rss, wcs=wcs, kernel=kernel,
+        datacube=datacube, datacube_var=datacube_var,
+        datacube_weight=datacube_weight,
+        adr_ra_arcsec=adr[0], adr_dec_arcsec=adr[1],
+        mask_flags=mask_flags, qc_plots=qc_plots, sparse=sparse,
+        weight_matrices=weight_matrices)
+    exptime = rss.info['exptime']
+    datacube /= exptime
+    datacube_var /= exptime**2
+    return rss_plots
+
+
+def _interpolate_rss_worker(index, rss, wcs, kernel, storage, names, shape,
+                            dtype, *args):
+    """Attach to the `build_cube` accumulators and interpolate a RSS."""
+    accumulators = CubeAccumulators(shape, storage=storage, names=names,
+                                    dtype=dtype)
+    try:
+        rss_plots = _interpolate_rss_into(index, rss, wcs, kernel,
+                                          accumulators, *args)
+    finally:
+        accumulators.close()
+    return rss_plots
+
+
 def build_wcs(datacube_shape, reference_position, spatial_pix_size,
               spectra_pix_size, radesys='ICRS    ', equinox=2000.0):
     """Create a WCS using cubing information.
@@ -563,53 +1506,98 @@ class Cube(DataContainer):
     variance
     wavelength
     info
+    lazy: bool, default=False
+        If True, the data is not read during the initialisation. The file is
+        opened using memory mapping and `get_section` (as well as the methods
+        that rely on it, like `get_white_image` or `get_spectrum`) reads only
+        the requested bytes until the full `intensity` or `variance` arrays
+        are accessed.
 
     """
     n_wavelength = None
     n_cols = None
     n_rows = None
+    incremental_stack = None
     x_size_arcsec = None
     y_size_arcsec = None
 
     def __init__(self, hdul=None, file_path=None, 
-                 hdul_extensions_map=None, **kwargs):
+                 hdul_extensions_map=None, lazy=False, **kwargs):
 
         self.hdul = hdul
+        self.lazy = lazy
         self.hdul_extensions_map = hdul_extensions_map
 
         if self.hdul_extensions_map is None:
             self.hdul_extensions_map = {"INTENSITY": "INTENSITY",
                                         "VARIANCE": "VARIANCE"}
+        # Extensions whose data is held in memory (see `get_section`)
+        self._loaded_extensions = set(self.hdul_extensions_map)
         if self.hdul is not None:
             print("[Cube] Initialising cube from input HDUL")
             self.hdul = hdul
         elif file_path is not None:
-            self.load_hdul(file_path)
+            self.load_hdul(file_path, lazy=lazy)
         self.get_wcs_from_header()
-        super().__init__(intensity=self.intensity,
-                         variance=self.variance,
-                         **kwargs)
+        if lazy:
+            # Avoid reading the data
+            self.n_wavelength, self.n_rows, self.n_cols = self.wcs.array_shape
+            kwargs.setdefault("mask", DataMask(shape=self.wcs.array_shape))
+            super().__init__(**kwargs)
+        else:
+            super().__init__(intensity=self.intensity,
+                             variance=self.variance,
+                             **kwargs)
+            self.n_wavelength, self.n_rows, self.n_cols = self.intensity.shape
         self.parse_info_from_header()
-        self.n_wavelength, self.n_rows, self.n_cols = self.intensity.shape
         self.get_wavelength()
 
     @property
     def intensity(self):
+        self._loaded_extensions.add('INTENSITY')
         return self.hdul[self.hdul_extensions_map['INTENSITY']].data
     
     @intensity.setter
     def intensity(self, intensity_corr):
         print("[Cube] Updating HDUL INTENSITY")
-        self.hdul[self.hdul_extensions_map['INTENSITY']].data = intensity_corr
+        self.hdul[self.hdul_extensions_map['INTENSITY']].data = (
+            config.as_float_array(intensity_corr))
+        self._loaded_extensions.add('INTENSITY')
 
     @property
     def variance(self):
+        self._loaded_extensions.add('VARIANCE')
         return self.hdul[self.hdul_extensions_map['VARIANCE']].data
 
     @variance.setter
     def variance(self, variance_corr):
         print("[Cube] Updating HDUL variance")
-        self.hdul[self.hdul_extensions_map['VARIANCE']].data = variance_corr
+        self.hdul[self.hdul_extensions_map['VARIANCE']].data = (
+            config.as_float_array(variance_corr))
+        self._loaded_extensions.add('VARIANCE')
+
+    def is_loaded(self, extension='INTENSITY'):
+        """Return True if the data of `extension` is held in memory."""
+        return extension in self._loaded_extensions
+
+    def copy(self, share_data=False):
+        """Return a copy of the Cube (see `DataContainer.copy`).
+
+        If `share_data` is True, the HDUs (and their headers) are copied but
+        their data arrays are shared with the original Cube.
+        """
+        if not share_data:
+            return super().copy()
+        hdul = self.hdul
+        self.hdul = None
+        try:
+            cube = copy.deepcopy(self)
+        finally:
+            self.hdul = hdul
+        cube.hdul = fits.HDUList([copy.copy(hdu) for hdu in hdul])
+        for hdu, new_hdu in zip(hdul, cube.hdul):
+            new_hdu.header = hdu.header.copy()
+        return cube
 
     def parse_info_from_header(self):
         """Look into the primary header for pykoala information."""
@@ -619,10 +1607,60 @@ class Cube(DataContainer):
         #self.fill_info()
         self.log.load_from_header(self.hdul[0].header)
 
-    def load_hdul(self, path_to_file):
+    def load_hdul(self, path_to_file, lazy=False):
         print(f"[Cube] Loading HDUL {path_to_file}")
-        self.hdul = fits.open(path_to_file)
-        pass
+        if lazy:
+            self.hdul = fits.open(path_to_file, memmap=True,
+                                  lazy_load_hdus=True)
+            # The data will be read on first access
+            self._loaded_extensions = set()
+        else:
+            self.hdul = fits.open(path_to_file)
+
+    def get_section(self, wave_slice=None, rows_slice=None, cols_slice=None,
+                    extension='INTENSITY'):
+        """Return a section of the data.
+
+        If the data has not been read yet (see `lazy`), only the section is
+        read from the file.
+
+        Parameters
+        ----------
+        - wave_slice: slice or int, default=None
+            Wavelength pixels to be read. If None, all pixels are read.
+        - rows_slice: slice or int, default=None
+            Rows (DEC) to be read. If None, all rows are read.
+        - cols_slice: slice or int, default=None
+            Columns (RA) to be read. If None, all columns are read.
+        - extension: str, default='INTENSITY'
+            Either 'INTENSITY' or 'VARIANCE'.
+
+        Returns
+        -------
+        - section: np.ndarray
+        """
+        key = tuple(slice(None) if s is None else s
+                    for s in (wave_slice, rows_slice, cols_slice))
+        hdu = self.hdul[self.hdul_extensions_map[extension]]
+        # In-memory or already read HDUs cannot be accessed through sections
+        if self.is_loaded(extension):
+            return hdu.data[key]
+        return hdu.section[key]
+
+    def get_wavelength_slice(self, wave_range=None):
+        """Return the slice of wavelength pixels within `wave_range`."""
+        if wave_range is None:
+            return slice(None)
+        wave_pixels = np.where((self.wavelength >= wave_range[0])
+                               & (self.wavelength <= wave_range[1]))[0]
+        if wave_pixels.size == 0:
+            return slice(0, 0)
+        return slice(wave_pixels[0], wave_pixels[-1] + 1)
+
+    def get_spectrum(self, row, col, extension='INTENSITY'):
+        """Return the spectrum of the spaxel at (row, col)."""
+        return self.get_section(rows_slice=row, cols_slice=col,
+                                extension=extension)
 
     def close_hdul(self):
         if self.hdul is not None:
@@ -640,20 +1678,16 @@ class Cube(DataContainer):
             np.arange(self.n_wavelength)).to('angstrom').value
         
     def get_centre_of_mass(self, wavelength_step=1, stat=np.median, power=1.0):
-        """Compute the center of mass of the data cube."""
-        x = np.arange(0, self.n_cols, 1)
-        y = np.arange(0, self.n_rows, 1)
-        x_com = np.empty(self.n_wavelength)
-        y_com = np.empty(self.n_wavelength)
-        for wave_range in range(0, self.n_wavelength, wavelength_step):
-            x_com[wave_range: wave_range + wavelength_step] = np.nansum(
-                self.intensity[wave_range: wave_range + wavelength_step]**power * x[np.newaxis, np.newaxis, :],
-                axis=(1, 2)) / np.nansum(self.intensity[wave_range: wave_range + wavelength_step]**power, axis=(1, 2))
-            x_com[wave_range: wave_range + wavelength_step] = stat(x_com[wave_range: wave_range + wavelength_step])
-            y_com[wave_range: wave_range + wavelength_step] = np.nansum(
-                self.intensity[wave_range: wave_range + wavelength_step]**power * y[np.newaxis, :, np.newaxis],
-                axis=(1, 2)) / np.nansum(self.intensity[wave_range: wave_range + wavelength_step]**power, axis=(1, 2))
-            y_com[wave_range: wave_range + wavelength_step] = stat(y_com[wave_range: wave_range + wavelength_step])
+        """Compute the center of mass of the data cube.
+
+        If several powers are provided, all of them are computed in a single
+        pass and the outputs have dimensions (n_power, n_wavelength).
+        """
+        y, x = np.indices((self.n_rows, self.n_cols))
+        x_com, y_com = np.moveaxis(ancillary.spectral_centre_of_mass(
+            self.intensity.reshape(self.n_wavelength, -1).T,
+            np.array([x.ravel(), y.ravel()]), power=power,
+            wavelength_step=wavelength_step, stat=stat), -2, 0)
         return x_com, y_com
 
     def get_integrated_light_frac(self, frac=0.5):
@@ -667,32 +1701,105 @@ class Cube(DataContainer):
         pos = np.searchsorted(cumulative_intensity, frac)
         return cumulative_intensity[pos]
 
-    def get_white_image(self, wave_range=None, s_clip=3.0, frequency_density=False):
-        """Create a white image."""
-        if wave_range is not None and self.wavelength is not None:
-            wave_mask = (self.wavelength >= wave_range[0]) & (self.wavelength <= wave_range[1])
-        else:
-            wave_mask = np.ones(self.wavelength.size, dtype=bool)
-        
-        if s_clip is not None:
-            std_dev = ancillary.std_from_mad(self.intensity[wave_mask], axis=0)
-            median = np.nanmedian(self.intensity[wave_mask], axis=0)
+    def get_white_image(self, wave_range=None, s_clip=3.0, frequency_density=False,
+                        chunk_size=None, median_step=None, memory_budget=None):
+        """Create a white image.
 
-            weights = (
-                (self.intensity[wave_mask] <= median[np.newaxis] + s_clip * std_dev[np.newaxis])
-                & (self.intensity[wave_mask] >= median[np.newaxis] - s_clip * std_dev[np.newaxis]))
-        else:
-            weights = np.ones_like(self.intensity[wave_mask])
+        The cube is processed in chunks so that only a few copies of each
+        chunk are kept in memory (and, for lazy cubes, only each chunk is
+        read). By default, the chunks span groups of rows along the full
+        wavelength range, so the median and MAD of every spaxel (used for the
+        sigma clipping) are exact. If `median_step` is provided, the median
+        and MAD are estimated from one every `median_step` wavelength pixels
+        and the clipped mean is then accumulated over wavelength chunks.
+
+        Parameters
+        ----------
+        - wave_range: 2-element iterable, default=None
+            Wavelength range used to compute the image.
+        - s_clip: float, default=3.0
+            Number of standard deviations (estimated from the MAD) used to
+            clip the pixels of each spaxel. If None, no clipping is applied.
+        - frequency_density: bool, default=False
+            If True, convert the intensity to frequency density.
+        - chunk_size: int, default=None
+            Number of rows (or wavelength pixels if `median_step` is provided)
+            processed at once. If None, it is computed from `memory_budget`.
+        - median_step: int, default=None
+            Wavelength sampling used to estimate the median and MAD.
+        - memory_budget: float, default=None
+            Approximate memory (in bytes) used by each chunk. If None,
+            `DEFAULT_MEMORY_BUDGET_GB` is used.
 
+        Returns
+        -------
+        - white_image: np.ndarray
+        """
+        wave_mask = self.get_wavelength_slice(wave_range)
+        wave_pixels = np.arange(self.n_wavelength)[wave_mask]
+        if wave_pixels.size == 0:
+            return np.full((self.n_rows, self.n_cols), np.nan)
         if frequency_density:
-            freq_trans = self.wavelength**2 / 3e18
+            freq_trans = self.wavelength[wave_mask]**2 / 3e18
         else:
-            freq_trans = np.ones_like(self.wavelength)
+            freq_trans = np.ones(wave_pixels.size)
+
+        if chunk_size is None:
+            if memory_budget is None:
+                memory_budget = DEFAULT_MEMORY_BUDGET_GB * 1024**3
+            # Chunk, absolute deviation, weights and weighted chunk
+            pixel_nbytes = 4 * np.dtype(float).itemsize
+            if median_step is None:
+                chunk_size = memory_budget // (
+                    pixel_nbytes * wave_pixels.size * self.n_cols)
+            else:
+                chunk_size = memory_budget // (
+                    pixel_nbytes * self.n_rows * self.n_cols)
+        chunk_size = int(max(chunk_size, 1))
+
+        if median_step is None:
+            white_image = np.empty((self.n_rows, self.n_cols))
+            for row in range(0, self.n_rows, chunk_size):
+                rows_slice = slice(row, row + chunk_size)
+                intensity = self.get_section(wave_slice=wave_mask,
+                                             rows_slice=rows_slice)
+                if s_clip is not None:
+                    median = np.nanmedian(intensity, axis=0)
+                    abs_dev = np.abs(intensity - median[np.newaxis])
+                    std_dev = 1.4826 * np.nanmedian(abs_dev, axis=0)
+                    weights = abs_dev <= s_clip * std_dev[np.newaxis]
+                    del abs_dev
+                else:
+                    weights = np.ones_like(intensity, dtype=bool)
+                white_image[rows_slice] = np.nansum(np.where(
+                    weights, intensity * freq_trans[:, np.newaxis, np.newaxis],
+                    0), axis=0) / np.sum(weights, axis=0)
+            return white_image
 
-        white_image = np.nansum(
-            self.intensity[wave_mask] * freq_trans[wave_mask, np.newaxis, np.newaxis] * weights, axis=0
-            ) / np.nansum(weights, axis=0)
-        return white_image
+        if s_clip is not None:
+            # Approximate median and MAD from a subsample of wavelengths
+            sample = self.get_section(wave_slice=slice(
+                wave_pixels[0], wave_pixels[-1] + 1, median_step))
+            median = np.nanmedian(sample, axis=0)
+            std_dev = 1.4826 * np.nanmedian(
+                np.abs(sample - median[np.newaxis]), axis=0)
+            del sample
+        weighted_sum = np.zeros((self.n_rows, self.n_cols))
+        weights_sum = np.zeros((self.n_rows, self.n_cols))
+        for start in range(0, wave_pixels.size, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            intensity = self.get_section(wave_slice=slice(
+                wave_pixels[chunk][0], wave_pixels[chunk][-1] + 1))
+            if s_clip is not None:
+                weights = np.abs(intensity - median[np.newaxis]) <= (
+                    s_clip * std_dev[np.newaxis])
+            else:
+                weights = np.ones_like(intensity, dtype=bool)
+            weighted_sum += np.nansum(np.where(
+                weights, intensity * freq_trans[chunk, np.newaxis, np.newaxis],
+                0), axis=0)
+            weights_sum += np.sum(weights, axis=0)
+        return weighted_sum / weights_sum
 
     def to_fits(self, fname=None, primary_hdr_kw=None):
         """Save the Cube into a FITS file."""
@@ -742,6 +1849,47 @@ class Cube(DataContainer):
         self.wcs.wcs.crval[:-1] = updated_wcs.wcs.crval
         self.log('update_coords', "Offset-coords updated")
 
+    def _update_from_stack(self, rss, adr, weight_matrices, remove):
+        if self.incremental_stack is None:
+            raise AttributeError(
+                "Cube does not contain an incremental stack. Build the cube"
+                " using `build_cube(..., incremental=True)`")
+        if remove:
+            self.incremental_stack.remove_rss(rss, adr, weight_matrices)
+        else:
+            self.incremental_stack.add_rss(rss, adr, weight_matrices)
+        self.intensity, self.variance = self.incremental_stack.get_stack()
+
+    def add_rss(self, rss, adr=None, weight_matrices=None):
+        """Interpolate a RSS and include it in the Cube without rebuilding it.
+
+        Only available for cubes built with `build_cube(..., incremental=True)`.
+
+        Parameters
+        ----------
+        - rss: RSS
+            RSS to be included.
+        - adr: tuple, default=None
+            ADR correction along (RA, DEC) in arcsec.
+        - weight_matrices: list, default=None
+            Pre-computed sparse weight matrices (see `get_weight_matrices`).
+        """
+        self._update_from_stack(rss, adr, weight_matrices, remove=False)
+        self.log('incremental_stack',
+                 f"Added RSS {rss.info.get('name', '')}"
+                 f" (n_exposures={self.incremental_stack.n_exposures})")
+
+    def remove_rss(self, rss, adr=None, weight_matrices=None):
+        """Remove a RSS from the Cube without rebuilding it.
+
+        The RSS (and ADR) must be the same used to build the Cube.
+        See `add_rss` for a description of the parameters.
+        """
+        self._update_from_stack(rss, adr, weight_matrices, remove=True)
+        self.log('incremental_stack',
+                 f"Removed RSS {rss.info.get('name', '')}"
+                 f" (n_exposures={self.incremental_stack.n_exposures})")
+
 def make_white_image_from_array(data_array, wavelength=None, **args):
     """Create a white image from a 3D data array."""
     print(f"Creating a Cube of dimensions: {data_array.shape}")
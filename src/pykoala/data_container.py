@@ -9,6 +9,7 @@ from astropy.io.fits import Header, ImageHDU
 from astropy.nddata import bitmask
 
 from pykoala.exceptions.exceptions import NoneAttrError
+from pykoala import config
 
 class LogEntry(object):
     """Log information unit.
@@ -259,10 +260,12 @@ class DataMask(object):
         A mapping between the flag names and their numerical values expressed
         in powers of two.
     - bitmask: (np.ndarray)
-        The array containing the bit pixel mask.
+        The array containing the bit pixel mask. It uses the smallest unsigned
+        integer type that can store every flag (e.g. uint8 for up to 8 flags).
     - masks: dict
-        A dictionary that stores the individual mask in the form of boolean arrays
-        for each flag name.
+        A dictionary that contains the individual mask in the form of boolean
+        arrays for each flag name. The masks are decoded from the bitmask
+        on demand.
     
     Methods
     -------
@@ -275,15 +278,26 @@ class DataMask(object):
             self.flag_map = {"BAD": (2, "Generic bad pixel flag")}
         else:
             self.flag_map = flag_map
-        # Initialise the mask with all pixels being valid
-        self.bitmask = np.zeros(shape, dtype=int)
-        self.masks = {}
-        for key in self.flag_map.keys():
-            self.masks[key] = np.zeros(shape, dtype=bool)
+        # Initialise the mask with all pixels being valid, using the smallest
+        # integer type that can store every flag
+        bitmask_dtype = np.min_scalar_type(
+            np.bitwise_or.reduce(np.array(
+                [value[0] for value in self.flag_map.values()], dtype=int)))
+        self.bitmask = np.zeros(shape, dtype=bitmask_dtype)
+        # Boolean masks decoded from the bitmask
+        self._flag_map_cache = {}
+
+    @property
+    def masks(self):
+        return {key: self.get_flag_map(key) for key in self.flag_map.keys()}
 
     def __decode_bitmask(self, value):
         return np.bitwise_and(self.bitmask, value) > 0
 
+    def clear_cache(self):
+        """Remove the boolean masks decoded from the bitmask."""
+        self._flag_map_cache = {}
+
     def flag_pixels(self, mask, flag_name):
         """Add a pixel mask corresponding to a flag name.
 
@@ -298,12 +312,11 @@ class DataMask(object):
         """
         if flag_name not in self.flag_map:
             raise NameError(f"Input flag name {flag_name} does not exist")
-        # Check that the bitmask does not already contain this flag
-        bit_flag_map = self.get_flag_map_from_bitmask(flag_name)
-        self.bitmask[bit_flag_map] -= self.flag_map[flag_name][0]
-        self.bitmask[mask] += self.flag_map[flag_name][0]
-        # Store the individual boolean map
-        self.masks[flag_name] = mask
+        value = self.bitmask.dtype.type(self.flag_map[flag_name][0])
+        # Remove any previous information of this flag
+        self.bitmask &= ~value
+        self.bitmask[mask] |= value
+        self._flag_map_cache.pop(flag_name, None)
 
     def get_flag_map_from_bitmask(self, flag_name):
         """Get the boolean mask for a given flag name from the bitmask."""
@@ -322,16 +335,20 @@ class DataMask(object):
         Returns
         -------
         - mask: np.ndarray
-            An array containing the boolean values for every pixel.
+            An array containing the boolean values for every pixel. The mask of
+            a single flag is cached and must not be modified.
         """
         if flag_name is not None:
             if type(flag_name) is str:
-                return self.masks[flag_name]
+                if flag_name not in self._flag_map_cache:
+                    self._flag_map_cache[flag_name] = (
+                        self.get_flag_map_from_bitmask(flag_name))
+                return self._flag_map_cache[flag_name]
             else:
-                mask = np.zeros_like(self.bitmask, dtype=bool)
-                for flag in flag_name:
-                    mask |= self.masks[flag]
-                return mask
+                # Decode every flag at once
+                value = np.bitwise_or.reduce(np.array(
+                    [self.flag_map[flag][0] for flag in flag_name], dtype=int))
+                return self.__decode_bitmask(value)
         else:
             return self.bitmask > 0
 
@@ -373,11 +390,16 @@ class DataContainer(object):
     -------
     # TODO
     """
+    _intensity = None
+    _variance = None
 
     def __init__(self, **kwargs):
-        # Data
-        self.intensity = kwargs.get("intensity", None)
-        self.variance = kwargs.get("variance", None)
+        # Data (subclasses that provide their own storage, e.g. lazy Cubes,
+        # may not provide these arguments)
+        if "intensity" in kwargs:
+            self.intensity = kwargs["intensity"]
+        if "variance" in kwargs:
+            self.variance = kwargs["variance"]
         self.intensity_units = kwargs.get("intensity_units", None)
         # Information and masking
         self.info = kwargs.get("info", dict())
@@ -385,7 +407,26 @@ class DataContainer(object):
             self.info = dict()
         self.log = kwargs.get("log", HistoryLog())
         self.fill_info()
-        self.mask = kwargs.get("mask", DataMask(shape=self.intensity.shape))
+        self.mask = kwargs.get("mask", None)
+        if self.mask is None:
+            self.mask = DataMask(shape=self.intensity.shape)
+
+    @property
+    def intensity(self):
+        return self._intensity
+
+    @intensity.setter
+    def intensity(self, intensity):
+        # Keep the floating point precision set in `pykoala.config`
+        self._intensity = config.as_float_array(intensity)
+
+    @property
+    def variance(self):
+        return self._variance
+
+    @variance.setter
+    def variance(self, variance):
+        self._variance = config.as_float_array(variance)
 
     def fill_info(self):
         """Check the keywords of info and fills them with placeholders."""
@@ -412,7 +453,22 @@ class DataContainer(object):
         """Fill a FITS Header with the HistoryLog information."""
         return self.log.dump_to_header(header)
 
-    def copy(self):
-        return copy.deepcopy(self)
+    def copy(self, share_data=False):
+        """Return a copy of the DataContainer.
+
+        Parameters
+        ----------
+        - share_data: bool, default=False
+            If True, the intensity and variance arrays are not copied but
+            shared with the original DataContainer (the rest of attributes,
+            including the mask and the log, are copied). New arrays must be
+            assigned to the copy instead of modifying them in place.
+        """
+        if not share_data:
+            return copy.deepcopy(self)
+        # Arrays already included in the memo are not copied
+        memo = {id(array): array for array in (self.intensity, self.variance)
+                if array is not None}
+        return copy.deepcopy(self, memo)
     
 # Mr Krtxo \(ﾟ▽ﾟ)/
@@ -29,7 +29,7 @@ def qc_throughput(throughput):
     - fig
     """
     if type(throughput) is Throughput:
-        throughput = throughput.throughput_data
+        throughput = throughput.get_throughput_data(expand=True)
 
     fig = plt.figure(figsize=(10, 8))
     gs = fig.add_gridspec(3, 4, wspace=0.15, hspace=0.35)
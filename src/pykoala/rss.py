@@ -12,7 +12,7 @@ from astropy.io import fits
 # KOALA packages
 # =============================================================================
 from pykoala import __version__
-from pykoala.ancillary import vprint
+from pykoala.ancillary import vprint, spectral_centre_of_mass
 from pykoala.data_container import DataContainer
 
 
@@ -73,36 +73,22 @@ class RSS(DataContainer):
             all wavelength points.
         stat: function, default=np.median
             Function to compute the COM over each wavelength range.
-        power: float (default=1.0)
-            Power the intensity to compute the COM.
+        power: float or iterable (default=1.0)
+            Power the intensity to compute the COM. If several powers are
+            provided, all of them are computed in a single pass.
         Returns
         -------
         x_com: np.array(float)
-            Array containing the COM in the x-axis (RA, columns).
+            Array containing the COM in the x-axis (RA, columns). If several
+            powers are provided, it has dimensions (n_power, n_wavelength).
         y_com: np.array(float)
             Array containing the COM in the y-axis (DEC, rows).
         """
         ra = self.info["fib_ra"]
         dec = self.info["fib_dec"]
-        ra_com = np.empty(self.wavelength.size)
-        dec_com = np.empty(self.wavelength.size)
-        for wave_range in range(0, self.wavelength.size, wavelength_step):
-            # Mean across all fibres
-            ra_com[wave_range: wave_range + wavelength_step] = np.nansum(
-                self.intensity[:, wave_range: wave_range +
-                               wavelength_step]**power * ra[:, np.newaxis],
-                axis=0) / np.nansum(self.intensity[:, wave_range: wave_range + wavelength_step]**power,
-                                    axis=0)
-            # Statistic (e.g., median, mean) per wavelength bin
-            ra_com[wave_range: wave_range + wavelength_step] = stat(
-                ra_com[wave_range: wave_range + wavelength_step])
-            dec_com[wave_range: wave_range + wavelength_step] = np.nansum(
-                self.intensity[:, wave_range: wave_range +
-                               wavelength_step]**power * dec[:, np.newaxis],
-                axis=0) / np.nansum(self.intensity[:, wave_range: wave_range + wavelength_step]**power,
-                                    axis=0)
-            dec_com[wave_range: wave_range + wavelength_step] = stat(
-                dec_com[wave_range: wave_range + wavelength_step])
+        ra_com, dec_com = np.moveaxis(spectral_centre_of_mass(
+            self.intensity, np.array([ra, dec]), power=power,
+            wavelength_step=wavelength_step, stat=stat), -2, 0)
         return ra_com, dec_com
 
     def update_coordinates(self, new_coords=None, offset=None):
@@ -0,0 +1,34 @@
+import numpy as np
+
+from pykoala.cubing import build_wcs
+from pykoala.data_container import HistoryLog
+from pykoala.rss import RSS
+
+
+def random_rss(seed=0, n_fibres=300, n_wave=60, radius_arcsec=15.,
+               ra_offset_arcsec=0., nan_fraction=0.):
+    """Create a RSS with random data within a square region of the sky.
+
+    The fibres are uniformly distributed within `radius_arcsec` of the
+    position (RA, DEC) = (10 + ra_offset_arcsec / 3600, -30) degrees.
+    """
+    rng = np.random.default_rng(seed)
+    fib_ra = 10. + (ra_offset_arcsec + rng.uniform(
+        -radius_arcsec, radius_arcsec, n_fibres)) / 3600
+    fib_dec = -30. + rng.uniform(-radius_arcsec, radius_arcsec,
+                                 n_fibres) / 3600
+    intensity = rng.normal(10, 1, (n_fibres, n_wave))
+    intensity[rng.random(intensity.shape) < nan_fraction] = np.nan
+    variance = np.abs(rng.normal(1, .1, (n_fibres, n_wave)))
+    rss = RSS(intensity=intensity, variance=variance,
+              wavelength=np.linspace(4000, 7000, n_wave),
+              info=dict(fib_ra=fib_ra, fib_dec=fib_dec, exptime=100.,
+                        airmass=1.2, name=f'random_{seed}'))
+    rss.log = HistoryLog()
+    return rss
+
+
+def random_wcs(n_wave=60, n_pix=40):
+    """WCS of a cube centred at (RA, DEC) = (10, -30) with 1 arcsec pixels."""
+    return build_wcs((n_wave, n_pix, n_pix), (4000., 10., -30.), 1 / 3600,
+                     3000 / (n_wave - 1))
@@ -0,0 +1,29 @@
+import numpy as np
+
+from pykoala.ancillary import spectral_centre_of_mass
+
+
+def test_spectral_centre_of_mass():
+    rng = np.random.default_rng(0)
+    data = rng.uniform(0, 1, (50, 103))
+    data[3, 10] = np.nan
+    positions = rng.normal(size=(2, 50))
+    com = spectral_centre_of_mass(data, positions, power=[1, 2, 3])
+    for i, power in enumerate([1, 2, 3]):
+        weights = np.nan_to_num(data**power)
+        np.testing.assert_allclose(
+            com[i], positions @ weights / weights.sum(axis=0))
+
+    # Statistics with and without the axis keyword
+    binned = spectral_centre_of_mass(data, positions, power=2,
+                                     wavelength_step=10)
+    no_axis = spectral_centre_of_mass(
+        data, positions, power=2, wavelength_step=10,
+        stat=lambda values: np.nanmedian(values))
+    np.testing.assert_allclose(no_axis, binned)
+    np.testing.assert_allclose(binned[:, :10],
+                               np.nanmedian(com[1, :, :10], axis=-1,
+                                            keepdims=True).repeat(10, -1))
+    np.testing.assert_allclose(binned[:, 100:],
+                               np.nanmedian(com[1, :, 100:], axis=-1,
+                                            keepdims=True).repeat(3, -1))
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from pykoala import config
+from pykoala.corrections.throughput import Throughput, ThroughputCorrection
+from pykoala.corrections.wavelength import (WavelengthOffset,
+                                            WavelengthCorrection)
+from pykoala.cubing import build_cube
+
+from random_data import random_rss, random_wcs
+
+
+def reduce_rss(seed):
+    """Create a RSS, apply some corrections and interpolate it into a cube."""
+    rss = random_rss(seed)
+    rng = np.random.default_rng(seed)
+    throughput = Throughput(throughput_data=rng.uniform(
+        0.8, 1.2, rss.intensity.shape))
+    offset = WavelengthOffset(offset_data=rng.normal(
+        0, 0.3, rss.intensity.shape[0]), n_wavelength=rss.wavelength.size)
+    rss = ThroughputCorrection(throughput=throughput).apply(
+        rss, plot=False, inplace=False)
+    rss = WavelengthCorrection(offset=offset).apply(rss, inplace=False)
+    return rss, build_cube([rss], wcs=random_wcs())
+
+
+def test_float_dtype():
+    """Single precision must be propagated through the reduction."""
+    previous = config.get_float_dtype()
+    rss, cube = reduce_rss(0)
+    try:
+        config.set_float_dtype(np.float32)
+        assert config.get_float_dtype() == np.float32
+        rss_32, cube_32 = reduce_rss(0)
+        for data_32, data in ((rss_32.intensity, rss.intensity),
+                              (rss_32.variance, rss.variance),
+                              (cube_32.intensity, cube.intensity),
+                              (cube_32.variance, cube.variance)):
+            assert data_32.dtype == np.float32
+            np.testing.assert_allclose(data_32, data, rtol=1e-4, atol=1e-6,
+                                       equal_nan=True)
+        with pytest.raises(ValueError):
+            config.set_float_dtype(int)
+    finally:
+        config.set_float_dtype(previous)
+    assert config.get_float_dtype() is previous
+    rss, cube = reduce_rss(0)
+    assert rss.intensity.dtype == np.float64
+    assert cube.intensity.dtype == np.float64
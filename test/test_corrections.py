@@ -0,0 +1,133 @@
+import numpy as np
+
+from pykoala.corrections.atmospheric_corrections import (
+    AtmosphericExtCorrection)
+from pykoala.corrections.correction import CorrectionBase, CorrectionPlan
+from pykoala.corrections.sky import SkyModel, SkySubsCorrection
+from pykoala.corrections.throughput import Throughput, ThroughputCorrection
+from pykoala.corrections.wavelength import (WavelengthOffset,
+                                            WavelengthCorrection)
+
+from pykoala.cubing import build_cube
+
+from random_data import random_rss, random_wcs
+
+
+def test_correction_plan():
+    """Compare a CorrectionPlan with the sequential corrections."""
+    rss = random_rss(n_fibres=20, n_wave=100)
+    throughput = Throughput(throughput_data=np.random.default_rng(1).uniform(
+        0.8, 1.2, rss.intensity.shape))
+    throughput_corr = ThroughputCorrection(throughput=throughput)
+    extinction_corr = AtmosphericExtCorrection()
+
+    sequential = throughput_corr.apply(rss, plot=False, inplace=False)
+    sequential = extinction_corr.apply(sequential, force_airmass=1.5,
+                                       inplace=False)
+    plan = CorrectionPlan().add(throughput_corr).add(extinction_corr,
+                                                     force_airmass=1.5)
+    combined = plan.apply(rss, inplace=False)
+    np.testing.assert_allclose(combined.intensity, sequential.intensity)
+    np.testing.assert_allclose(combined.variance, sequential.variance)
+    # The input RSS is not modified
+    assert not np.allclose(rss.intensity, combined.intensity)
+
+
+def test_compact_products(tmp_path):
+    """Compare the compact and full forms of the correction products."""
+    rss = random_rss(n_fibres=20, n_wave=100)
+    n_fibres, n_wave = rss.intensity.shape
+    rng = np.random.default_rng(2)
+
+    fibre_throughput = rng.normal(1, 0.05, n_fibres)
+    full = Throughput(throughput_data=np.repeat(
+        fibre_throughput[:, np.newaxis], n_wave, axis=1))
+    compact = Throughput(throughput_data=fibre_throughput,
+                         n_wavelength=n_wave)
+    expected = ThroughputCorrection(throughput=full).apply(
+        rss, plot=False, inplace=False)
+    corrected = ThroughputCorrection(throughput=compact).apply(
+        rss, plot=False, inplace=False)
+    np.testing.assert_allclose(corrected.intensity, expected.intensity)
+    np.testing.assert_allclose(corrected.variance, expected.variance)
+    # The compact form is expanded when saved
+    compact.tofits(str(tmp_path / "throughput.fits"))
+    loaded = Throughput(path=str(tmp_path / "throughput.fits"))
+    np.testing.assert_allclose(loaded.get_throughput_data(expand=True),
+                               full.get_throughput_data(expand=True))
+
+    poly = np.zeros((n_fibres, 3))
+    poly[:, 0] = fibre_throughput
+    poly[:, 1] = 0.01
+    from_poly = Throughput(throughput_poly=poly, n_wavelength=n_wave)
+    expanded = Throughput(
+        throughput_data=from_poly.get_throughput_data(expand=True))
+    np.testing.assert_allclose(
+        ThroughputCorrection(throughput=from_poly).apply(
+            rss, plot=False, inplace=False).intensity,
+        ThroughputCorrection(throughput=expanded).apply(
+            rss, plot=False, inplace=False).intensity)
+
+    fibre_offset = rng.normal(0, 0.3, n_fibres)
+    full = WavelengthOffset(offset_data=np.repeat(
+        fibre_offset[:, np.newaxis], n_wave, axis=1))
+    compact = WavelengthOffset(offset_data=fibre_offset, n_wavelength=n_wave,
+                               offset_error=np.abs(fibre_offset))
+    expected = WavelengthCorrection(offset=full).apply(rss, inplace=False)
+    corrected = WavelengthCorrection(offset=compact).apply(rss, inplace=False)
+    np.testing.assert_allclose(corrected.intensity, expected.intensity)
+    np.testing.assert_allclose(corrected.variance, expected.variance)
+    compact.tofits(str(tmp_path / "offset.fits"))
+    loaded = WavelengthOffset(path=str(tmp_path / "offset.fits"))
+    np.testing.assert_allclose(loaded.get_offset_data(expand=True),
+                               full.get_offset_data(expand=True))
+    assert loaded.get_offset_error(expand=True).shape == (n_fibres, n_wave)
+
+
+def test_inplace(monkeypatch):
+    """By default, corrections must not modify the input DataContainer."""
+    rss = random_rss(n_fibres=20, n_wave=100)
+    n_fibres, n_wave = rss.intensity.shape
+    rng = np.random.default_rng(3)
+    sky_model = SkyModel(wavelength=rss.wavelength,
+                         intensity=rng.uniform(1, 2, n_wave),
+                         variance=np.full(n_wave, 0.1))
+    corrections = [
+        (ThroughputCorrection(throughput=Throughput(
+            throughput_data=rng.uniform(0.8, 1.2, (n_fibres, n_wave)))),
+         dict(plot=False)),
+        (AtmosphericExtCorrection(), dict(force_airmass=1.5)),
+        (WavelengthCorrection(offset=WavelengthOffset(
+            offset_data=rng.normal(0, 0.3, n_fibres), n_wavelength=n_wave)),
+         dict()),
+        (SkySubsCorrection(sky_model), dict(verbose=False))]
+    cube = build_cube([random_rss()], wcs=random_wcs())
+
+    def apply(correction, dc, **kwargs):
+        dc_out = correction.apply(dc, **kwargs)
+        if isinstance(correction, SkySubsCorrection):
+            dc_out, _ = dc_out
+        return dc_out
+
+    for dc, dc_corrections in ((rss, corrections),
+                               (cube, corrections[1:2])):
+        for correction, kwargs in dc_corrections:
+            intensity, variance = dc.intensity.copy(), dc.variance.copy()
+            dc_out = apply(correction, dc, **kwargs)
+            assert dc_out is not dc
+            assert not np.allclose(dc_out.intensity, intensity,
+                                   equal_nan=True)
+            np.testing.assert_array_equal(dc.intensity, intensity)
+            np.testing.assert_array_equal(dc.variance, variance)
+            # The input is modified when applied in place, either per call
+            # or for every correction
+            for inplace_kwargs in (dict(inplace=True), dict()):
+                dc_copy = dc.copy()
+                with monkeypatch.context() as context:
+                    if not inplace_kwargs:
+                        context.setattr(CorrectionBase, "inplace", True)
+                    dc_inplace = apply(correction, dc_copy, **kwargs,
+                                       **inplace_kwargs)
+                assert dc_inplace is dc_copy
+                np.testing.assert_allclose(dc_copy.intensity, dc_out.intensity,
+                                           equal_nan=True)
@@ -0,0 +1,260 @@
+import os
+import tempfile
+
+import numpy as np
+
+from pykoala import ancillary
+from pykoala.cubing import (build_cube, build_cube_tiled, Cube, CubeStacking,
+                            DrizzlingKernel, GaussianKernel, ParabolicKernel,
+                            TopHatKernel, stack_in_wavelength_slabs,
+                            STACKING_MEMORY_FACTOR)
+
+from random_data import random_rss, random_wcs
+
+
+def test_sparse_interpolation():
+    """Compare the sparse weight-matrix engine with the per-fibre loop."""
+    wcs = random_wcs()
+    rss_set = [random_rss(seed, nan_fraction=0.01) for seed in range(2)]
+    n_wave = rss_set[0].wavelength.size
+    adr = np.linspace(-0.8, 0.8, n_wave)
+    adr_set = [(adr, -adr), (None, None)]
+    loop = build_cube(rss_set, wcs=wcs, adr_set=adr_set)
+    sparse = build_cube(rss_set, wcs=wcs, adr_set=adr_set, sparse=True)
+    np.testing.assert_allclose(sparse.intensity, loop.intensity,
+                               rtol=1e-10, atol=1e-14, equal_nan=True)
+    np.testing.assert_allclose(sparse.variance, loop.variance,
+                               rtol=1e-10, atol=1e-14, equal_nan=True)
+
+
+def test_drizzling_kernel():
+    """Compare the drizzling weights with the area of each pixel in the fibre.
+
+    The grid is not square, so that the weights of the pixel (i, j) must
+    correspond to the edges x_edges[i] and y_edges[j] (the former per-pixel
+    loop filled the weights in the wrong order for non-square grids).
+    """
+    kernel = DrizzlingKernel(scale=3.0, pixel_scale_arcsec=1.0)
+    x_edges = np.arange(-3, 4) - 0.3
+    y_edges = np.arange(-2, 3) + 0.2
+    weights = kernel.kernel_2D(x_edges, y_edges)
+    assert weights.shape == (x_edges.size - 1, y_edges.size - 1)
+
+    expected = np.zeros_like(weights)
+    for i in range(x_edges.size - 1):
+        for j in range(y_edges.size - 1):
+            _, expected[i, j] = ancillary.pixel_in_circle(
+                (x_edges[i], y_edges[j]), pixel_size=1, circle_pos=(0, 0),
+                circle_radius=kernel.scale / 2)
+    np.testing.assert_allclose(weights, expected, atol=1e-12)
+    np.testing.assert_allclose(weights.sum(), 1.0)
+
+
+def test_cached_kernel():
+    """Compare the tabulated kernel weights with the direct evaluation."""
+    for kernel_class in (GaussianKernel, ParabolicKernel, TopHatKernel,
+                         DrizzlingKernel):
+        kernel = kernel_class(scale=2.0, truncation_radius=2.0,
+                              pixel_scale_arcsec=1.0, phase_resolution=10)
+        # Offsets on the phase grid are not displaced
+        x_edges = np.arange(-4, 5) - 0.3
+        y_edges = np.arange(-3, 3) + 0.2
+        weights = kernel.cached_kernel_2D(x_edges, y_edges)
+        np.testing.assert_allclose(weights, kernel.kernel_2D(x_edges, y_edges),
+                                   atol=1e-12)
+        assert not weights.flags.writeable
+        # Other offsets are quantised to the nearest phase
+        np.testing.assert_allclose(
+            kernel.cached_kernel_2D(x_edges + 0.04, y_edges - 0.03), weights,
+            atol=1e-12)
+        # Edges outside the table use the direct evaluation
+        x_edges = np.arange(-30, 5) + 0.123
+        np.testing.assert_array_equal(
+            kernel.cached_kernel_2D(x_edges, y_edges),
+            kernel.kernel_2D(x_edges, y_edges))
+        # The table converges to the direct evaluation
+        x_edges = np.arange(-4, 5) + 0.123
+        y_edges = np.arange(-3, 3) - 0.377
+        expected = kernel.kernel_2D(x_edges, y_edges)
+        errors = []
+        for resolution in (4, 16, 64):
+            kernel = kernel_class(scale=2.0, truncation_radius=2.0,
+                                  pixel_scale_arcsec=1.0,
+                                  phase_resolution=resolution)
+            errors.append(np.abs(kernel.cached_kernel_2D(x_edges, y_edges)
+                                 - expected).max())
+        assert errors[2] < errors[0]
+        assert errors[2] < 0.05 * expected.max()
+
+    wcs = random_wcs()
+    rss_set = [random_rss(seed) for seed in range(2)]
+    cube = build_cube(rss_set, wcs=wcs)
+    cached_cube = build_cube(rss_set, wcs=wcs, kernel_phase_resolution=64)
+    # Intensities are ~0.1 (counts per second)
+    np.testing.assert_allclose(cached_cube.intensity, cube.intensity,
+                               rtol=1e-3, atol=1e-4, equal_nan=True)
+
+
+def test_white_image():
+    """Compare the chunked white image with a direct computation."""
+    cube = build_cube([random_rss(0, nan_fraction=0.01)], wcs=random_wcs())
+    intensity = cube.intensity[10:40]
+    expected = np.nanmean(intensity, axis=0)
+    wave_range = cube.wavelength[[10, 39]]
+    for kwargs in (dict(), dict(chunk_size=3), dict(median_step=2)):
+        white = cube.get_white_image(wave_range=wave_range, s_clip=None,
+                                     **kwargs)
+        np.testing.assert_allclose(white, expected, equal_nan=True)
+    # Wavelength range outside the cube
+    white = cube.get_white_image(wave_range=[8000, 9000])
+    assert white.shape == cube.intensity.shape[1:]
+    assert np.isnan(white).all()
+
+
+def test_lazy_cube(tmp_path):
+    """A lazy cube must read sections without loading the full data."""
+    cube = build_cube([random_rss(0, nan_fraction=0.01)], wcs=random_wcs())
+    path = str(tmp_path / "cube.fits")
+    cube.to_fits(path)
+    lazy_cube = Cube(file_path=path, lazy=True)
+    try:
+        wave_range = cube.wavelength[[10, 39]]
+        for kwargs in (dict(), dict(median_step=2)):
+            np.testing.assert_allclose(
+                lazy_cube.get_white_image(wave_range=wave_range, **kwargs),
+                cube.get_white_image(wave_range=wave_range, **kwargs),
+                equal_nan=True)
+        for extension in ("INTENSITY", "VARIANCE"):
+            np.testing.assert_allclose(
+                lazy_cube.get_spectrum(20, 15, extension=extension),
+                cube.get_spectrum(20, 15, extension=extension),
+                equal_nan=True)
+        assert not lazy_cube.is_loaded("INTENSITY")
+        assert not lazy_cube.is_loaded("VARIANCE")
+        # Accessing the full data switches to the in-memory arrays
+        np.testing.assert_allclose(lazy_cube.intensity, cube.intensity,
+                                   equal_nan=True)
+        assert lazy_cube.is_loaded("INTENSITY")
+        np.testing.assert_allclose(lazy_cube.get_spectrum(20, 15),
+                                   cube.get_spectrum(20, 15), equal_nan=True)
+    finally:
+        lazy_cube.close_hdul()
+
+
+def test_incremental_mosaic():
+    """Compare the incremental stack with build_cube on a partial mosaic."""
+    wcs = random_wcs(n_wave=50, n_pix=50)
+    rss_1 = random_rss(1, n_wave=50, ra_offset_arcsec=-8.)
+    rss_2 = random_rss(2, n_wave=50, ra_offset_arcsec=8.)
+    cube = build_cube([rss_1, rss_2], wcs=wcs)
+    cube_1 = build_cube([rss_1], wcs=wcs)
+    cube_2 = build_cube([rss_2], wcs=wcs)
+    incremental = build_cube([rss_1, rss_2], wcs=wcs, incremental=True)
+
+    n_cubes = incremental.incremental_stack.n_cubes
+    assert (n_cubes == 2).any() and (n_cubes == 1).any()
+    assert (n_cubes == 0).any()
+    # Regions covered by both pointings
+    overlap = n_cubes == 2
+    np.testing.assert_allclose(incremental.intensity[overlap],
+                               cube.intensity[overlap], rtol=1e-10)
+    np.testing.assert_allclose(incremental.variance[overlap],
+                               cube.variance[overlap], rtol=1e-10)
+    # Regions covered by a single pointing must not be diluted
+    for single_cube in (cube_1, cube_2):
+        single = (n_cubes == 1) & (single_cube.variance > 0)
+        np.testing.assert_allclose(incremental.intensity[single],
+                                   single_cube.intensity[single], rtol=1e-10)
+        np.testing.assert_allclose(incremental.variance[single],
+                                   single_cube.variance[single], rtol=1e-10)
+    # Regions without data
+    assert np.isnan(incremental.intensity[n_cubes == 0]).all()
+
+    # Add and remove pointings from the stack
+    updated = build_cube([rss_1], wcs=wcs, incremental=True)
+    updated.add_rss(rss_2)
+    np.testing.assert_allclose(updated.intensity, incremental.intensity,
+                               rtol=1e-10, equal_nan=True)
+    np.testing.assert_allclose(updated.variance, incremental.variance,
+                               rtol=1e-10, equal_nan=True)
+    updated.remove_rss(rss_2)
+    covered = updated.incremental_stack.n_cubes > 0
+    np.testing.assert_allclose(updated.intensity[covered],
+                               cube_1.intensity[covered], rtol=1e-8)
+    np.testing.assert_allclose(updated.variance[covered],
+                               cube_1.variance[covered], rtol=1e-8)
+    assert np.isnan(updated.intensity[~covered]).all()
+
+
+def test_tiled_cube():
+    """Compare the tiled cube with build_cube for uneven tile shapes."""
+    wcs = random_wcs()
+    rss_set = [random_rss(seed, nan_fraction=0.01) for seed in range(2)]
+    cube = build_cube(rss_set, wcs=wcs)
+    for tile_shape, n_tile_workers in ((13, None), ((16, 9), None),
+                                       (13, 2)):
+        tiled = build_cube_tiled(rss_set, wcs=wcs, tile_shape=tile_shape,
+                                 n_tile_workers=n_tile_workers)
+        np.testing.assert_allclose(tiled.intensity, cube.intensity,
+                                   rtol=1e-10, atol=1e-14, equal_nan=True)
+        np.testing.assert_allclose(tiled.variance, cube.variance,
+                                   rtol=1e-10, atol=1e-14, equal_nan=True)
+
+
+def shared_memory_segments():
+    if not os.path.isdir("/dev/shm"):
+        return set()
+    return set(os.listdir("/dev/shm"))
+
+
+def test_cube_storage(tmp_path, monkeypatch):
+    """Compare parallel and out-of-core cubing with the default build."""
+    wcs = random_wcs()
+    rss_set = [random_rss(seed, nan_fraction=0.01) for seed in range(3)]
+    cube = build_cube(rss_set, wcs=wcs)
+    # Scratch files created in the system temporary directory
+    temp_dir = tmp_path / "tmp"
+    temp_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temp_dir))
+    scratch_dir = tmp_path / "scratch"
+    scratch_dir.mkdir()
+    segments = shared_memory_segments()
+    for kwargs in (dict(n_workers=2), dict(scratch_dir=str(scratch_dir)),
+                   dict(max_memory_gb=1e-4),
+                   dict(n_workers=2, max_memory_gb=1e-4)):
+        other = build_cube(rss_set, wcs=wcs, **kwargs)
+        np.testing.assert_allclose(other.intensity, cube.intensity,
+                                   rtol=1e-10, atol=1e-14, equal_nan=True)
+        np.testing.assert_allclose(other.variance, cube.variance,
+                                   rtol=1e-10, atol=1e-14, equal_nan=True)
+    # Nothing is left behind
+    assert shared_memory_segments() == segments
+    assert not any(temp_dir.iterdir())
+    assert not any(scratch_dir.iterdir())
+
+
+def test_chunked_stacking():
+    """Stacking in wavelength slabs must match the full stacking."""
+    rng = np.random.default_rng(0)
+    cubes = rng.normal(10, 1, (4, 23, 8, 9))
+    cubes[rng.random(cubes.shape) < 0.01] = np.nan
+    cubes[1, :, 3, 4] += 20
+    variances = np.abs(rng.normal(1, .1, cubes.shape))
+    for method, chunked in (
+            (CubeStacking.sigma_clipping, CubeStacking.sigma_clipping_chunked),
+            (CubeStacking.mad_clipping, CubeStacking.mad_clipping_chunked)):
+        expected = method(cubes, variances, nsigma=2.)
+        for n_threads in (None, 2):
+            for result in (
+                    chunked(cubes, variances, slab_size=5,
+                            n_threads=n_threads, nsigma=2.),
+                    stack_in_wavelength_slabs(
+                        method, cubes, variances, slab_size=5,
+                        n_threads=n_threads, nsigma=2.),
+                    stack_in_wavelength_slabs(
+                        method, cubes, variances,
+                        memory_budget=7 * STACKING_MEMORY_FACTOR
+                        * cubes[:, 0].nbytes,
+                        n_threads=n_threads, nsigma=2.)):
+                for stacked, full in zip(result, expected):
+                    np.testing.assert_array_equal(stacked, full)
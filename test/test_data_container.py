@@ -0,0 +1,35 @@
+import numpy as np
+
+from pykoala.data_container import DataMask
+
+
+def test_bitmask_round_trip():
+    """Compare the bitmask decoding with the individual boolean masks."""
+    rng = np.random.default_rng(0)
+    flag_map = {"BAD": (2, "Bad pixel"), "CR": (4, "Cosmic ray"),
+                "SAT": (8, "Saturated pixel")}
+    shape = (30, 40)
+    mask = DataMask(shape, flag_map=flag_map)
+    assert mask.bitmask.dtype == np.uint8
+    boolean_masks = {}
+    for flag in ["BAD", "CR", "SAT", "CR"]:
+        # Flagging the same layer again overrides the previous values
+        boolean_masks[flag] = rng.random(shape) < 0.2
+        mask.flag_pixels(boolean_masks[flag], flag)
+
+    for flag, boolean_mask in boolean_masks.items():
+        np.testing.assert_array_equal(mask.get_flag_map(flag), boolean_mask)
+        np.testing.assert_array_equal(mask.masks[flag], boolean_mask)
+    np.testing.assert_array_equal(
+        mask.get_flag_map(["BAD", "SAT"]),
+        boolean_masks["BAD"] | boolean_masks["SAT"])
+    np.testing.assert_array_equal(
+        mask.get_flag_map(),
+        boolean_masks["BAD"] | boolean_masks["CR"] | boolean_masks["SAT"])
+
+    # Decode the mask stored in the HDU
+    hdu = mask.dump_to_hdu()
+    for flag, boolean_mask in boolean_masks.items():
+        value = hdu.header[f"FLAG_{flag}"]
+        assert value == flag_map[flag][0]
+        np.testing.assert_array_equal(hdu.data & value > 0, boolean_mask)
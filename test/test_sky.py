@@ -0,0 +1,266 @@
+import numpy as np
+from astropy import units as u
+
+from pykoala.corrections import sky
+from pykoala.cubing import build_cube
+from pykoala.rss import RSS
+from pykoala.corrections.sky import (BackgroundEstimator, ContinuumEstimator,
+                                     SkyFromObject, SkyModel, SkyPCA,
+                                     WaveletFilter, batched_weighted_lstsq)
+
+from random_data import random_rss, random_wcs
+
+
+def test_batched_weighted_lstsq_singular():
+    """Singular spectra must not prevent solving the rest of the batch."""
+    design = np.zeros((10, 3))
+    design[0:5, 0] = 1.
+    design[3:8, 1] = 1.
+    design[8:, 2] = 1.
+    rng = np.random.default_rng(0)
+    coefficients = rng.uniform(1, 10, (6, 3))
+    data = coefficients @ design.T
+    weights = rng.uniform(0.5, 2, data.shape)
+    # The first two columns are degenerate for this spectrum
+    weights[2] = 0
+    weights[2, 3:5] = 1
+    result = batched_weighted_lstsq(design, data, weights, chunk_size=4)
+    assert np.isnan(result[2]).all()
+    valid = np.arange(data.shape[0]) != 2
+    np.testing.assert_allclose(result[valid], coefficients[valid])
+
+
+def test_fit_emission_lines_linear():
+    rng = np.random.default_rng(0)
+    sky_model = SkyModel(wavelength=np.linspace(6000, 7000, 1024))
+    sky_model.sky_lines = np.linspace(6010, 6990, 50)
+    sky_model.sky_lines_fwhm = np.full(50, 2.)
+    amplitudes = rng.uniform(1, 100, 50)
+    line_matrix = sky_model.get_emission_line_matrix(truncation=np.inf)
+    intensity = line_matrix @ amplitudes
+    variance = rng.uniform(0.5, 2, (3, intensity.size))
+
+    # Compare each weighted spectrum with a direct least-squares solution
+    fit_amplitudes, _ = sky_model.fit_emission_lines_linear(
+        np.tile(intensity, (3, 1)), variance, truncation=np.inf)
+    for i in range(variance.shape[0]):
+        sqrt_w = 1 / np.sqrt(variance[i])
+        expected = np.linalg.lstsq(line_matrix * sqrt_w[:, np.newaxis],
+                                   intensity * sqrt_w, rcond=None)[0]
+        np.testing.assert_allclose(fit_amplitudes[i], expected, rtol=1e-8)
+
+    # Linear option of the Levenberg-Marquardt fit interface
+    sky_model.intensity = line_matrix @ amplitudes
+    model, emission = sky_model.fit_emission_lines(method='linear',
+                                                   truncation=np.inf)
+    np.testing.assert_allclose(emission, sky_model.intensity, atol=1e-8)
+    np.testing.assert_allclose(
+        model(sky_model.wavelength, model_set_axis=False).sum(axis=0),
+        emission, atol=1e-8)
+    # Set of spectra
+    models, emission = sky_model.fit_emission_lines(
+        method='linear', intensity=np.tile(intensity, (3, 1)),
+        variance=variance, truncation=np.inf)
+    assert len(models) == 3 and emission.shape == variance.shape
+    for model, spectrum in zip(models, emission):
+        np.testing.assert_allclose(spectrum, intensity, atol=1e-8)
+        np.testing.assert_allclose(
+            model(sky_model.wavelength, model_set_axis=False).sum(axis=0),
+            spectrum, atol=1e-8)
+
+
+def test_approximate_quantiles():
+    """Compare the histogram-based quantiles with np.nanquantile."""
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(300, 200)).astype(np.float32)
+    data[rng.random(data.shape) < 0.05] = np.nan
+    view, out_shape = BackgroundEstimator._reduction_view(data, axis=0)
+    assert view.dtype == data.dtype and out_shape == (200,)
+    quantiles = [0., .16, .5, .84, 1.]
+    values = BackgroundEstimator._histogram_quantiles(data.T, quantiles,
+                                                      n_bins=100, n_iter=3)
+    expected = np.nanquantile(data, quantiles, axis=0)
+    np.testing.assert_allclose(values, expected, atol=1e-5)
+
+    background, sigma = BackgroundEstimator.approx_percentile(data, axis=0)
+    plow, median, pup = np.nanpercentile(data, [16, 50, 84], axis=0)
+    np.testing.assert_allclose(background, median, atol=1e-3)
+    np.testing.assert_allclose(sigma, (pup - plow) / 2, atol=1e-3)
+
+
+def loop_lower_envelope(x, y, min_separation):
+    """Former implementation of `ContinuumEstimator.lower_envelope`."""
+    y = y.copy()
+    y[np.isnan(y)] = np.inf
+    valleys = []
+    for i in range(min_separation, y.size - min_separation - 1):
+        if np.argmin(y[i - min_separation:i + min_separation + 1]
+                     ) == min_separation:
+            valleys.append(i)
+    y[~np.isfinite(y)] = np.nan
+    continuum = np.fmin(y, np.interp(x, x[valleys], y[valleys]))
+    offset = y - continuum
+    offset = np.nanpercentile(offset[offset > 0], np.linspace(1, 50, 51))
+    density = (np.arange(offset.size) + 1) / offset
+    offset = np.median(offset[density > np.max(density) / 2])
+    return continuum + offset, offset
+
+
+def test_lower_envelope():
+    """Compare the vectorised lower envelope with the per-pixel loop."""
+    rng = np.random.default_rng(1)
+    x = np.linspace(6000, 7000, 2048)
+    for min_separation in (1, 2, 5, 10, 11):
+        # Rounded values to include ties
+        y = np.round(rng.normal(10, 2, (20, x.size)), 1)
+        y[:, 100:130] = np.nan
+        y[3, 500] = np.inf
+        continuum, offset = ContinuumEstimator.lower_envelope_2d(
+            x, y, min_separation)
+        for i in range(y.shape[0]):
+            expected_continuum, expected_offset = loop_lower_envelope(
+                x, y[i], min_separation)
+            np.testing.assert_allclose(continuum[i], expected_continuum,
+                                       rtol=1e-12, equal_nan=True)
+            np.testing.assert_allclose(offset[i], expected_offset,
+                                       rtol=1e-12)
+        single, _ = ContinuumEstimator.lower_envelope(x, y[0], min_separation)
+        np.testing.assert_allclose(single, continuum[0], equal_nan=True)
+
+
+def test_uves_sky_lines_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYKOALA_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(sky, "_uves_sky_lines_memo", {})
+    lines = sky.uves_sky_lines(use_cache=False)
+    cached = sky.uves_sky_lines()
+    assert len(list(tmp_path.glob("uves_sky_lines_*.npz"))) == 1
+    # The in-memory list is used without reading the tables again
+    monkeypatch.setattr(sky.hashlib, "sha1", None)
+    memo = sky.uves_sky_lines()
+    for parsed, from_cache, from_memo in zip(lines, cached, memo):
+        np.testing.assert_array_equal(from_cache, parsed)
+        np.testing.assert_array_equal(from_memo, parsed)
+    assert np.all(np.diff(lines[0]) >= 0)
+
+
+def test_wavelet_filter():
+    """Check the fibre blocks and precision of WaveletFilter."""
+    rng = np.random.default_rng(0)
+    n_fibres = 60
+    wavelength = np.linspace(6000, 7000, 2048)
+    lines = rng.uniform(6050, 6950, 60)
+    shifts = rng.normal(0, 0.3, n_fibres)
+    throughput = rng.normal(1, 0.05, n_fibres)
+    intensity = np.array([
+        t * (5 + np.sum(80 * np.exp(-0.5 * (
+            (wavelength[np.newaxis] - shift - lines[:, np.newaxis]) / 1.5)**2),
+            axis=0)) for t, shift in zip(throughput, shifts)])
+    intensity += rng.normal(0, 1, intensity.shape)
+    intensity[3, 100:120] = np.nan
+    rss = RSS(intensity=intensity, variance=np.ones_like(intensity),
+              wavelength=wavelength * u.AA)
+
+    reference = WaveletFilter(rss, block_size=n_fibres, dtype=np.float64)
+    blocks = WaveletFilter(rss, block_size=7, dtype=np.float32)
+    assert blocks.filtered.dtype == np.float32
+    assert blocks.scale == reference.scale
+    np.testing.assert_allclose(blocks.fibre_throughput,
+                               reference.fibre_throughput, atol=1e-5)
+    np.testing.assert_allclose(blocks.fibre_offset, reference.fibre_offset,
+                               atol=1e-5)
+    np.testing.assert_allclose(blocks.sky, reference.sky,
+                               atol=1e-5 * np.nanmax(np.abs(reference.sky)))
+    # The injected offsets are recovered
+    assert np.corrcoef(blocks.fibre_offset, shifts)[0, 1] > 0.99
+
+
+def test_streaming_pca():
+    """Compare the streaming PCA with the SVD of all the exposures."""
+    rng = np.random.default_rng(0)
+    wavelength = np.arange(512)
+    basis = np.array([np.exp(-0.5 * (
+        (wavelength[:, np.newaxis] - rng.uniform(0, 512, 20)) / 2)**2)
+        @ rng.uniform(0, 50, 20) for _ in range(4)])
+    basis += np.array([1, 0.5, 0.2, 0.1])[:, np.newaxis]
+
+    def exposure(n_fibres=100):
+        coeffs = rng.normal(1, 0.3, (n_fibres, 4)) * np.array([10, 3, 2, 1])
+        return coeffs @ basis + rng.normal(0, 0.5, (n_fibres, 512))
+
+    exposures = [exposure() for _ in range(5)]
+    pca = SkyPCA(n_components=6, random_state=0).fit_exposures(
+        (data for data in exposures))
+    data = np.vstack(exposures)
+    mean = data.mean(axis=0)
+    _, singular_values, components = np.linalg.svd(data - mean,
+                                                   full_matrices=False)
+    np.testing.assert_allclose(pca.mean, mean, atol=1e-10)
+    np.testing.assert_allclose(pca.singular_values[:4], singular_values[:4],
+                               rtol=1e-6)
+    # Same subspace spanned by the main components
+    np.testing.assert_allclose(
+        np.linalg.svd(pca.components[:4] @ components[:4].T)[1], 1,
+        rtol=1e-6)
+
+    # Sky subtraction of a new exposure leaves only the noise
+    sky_model = SkyModel(wavelength=wavelength, pca=pca)
+    residuals, _ = sky_model.substract_pca(
+        exposure(), np.full((100, 512), 0.25))
+    assert np.nanstd(residuals) < 0.6
+
+
+def test_sky_model_verbose(capsys):
+    wavelength = np.linspace(6000, 7000, 1024)
+    SkyModel(wavelength=wavelength, verbose=False).load_sky_lines()
+    assert capsys.readouterr().out == ""
+    SkyModel(wavelength=wavelength, verbose=True).load_sky_lines()
+    assert "[SkyModel]" in capsys.readouterr().out
+
+
+def test_load_sky_lines_memo(tmp_path, monkeypatch):
+    """Modified tables and different wavelength grids are reloaded."""
+    monkeypatch.setattr(sky, "_sky_lines_memo", {})
+    table = tmp_path / "sky_lines.txt"
+    np.savetxt(table, [[6100., 1., 10.], [6500., 1., 20.]])
+    wavelength = np.linspace(6000, 7000, 1024)
+    sky_model = SkyModel(wavelength=wavelength, verbose=False)
+    sky_model.load_sky_lines(str(table), lines_pct=0)
+    np.testing.assert_array_equal(sky_model.sky_lines, [6100., 6500.])
+
+    np.savetxt(table, [[6200., 1., 10.], [6600., 1., 20.], [6800., 1., 5.]])
+    sky_model.load_sky_lines(str(table), lines_pct=0)
+    np.testing.assert_array_equal(sky_model.sky_lines, [6200., 6600., 6800.])
+
+    # Non-linear grid with the same size, limits and first step
+    distorted = wavelength.copy()
+    distorted[2:-1] = np.linspace(distorted[2], 6750, distorted.size - 3)
+    SkyModel(wavelength=distorted, verbose=False).load_sky_lines(
+        str(table), lines_pct=0)
+    assert len(sky._sky_lines_memo) == 3
+
+
+def test_sky_from_object_chunked():
+    """The chunked background of a Cube must match the full estimation."""
+    cube = build_cube([random_rss(0)], wcs=random_wcs(n_pix=20))
+    sky_lines = np.zeros(cube.n_wavelength)
+    sky_lines[[10, 30, 45]] = 5.
+    intensity = cube.intensity + sky_lines[:, np.newaxis, np.newaxis]
+    # Bright source at the centre of the cube
+    intensity[:, 8:12, 8:12] += 20.
+    cube.intensity = intensity
+    for estimator in ("mad", "percentile"):
+        # Without source masking both methods use the same pixels
+        model = SkyFromObject(cube, bckgr_estimator=estimator,
+                              source_mask_nsigma=None)
+        chunked = SkyFromObject(cube, bckgr_estimator=estimator,
+                                source_mask_nsigma=None, chunk_size=7)
+        np.testing.assert_array_equal(chunked.intensity, model.intensity)
+        np.testing.assert_array_equal(chunked.variance, model.variance)
+        # The chunked method masks the source spaxels using the white image
+        model = SkyFromObject(cube, bckgr_estimator=estimator)
+        chunked = SkyFromObject(cube, bckgr_estimator=estimator,
+                                chunk_size=7)
+        np.testing.assert_allclose(chunked.intensity, model.intensity,
+                                   rtol=1e-3)
+        np.testing.assert_allclose(chunked.variance, model.variance,
+                                   rtol=1e-2)
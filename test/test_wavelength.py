@@ -0,0 +1,41 @@
+import numpy as np
+
+from pykoala.ancillary import (flux_conserving_interpolation,
+                               flux_conserving_interpolation_2d)
+from pykoala.corrections.wavelength import (WavelengthOffset,
+                                            WavelengthCorrection)
+
+from random_data import random_rss
+
+
+def test_batched_interpolation():
+    """Compare the batched interpolation with the per-fibre implementation."""
+    rss = random_rss(n_fibres=20, n_wave=100)
+    offset = np.random.default_rng(1).uniform(-2, 2, (rss.intensity.shape[0],
+                                                      1))
+    x = np.arange(rss.wavelength.size)
+    intensity, variance = flux_conserving_interpolation_2d(
+        x, x - offset, rss.intensity, rss.variance)
+    for i in range(rss.intensity.shape[0]):
+        np.testing.assert_allclose(
+            intensity[i],
+            flux_conserving_interpolation(x, x - offset[i], rss.intensity[i]),
+            rtol=1e-10, atol=1e-12)
+
+
+def test_operator_cache():
+    """The cached operator must follow in-place changes of the offset."""
+    rss = random_rss(n_fibres=20, n_wave=100)
+    n_fibres, n_wave = rss.intensity.shape
+    offset = WavelengthOffset(offset_data=np.full((n_fibres, n_wave), 0.5))
+    correction = WavelengthCorrection(offset=offset)
+    first = correction.apply(rss, inplace=False)
+
+    offset.offset_data *= -1
+    second = correction.apply(rss, inplace=False)
+    expected = WavelengthCorrection(offset=WavelengthOffset(
+        offset_data=np.full((n_fibres, n_wave), -0.5))).apply(
+            rss, inplace=False)
+    assert not np.allclose(first.intensity, second.intensity)
+    np.testing.assert_allclose(second.intensity, expected.intensity)
+    np.testing.assert_allclose(second.variance, expected.variance)